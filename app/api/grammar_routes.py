@@ -1,63 +1,61 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Response
 from typing import List, Dict, Any
 from app.models.schemas_step2 import GrammarRequest, GrammarResponse
-from app.core.step2_orchestrator import run_step2
-from app.core.gemini_client import Step2Gemini
-from app.core.csv_store import append_row, should_review
+from app.core.step2_orchestrator import arun_step2
+from app.core.step2_backends import get_backend
+from app.core.csv_store import hitl_row
+from app.core.hitl_queue import get_queue
+from app.core.step2_cache import get_default_cache
+from app.core.rate_limit import get_scheduler
+from app.core.deadline import Deadline
+from app.core.metrics import timed
+from app.core.prompt_compaction import SAVED_TOKENS_HEADER, compaction_report
+from app.api.metadata_routes import resolve_metadata
 
 router = APIRouter()
-_gemini = Step2Gemini()
 
 @router.post("/step2", response_model=GrammarResponse)
-def refine_grammar(req: GrammarRequest):
+async def refine_grammar(req: GrammarRequest, response: Response):
+    deadline = Deadline.for_request(req.deadline_ms)
+    metadata, _ = await resolve_metadata(req.metadata, req.metadata_id)
     step1_texts = [seg.text for seg in req.transcript]
     seg_dicts: List[Dict[str, Any]] = [seg.dict() for seg in req.transcript]
-    
-    results, warnings = run_step2(
-        gemini = _gemini,
-        metadata = req.metadata,
-        transcript_segments=seg_dicts,
-        step1_texts=step1_texts,
-        step1_changes=req.step1_changes
-    )
+
+    with timed("step2"), compaction_report() as report:
+        results, warnings = await arun_step2(
+            gemini = get_backend(req.backend),
+            metadata = metadata,
+            transcript_segments=seg_dicts,
+            step1_texts=step1_texts,
+            step1_changes=req.step1_changes,
+            deadline=deadline,
+        )
 
     corrected: List[Dict[str, Any]] = []
     edits_all: List[List[Dict[str, Any]]] = []
+    rows: List[Dict[str, Any]] = []
 
-    had_warning = len(warnings) > 0
     for idx, (seg, res) in enumerate(zip(seg_dicts, results)):
         corrected.append({**seg, "text": res.text})
         edits_dicts = [e.model_dump(by_alias=True) for e in res.edits]
         edits_all.append(edits_dicts)
+        # Triage plus CSV fields (review or accepted)
+        rows.append(hitl_row(idx, seg, step1_texts[idx], res.text, res.source, edits_dicts, warnings, metadata))
 
-        # Heuristic triage
-        review, reason = should_review(num_edits=len(edits_dicts), had_warning=had_warning)
-
-        # Build fields for CSV
-        original_text = seg.get("text", "")
-        step1_text = step1_texts[idx]
-        step2_text = res.text
-        speaker = seg.get("speaker", "")
-        speaker_id = seg.get("speaker_id", 0)
-
-        # Append to CSV (review or accepted)
-        append_row(
-            review=review,
-            reason=reason,
-            segment_index=idx,
-            speaker=speaker,
-            speaker_id=speaker_id,
-            original_text=original_text,
-            step1_text=step1_text,
-            step2_text=step2_text,
-            edits=edits_dicts,
-            warnings=warnings,
-            metadata=req.metadata,
-        )
+    # Handed to the background HITL writer; never waits on disk
+    with timed("hitl"):
+        await get_queue().asubmit(rows, timeout=deadline.timeout())
+
+    response.headers[SAVED_TOKENS_HEADER] = str(report.saved_tokens)
+    return GrammarResponse(transcript=corrected, edits=edits_all, warnings=warnings)
 
 
-    for seg, res in zip(seg_dicts, results):
-        corrected.append({**seg, "text": res.text})
-        edits_all.append([e.model_dump(by_alias=True) for e in res.edits])
+@router.get("/step2/cache")
+def cache_stats():
+    cache = get_default_cache()
+    return cache.stats() if cache is not None else {"enabled": False}
 
-    return GrammarResponse(transcript=corrected, edits=edits_all, warnings=warnings)
+
+@router.get("/step2/limits")
+def limit_stats():
+    return get_scheduler().stats()
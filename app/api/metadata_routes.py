@@ -0,0 +1,61 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+from typing import Any, Dict, List, Optional, Tuple
+from app.core.fuzzy_matcher import EntityIndex
+from app.core.metadata_registry import MetadataNotFound, get_registry, resolve
+
+router = APIRouter()
+
+
+class MetadataUpload(BaseModel):
+    name: str
+    metadata: Dict[str, Any]
+
+
+async def resolve_metadata(metadata: Optional[Dict[str, Any]],
+                           metadata_id: Optional[str]) -> Tuple[Dict[str, Any], Optional[EntityIndex]]:
+    """Request metadata (+ prebuilt index for registry IDs); unknown IDs are a 404."""
+    if metadata_id is None:
+        return metadata or {}, None
+    try:
+        # A cold entry compiles its index; keep that off the event loop
+        return await run_in_threadpool(resolve, metadata, metadata_id)
+    except MetadataNotFound as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+
+
+@router.post("/metadata")
+async def upload_metadata(req: MetadataUpload):
+    """Registers metadata under a name; returns its versioned ID ("name:vN")."""
+    registry = get_registry()
+    try:
+        entry, created = registry.register(req.name, req.metadata)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    # Compile now so the first request using the ID does not pay for it
+    await run_in_threadpool(registry.resolve, entry.id)
+    return {**entry.summary(), "created_version": created}
+
+
+@router.get("/metadata")
+def list_metadata() -> List[Dict[str, Any]]:
+    return [entry.summary() for entry in get_registry().names()]
+
+
+@router.get("/metadata/stats")
+def registry_stats():
+    return get_registry().stats()
+
+
+@router.get("/metadata/{metadata_id}")
+def get_metadata(metadata_id: str):
+    """One version ("name:vN" / "name:latest") with its metadata, or every version of a bare name."""
+    registry = get_registry()
+    try:
+        if ":" not in metadata_id:
+            return {"name": metadata_id, "versions": [e.summary() for e in registry.versions(metadata_id)]}
+        entry = registry.get(metadata_id)
+    except MetadataNotFound as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    return {**entry.summary(), "metadata": entry.metadata}
@@ -0,0 +1,46 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from typing import List
+from app.core.metrics import REGISTRY, Family, stats_families
+from app.core.step2_cache import get_default_cache
+from app.core.rate_limit import get_scheduler
+from app.core.hitl_queue import get_queue
+from app.core.sessions import get_store
+from app.core.metadata_registry import get_registry
+from app.core.step2_backends import loaded_backend
+
+router = APIRouter()
+
+
+def _component_stats() -> List[Family]:
+    """Stats the caches, scheduler, HITL queue, metadata registry and session store keep anyway, exported at scrape time."""
+    families: List[Family] = []
+    cache = get_default_cache()
+    if cache is not None:
+        families += stats_families("step2_cache", "Step-2 response cache", cache.stats(),
+                                   counters=("hits", "memory_hits", "disk_hits", "misses"))
+    scheduler = get_scheduler().stats()
+    families += stats_families("gemini_scheduler", "Gemini scheduler", scheduler,
+                               counters=[k for k in scheduler if k != "breaker_state"])
+    families.append(("gemini_breaker_open", "gauge", "1 while the Gemini circuit breaker is open or half-open.",
+                     [({}, 0 if scheduler["breaker_state"] == "closed" else 1)]))
+    families += stats_families("hitl", "HITL writer queue", get_queue().stats(),
+                               counters=("enqueued_batches", "dropped_batches", "dropped_rows",
+                                         "written_rows", "write_errors"))
+    families += stats_families("metadata_registry", "Metadata registry", get_registry().stats(),
+                               counters=("hits", "misses"))
+    context_cache = getattr(loaded_backend("gemini"), "context_cache", None)
+    if context_cache is not None:
+        families += stats_families("gemini_context_cache", "Gemini cached-content handles", context_cache.stats(),
+                                   counters=("hits", "inline", "creates", "refreshes", "failures", "invalidated"))
+    families.append(("live_sessions", "gauge", "Open live transcript sessions.", [({}, len(get_store()))]))
+    return families
+
+
+REGISTRY.collector(_component_stats)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus text exposition of stage timings, Step-2 counters and component stats."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
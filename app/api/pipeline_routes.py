@@ -1,75 +1,158 @@
 # app/api/pipeline_routes.py
-from fastapi import APIRouter
-from typing import List, Dict, Any
+import json, time
+from fastapi import APIRouter, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
 from app.models.schemas_pipeline import PipelineRequest
+from app.models.schemas_step2 import Step2SegmentResult
 from app.models.schemas import TranscriptSegment
-from app.core.fuzzy_matcher import correct_transcript_segment  # Step 1
-from app.core.step2_orchestrator import run_step2               # Step 2 orchestrator
-from app.core.gemini_client import Step2Gemini                  # Step 2 client
+from app.core.fuzzy_matcher import EntityIndex, correct_transcript  # Step 1
+from app.core.step2_orchestrator import arun_step2, astream_step2  # Step 2 orchestrator
+from app.core.step2_backends import get_backend                 # Step 2 backend (gemini / local)
+from app.core.deadline import DEADLINE_EXCEEDED, Deadline
+from app.core.metrics import timed
+from app.core.prompt_compaction import SAVED_TOKENS_HEADER, compaction_report
+from app.api.metadata_routes import resolve_metadata
 
 # HITL CSV triage helpers
-from app.core.csv_store import append_row, should_review
+from app.core.csv_store import hitl_row
+from app.core.hitl_queue import get_queue
 
 router = APIRouter()
-_gemini = Step2Gemini()  # ensure env is loaded before import/instantiation
 
-@router.post("/run", response_model=List[TranscriptSegment])
-def run_full_pipeline(req: PipelineRequest):
-    # Copy input segments to plain dicts
-    seg_dicts: List[Dict[str, Any]] = [seg.dict() for seg in req.transcript]
 
-    # Step 1: entity-only pass
+def _run_stage1(seg_dicts: List[Dict[str, Any]], metadata: Dict[str, Any],
+                index: Optional[EntityIndex] = None) -> Tuple[List[str], List[List[Dict[str, Any]]]]:
     stage1_texts: List[str] = []
     stage1_changes: List[List[Dict[str, Any]]] = []
-    for seg in seg_dicts:
-        s1 = correct_transcript_segment(
-            seg, req.metadata, add_terminal_period=True, threshold=80.0
-        )
+    # All segments are scored in one batch against the compiled entity index
+    stage1 = correct_transcript(seg_dicts, metadata, add_terminal_period=True, threshold=80.0, index=index)
+    for seg, s1 in zip(seg_dicts, stage1):
         seg["text"] = s1["text"]         # update segment to Stage 1 text (input to Step 2)
         stage1_texts.append(s1["text"])
         stage1_changes.append(s1.get("_stage1_changes", []))
+    return stage1_texts, stage1_changes
+
+
+def _hitl_row(idx: int, seg: Dict[str, Any], stage1_text: str, res: Step2SegmentResult,
+              warnings: List[str], metadata: Dict[str, Any]) -> Dict[str, Any]:
+    edits_dicts = [e.model_dump(by_alias=True) for e in res.edits]
+    return hitl_row(idx, seg, stage1_text, res.text, res.source, edits_dicts, warnings, metadata)
+
+
+@router.post("/run", response_model=List[TranscriptSegment])
+async def run_full_pipeline(req: PipelineRequest, response: Response):
+    # Latency budget for the whole request, Stage 1 included
+    deadline = Deadline.for_request(req.deadline_ms)
+    # Inline metadata, or a registry upload with its index already built
+    metadata, index = await resolve_metadata(req.metadata, req.metadata_id)
+
+    # Copy input segments to plain dicts
+    seg_dicts: List[Dict[str, Any]] = [seg.dict() for seg in req.transcript]
+
+    # Step 1: entity-only pass (CPU-bound, kept off the event loop)
+    with timed("stage1"):
+        stage1_texts, stage1_changes = await run_in_threadpool(_run_stage1, seg_dicts, metadata, index)
 
     # Step 2: LLM refinement (context + grammar/style)
-    results, warnings = run_step2(
-        gemini=_gemini,
-        metadata=req.metadata,
-        transcript_segments=seg_dicts,   # Stage 1 text in seg_dicts
-        step1_texts=stage1_texts,
-        step1_changes=stage1_changes,
-    )
+    with timed("step2"), compaction_report() as report:
+        results, warnings = await arun_step2(
+            gemini=get_backend(req.backend),
+            metadata=metadata,
+            transcript_segments=seg_dicts,   # Stage 1 text in seg_dicts
+            step1_texts=stage1_texts,
+            step1_changes=stage1_changes,
+            deadline=deadline,              # pending segments keep Stage-1 text once it passes
+        )
 
     # Triage + CSV dump per segment (review or accepted)
-    had_warning = len(warnings) > 0
     final_segments: List[Dict[str, Any]] = []
+    rows: List[Dict[str, Any]] = []
     for idx, (seg, res) in enumerate(zip(seg_dicts, results)):
         # Final corrected segment (replace text only)
-        final = {**seg, "text": res.text}
-        final_segments.append(final)
-
-        # Prepare HITL CSV fields
-        edits_dicts = [e.model_dump(by_alias=True) for e in res.edits]
-        review, reason = should_review(num_edits=len(edits_dicts), had_warning=had_warning)
-
-        # "original_text" here means the text as seen by Step 2 (Stage 1 text)
-        original_text_for_step2 = stage1_texts[idx]
-        step1_text = stage1_texts[idx]
-        step2_text = res.text
-        speaker = seg.get("speaker", "")
-        speaker_id = seg.get("speaker_id", 0)
-
-        append_row(
-            review=review,
-            reason=reason,
-            segment_index=idx,
-            speaker=speaker,
-            speaker_id=speaker_id,
-            original_text=original_text_for_step2,
-            step1_text=step1_text,
-            step2_text=step2_text,
-            edits=edits_dicts,
-            warnings=warnings,
-            metadata=req.metadata,
-        )
+        final_segments.append({**seg, "text": res.text})
+        rows.append(_hitl_row(idx, seg, stage1_texts[idx], res, warnings, metadata))
+
+    # Handed to the background HITL writer; never waits on disk (nor past the deadline)
+    with timed("hitl"):
+        await get_queue().asubmit(rows, timeout=deadline.timeout())
 
+    response.headers[SAVED_TOKENS_HEADER] = str(report.saved_tokens)
     # Return only corrected segments array for downstream pipeline
     return final_segments
+
+
+def _ndjson(record: Dict[str, Any]) -> bytes:
+    return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+async def _stream_pipeline(req: PipelineRequest, metadata: Dict[str, Any], index: Optional[EntityIndex],
+                           deadline: Deadline, started: float) -> AsyncIterator[bytes]:
+    seg_dicts: List[Dict[str, Any]] = [seg.dict() for seg in req.transcript]
+    # Runs after the headers went out, so this only reaches /metrics, not Server-Timing
+    with timed("stage1"):
+        stage1_texts, stage1_changes = await run_in_threadpool(_run_stage1, seg_dicts, metadata, index)
+
+    results: Dict[int, Step2SegmentResult] = {}
+    seg_warnings: Dict[int, str] = {}
+    sources: Dict[str, int] = {}
+    with compaction_report() as report:
+        async for idx, res, warning in astream_step2(
+            gemini=get_backend(req.backend),
+            metadata=metadata,
+            transcript_segments=seg_dicts,
+            step1_texts=stage1_texts,
+            step1_changes=stage1_changes,
+            deadline=deadline,
+        ):
+            results[idx] = res
+            if warning:
+                seg_warnings[idx] = warning
+            sources[res.source] = sources.get(res.source, 0) + 1
+            yield _ndjson({
+                "type": "segment",
+                "index": idx,
+                "segment": {**seg_dicts[idx], "text": res.text},
+                "edits": [e.model_dump(by_alias=True) for e in res.edits],
+                "source": res.source,
+                "warnings": [warning] if warning else [],
+            })
+
+    # HITL rows get the request-level warnings, same as /run
+    warnings = [seg_warnings[i] for i in sorted(seg_warnings)]
+    rows = [
+        _hitl_row(idx, seg_dicts[idx], stage1_texts[idx], results[idx], warnings, metadata)
+        for idx in range(len(seg_dicts))
+    ]
+    await get_queue().asubmit(rows, timeout=deadline.timeout())
+
+    yield _ndjson({
+        "type": "summary",
+        "segments": len(seg_dicts),
+        "warnings": warnings,
+        "sources": sources,
+        "deadline_exceeded": sum(w.endswith(DEADLINE_EXCEEDED) for w in warnings),
+        "metadata_tokens_saved": report.saved_tokens,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    })
+
+
+@router.post("/run/stream")
+async def run_pipeline_stream(req: PipelineRequest):
+    """
+    Streaming /run: one NDJSON line per segment as soon as it is corrected
+    (in completion order, keyed by "index"), then a final "summary" line.
+    """
+    # The clock starts on arrival, not when the generator first runs after the headers went out
+    started = time.perf_counter()
+    deadline = Deadline.for_request(req.deadline_ms)
+    # Resolved before streaming starts so an unknown metadata_id is still a 404
+    metadata, index = await resolve_metadata(req.metadata, req.metadata_id)
+    return StreamingResponse(_stream_pipeline(req, metadata, index, deadline, started),
+                             media_type="application/x-ndjson")
+
+
+@router.get("/hitl/stats")
+def hitl_stats():
+    return get_queue().stats()
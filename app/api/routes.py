@@ -1,18 +1,32 @@
 from fastapi import APIRouter
-from typing import List, Dict, Any
+from fastapi.concurrency import run_in_threadpool
+from typing import List, Dict, Any, Optional
 from app.models.schemas import CorrectionRequest, CorrectionResponse
-from app.core.fuzzy_matcher import correct_transcript_segment
+from app.core.fuzzy_matcher import EntityIndex, correct_transcript
+from app.core.metrics import timed
+from app.api.metadata_routes import resolve_metadata
 
 router = APIRouter()
 
-@router.post("/step1", response_model=CorrectionResponse)
-def correct_entities(req: CorrectionRequest):
+
+def _correct_all(req: CorrectionRequest, metadata: Dict[str, Any],
+                 index: Optional[EntityIndex] = None) -> Dict[str, Any]:
     corrected: List[Dict[str, Any]] = []
-    changes_all: List[List[Dict[str, any]]] = []
+    changes_all: List[List[Dict[str, Any]]] = []
 
-    for seg in req.transcript:
-        c = correct_transcript_segment(seg.dict(), req.metadata, add_terminal_period=True, threshold=80.0)
-        corrected.append({**seg.dict(), "text": c["text"]})
+    seg_dicts = [seg.dict() for seg in req.transcript]
+    # All segments are scored in one batch against the compiled entity index
+    stage1 = correct_transcript(seg_dicts, metadata, add_terminal_period=True, threshold=80.0, index=index)
+    for seg, c in zip(seg_dicts, stage1):
+        corrected.append({**seg, "text": c["text"]})
         changes_all.append(c.get("_stage1_changes", []))
-        
-    return {"transcript": corrected, "changes": changes_all}
\ No newline at end of file
+
+    return {"transcript": corrected, "changes": changes_all}
+
+
+@router.post("/step1", response_model=CorrectionResponse)
+async def correct_entities(req: CorrectionRequest):
+    metadata, index = await resolve_metadata(req.metadata, req.metadata_id)
+    # Stage 1 is CPU-bound; keep it off the event loop
+    with timed("stage1"):
+        return await run_in_threadpool(_correct_all, req, metadata, index)
@@ -0,0 +1,95 @@
+from fastapi import APIRouter, HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
+from typing import List, Dict, Any
+from app.models.schemas_session import (
+    SessionCreateRequest, SessionInfo, SessionAppendRequest, SessionAppendResponse, SessionTranscript,
+)
+from app.core.sessions import Session, get_store
+from app.core.step2_orchestrator import arun_step2
+from app.core.step2_backends import get_backend
+from app.core.csv_store import hitl_row
+from app.core.hitl_queue import get_queue
+from app.core.deadline import Deadline
+from app.core.metrics import timed
+from app.core.prompt_compaction import SAVED_TOKENS_HEADER, compaction_report
+from app.api.metadata_routes import resolve_metadata
+
+router = APIRouter()
+
+
+def _session_or_404(session_id: str) -> Session:
+    session = get_store().get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"session {session_id} not found")
+    return session
+
+
+@router.post("/sessions", response_model=SessionInfo)
+async def open_session(req: SessionCreateRequest):
+    metadata, index = await resolve_metadata(req.metadata, req.metadata_id)
+    # Building the entity index is CPU-bound; done once per session (registry uploads reuse theirs)
+    session = await run_in_threadpool(get_store().create, metadata, req.backend, index)
+    return session.summary()
+
+
+@router.post("/sessions/{session_id}/segments", response_model=SessionAppendResponse)
+async def append_segments(session_id: str, req: SessionAppendRequest, response: Response):
+    session = _session_or_404(session_id)
+    # Started before taking the lock: time queued behind earlier chunks counts
+    deadline = Deadline.for_request(req.deadline_ms)
+    seg_dicts: List[Dict[str, Any]] = [seg.dict() for seg in req.transcript]
+
+    async with session.lock:
+        offset = session.next_index
+        with timed("stage1"):
+            stage1_texts, stage1_changes = await run_in_threadpool(session.stage1, seg_dicts)
+
+        with timed("step2"), compaction_report() as report:
+            results, warnings = await arun_step2(
+                gemini=get_backend(session.backend),
+                metadata=session.metadata,
+                transcript_segments=seg_dicts,
+                step1_texts=stage1_texts,
+                step1_changes=stage1_changes,
+                context=session.context(),
+                deadline=deadline,
+            )
+
+        corrected: List[Dict[str, Any]] = []
+        edits_all: List[List[Dict[str, Any]]] = []
+        rows: List[Dict[str, Any]] = []
+        for idx, (seg, res) in enumerate(zip(seg_dicts, results)):
+            corrected.append({**seg, "text": res.text})
+            edits_dicts = [e.model_dump(by_alias=True) for e in res.edits]
+            edits_all.append(edits_dicts)
+            rows.append(hitl_row(offset + idx, seg, stage1_texts[idx], res.text, res.source,
+                                 edits_dicts, warnings, session.metadata))
+        session.commit(corrected)
+
+    # Handed to the background HITL writer; never waits on disk
+    with timed("hitl"):
+        await get_queue().asubmit(rows, timeout=deadline.timeout())
+
+    response.headers[SAVED_TOKENS_HEADER] = str(report.saved_tokens)
+    return SessionAppendResponse(
+        session_id=session_id, offset=offset, transcript=corrected, edits=edits_all, warnings=warnings
+    )
+
+
+@router.get("/sessions/{session_id}", response_model=SessionInfo)
+def session_info(session_id: str):
+    return _session_or_404(session_id).summary()
+
+
+@router.get("/sessions/{session_id}/transcript", response_model=SessionTranscript)
+def session_transcript(session_id: str):
+    session = _session_or_404(session_id)
+    return SessionTranscript(session_id=session_id, transcript=session.transcript)
+
+
+@router.delete("/sessions/{session_id}", response_model=SessionTranscript)
+def close_session(session_id: str):
+    session = get_store().close(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"session {session_id} not found")
+    return SessionTranscript(session_id=session_id, transcript=session.transcript)
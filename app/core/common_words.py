@@ -0,0 +1,42 @@
+# Everyday English words (4+ letters) the phonetic fallback never rewrites:
+# they share Soundex / Metaphone codes with many names ("root" ~ "Rohit",
+# "chain" ~ "Chennai", "band" ~ "BANT") but are almost always meant literally.
+# Extend per deployment with STAGE1_PHONETIC_WORDLIST (one word per line).
+
+COMMON_WORDS = frozenset("""
+able about above accept account across action actually add address after again against agent agree ahead
+allow almost alone along already also always amount analysis answer anyone anything anyway apart apply april
+area around arrive aside asked away back bad balance band bank base basic basis batch bear beat because become
+been before began begin behind being believe below bench bend benefit bent best better between beyond big bill
+bind bird black blank block blue board body book both bottom bound box brand bread break bring broad brought
+budget build built bunch business busy buyer call came campaign cannot capital card care carry case cash cause
+center central chain chair challenge chance change channel charge chart chat cheap check choice choose church
+city claim class clean clear client close cloud code cold come coming comment common company complete concern
+condition consider contact content context continue contract control cool copy core cost could count country
+couple course cover create credit cross current customer cycle daily data date deal dear decide deep define
+delay deliver demand demo deploy design detail develop device different direct discount discuss doing done door
+double down draft drive drop during each early east easy edge effect either else email emails end energy enough
+entire even event ever every exact example except expect extra face fact fair fall family fast feature feel
+few field figure file fill final finance find fine finish firm first fit five fix flow focus follow form forward
+four free friday friend from front full fund further future gain game gave general get getting give given glad
+goal going gone good great green group grow growth guess half hand handle happen happy hard have head hear heard
+help here high hire hold home hope hour house however huge idea impact include increase index inside instead
+into issue item join july june just keep kind know known land large last late later launch lead learn least
+leave left less letter level light like limit line link list listen little live load local long look loop lose
+lost lower made mail main make manage many march margin mark market mean meet meeting member mention message
+might mind minute miss model moment monday money month more most move much must name near need never next nice
+night none normal note nothing number offer office okay once only open option order other outside over owner
+page paid pain part party pass past path peak people percent period person phone pick piece pipeline place plan
+platform play please plus point policy pool poor post power present press price pricing problem process product
+program project proper prove pull push quarter question quick quite rain raise range rate rather reach read
+ready real really reason record reduce region remain report request result return review right ring rise risk
+road role roll room root round rule sale sales same save saying scale scope second section seem sell send sense
+sent series serve service session setup several share shift short should show side sign simple since single
+site size slow small smart some someone something soon sorry sort sound source space speak spend stage stand
+start state stay step still stock stop story strong study stuff such summer sunday support sure system table
+take talk target task team tell term test than thank that their them then there these thing think this those
+though three through thursday time today together tomorrow tool total touch toward track trade train trial true
+trust truth try tuesday turn under unit until update upon usage used user value very view visit voice wait walk
+want week weekend well went were west what when where which while white whole will win window wish with within
+without word work world worth would write year yeah yesterday young your
+""".split())
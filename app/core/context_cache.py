@@ -0,0 +1,194 @@
+import asyncio, hashlib, json, os, threading, time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from google.genai import types
+
+from app.core.metrics import timed
+from app.core.rate_limit import GEMINI_TIMEOUT_S, status_code
+
+# Keep the Step-2 system instruction in a Gemini cached-content handle instead of every prompt
+CONTEXT_CACHE_ENABLED = os.getenv("GEMINI_CONTEXT_CACHE", "1") == "1"
+# Also cache each tenant's full metadata with the instruction (prompts then carry none;
+# disables per-prompt metadata compaction, which would make every prefix different)
+CONTEXT_CACHE_METADATA = os.getenv("GEMINI_CONTEXT_CACHE_METADATA", "0") == "1"
+# Lifetime requested for a handle; it is extended once less than REFRESH_S is left
+CONTEXT_CACHE_TTL_S = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL_S", "3600"))
+CONTEXT_CACHE_REFRESH_S = int(os.getenv("GEMINI_CONTEXT_CACHE_REFRESH_S", "300"))
+# The API rejects caches below the model's minimum; smaller prefixes are sent inline without trying.
+# The instruction alone (~500-650 tokens) is below it, so handles need CONTEXT_CACHE_METADATA
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("GEMINI_CONTEXT_CACHE_MIN_TOKENS", "1024"))
+# After a failed create, that prefix goes inline for this long before another attempt
+CONTEXT_CACHE_RETRY_S = float(os.getenv("GEMINI_CONTEXT_CACHE_RETRY_S", "600"))
+# Handles kept (one per instruction variant, times tenants with CONTEXT_CACHE_METADATA); LRU ones are deleted
+CONTEXT_CACHE_MAX_ENTRIES = int(os.getenv("GEMINI_CONTEXT_CACHE_MAX_ENTRIES", "64"))
+
+# Errors on a call that used a handle which mean the handle itself is gone or unusable
+STALE_HANDLE_CODES = {400, 403, 404}
+
+METADATA_PREAMBLE = "Metadata for every segment of this call:\n\n"
+
+
+class _Handle:
+    def __init__(self, name: str, expires_at: float, tokens: int):
+        self.name = name
+        self.expires_at = expires_at      # time.monotonic()
+        self.tokens = tokens
+
+
+class ContextCache:
+    """
+    Cached-content handles for the static prefix of Step-2 prompts: the
+    system instruction variant and, with CONTEXT_CACHE_METADATA, the tenant's
+    metadata. handle() returns a name for GenerateContentConfig.cached_content
+    or None, meaning "send the prompt inline": caching disabled, prefix below
+    CONTEXT_CACHE_MIN_TOKENS, a recent failed create, or another caller is
+    creating that handle right now (nobody waits on a create).
+    `client` is a callable so a swapped client (tests, benchmark) is picked up.
+    """
+
+    def __init__(self, client: Callable[[], Any], model: str,
+                 ttl_s: int = CONTEXT_CACHE_TTL_S, refresh_s: int = CONTEXT_CACHE_REFRESH_S,
+                 min_tokens: int = CONTEXT_CACHE_MIN_TOKENS, retry_s: float = CONTEXT_CACHE_RETRY_S,
+                 max_entries: int = CONTEXT_CACHE_MAX_ENTRIES):
+        self._client = client
+        self.model = model
+        self.ttl_s = ttl_s
+        self.refresh_s = min(refresh_s, ttl_s // 2)
+        self.min_tokens = min_tokens
+        self.retry_s = retry_s
+        self.max_entries = max(1, max_entries)
+        self._handles: "OrderedDict[str, _Handle]" = OrderedDict()
+        self._failed: Dict[str, float] = {}
+        self._busy: set = set()
+        self._lock = threading.Lock()
+        self.stats_counters = {"hits": 0, "inline": 0, "creates": 0, "refreshes": 0, "failures": 0, "invalidated": 0}
+
+    @staticmethod
+    def _key(instruction: str, metadata_json: Optional[str]) -> str:
+        return hashlib.sha1(f"{instruction}\0{metadata_json or ''}".encode("utf-8")).hexdigest()
+
+    def _count(self, name: str):
+        self.stats_counters[name] += 1
+
+    def _lookup(self, key: str, tokens: int) -> Tuple[Optional[str], bool]:
+        """(handle name, whether this caller should create / refresh it); caller holds the lock."""
+        now = time.monotonic()
+        handle = self._handles.get(key)
+        if handle is not None and handle.expires_at - now > self.refresh_s:
+            self._handles.move_to_end(key)
+            self._count("hits")
+            return handle.name, False
+        if tokens < self.min_tokens or key in self._busy or self._failed.get(key, 0.0) > now:
+            # An expiring handle stays usable while someone else refreshes it
+            usable = handle is not None and handle.expires_at > now
+            self._count("hits" if usable else "inline")
+            return (handle.name if usable else None), False
+        self._busy.add(key)
+        return None, True
+
+    def _prefix(self, instruction: str, metadata: Optional[Dict[str, Any]]) -> Tuple[str, Optional[str], int]:
+        metadata_json = None
+        if metadata:
+            # Registry metadata (PromptMetadata) carries its serialized form already
+            metadata_json = getattr(metadata, "json", None) or json.dumps(metadata, ensure_ascii=False, separators=(",", ":"))
+        tokens = (len(instruction) + len(metadata_json or "")) // 4
+        return self._key(instruction, metadata_json), metadata_json, tokens
+
+    def handle(self, instruction: str, metadata: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        key, metadata_json, tokens = self._prefix(instruction, metadata)
+        with self._lock:
+            name, build = self._lookup(key, tokens)
+        if not build:
+            return name
+        return self._build(key, instruction, metadata_json, tokens)
+
+    async def ahandle(self, instruction: str, metadata: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """handle() that only leaves the event loop when a create / refresh call is due."""
+        key, metadata_json, tokens = self._prefix(instruction, metadata)
+        with self._lock:
+            name, build = self._lookup(key, tokens)
+        if not build:
+            return name
+        return await asyncio.to_thread(self._build, key, instruction, metadata_json, tokens)
+
+    def _build(self, key: str, instruction: str, metadata_json: Optional[str], tokens: int) -> Optional[str]:
+        with self._lock:
+            current = self._handles.get(key)
+        evicted: List[str] = []
+        try:
+            with timed("context_cache"):
+                if current is not None:
+                    try:
+                        self._client().caches.update(name=current.name, config=types.UpdateCachedContentConfig(
+                            ttl=f"{self.ttl_s}s", http_options=self._http_options()))
+                        name = current.name
+                        kind = "refreshes"
+                    except Exception:
+                        current = None
+                if current is None:
+                    contents = None
+                    if metadata_json:
+                        contents = [types.Content(role="user", parts=[types.Part(text=METADATA_PREAMBLE + metadata_json)])]
+                    cached = self._client().caches.create(model=self.model, config=types.CreateCachedContentConfig(
+                        system_instruction=instruction, contents=contents, ttl=f"{self.ttl_s}s",
+                        display_name=f"step2-{key[:12]}", http_options=self._http_options()))
+                    name = cached.name
+                    kind = "creates"
+        except Exception:
+            with self._lock:
+                self._busy.discard(key)
+                self._handles.pop(key, None)
+                self._failed[key] = time.monotonic() + self.retry_s
+                self._count("failures")
+            return None
+
+        with self._lock:
+            self._busy.discard(key)
+            self._failed.pop(key, None)
+            self._handles[key] = _Handle(name, time.monotonic() + self.ttl_s, tokens)
+            self._handles.move_to_end(key)
+            self._count(kind)
+            while len(self._handles) > self.max_entries:
+                evicted.append(self._handles.popitem(last=False)[1].name)
+        for old in evicted:
+            self._delete(old)
+        return name
+
+    def _http_options(self) -> types.HttpOptions:
+        return types.HttpOptions(timeout=int(GEMINI_TIMEOUT_S * 1000))
+
+    def _delete(self, name: str):
+        # Best effort: an undeleted handle only lingers until its TTL
+        try:
+            self._client().caches.delete(name=name)
+        except Exception:
+            pass
+
+    def is_stale(self, exc: BaseException) -> bool:
+        """Whether a failed call that used a handle should be resent inline."""
+        return status_code(exc) in STALE_HANDLE_CODES
+
+    def invalidate(self, name: Optional[str]):
+        """Forgets a handle the API rejected; the next handle() call recreates it."""
+        with self._lock:
+            for key, handle in list(self._handles.items()):
+                if handle.name == name:
+                    del self._handles[key]
+                    self._count("invalidated")
+
+    def clear(self):
+        """Deletes every handle (shutdown), so none keeps billing storage until its TTL."""
+        with self._lock:
+            names = [h.name for h in self._handles.values()]
+            self._handles.clear()
+        for name in names:
+            self._delete(name)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "handles": len(self._handles),
+                "cached_tokens": sum(h.tokens for h in self._handles.values()),
+                **self.stats_counters,
+            }
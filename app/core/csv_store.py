@@ -1,12 +1,22 @@
-import csv, json, os
+import csv, hashlib, io, json, os, threading, time
 from datetime import datetime
 from typing import Any, Dict, List, Optional, Tuple
 
+try:
+    import fcntl  # cross-process file locking (POSIX only)
+except ImportError:
+    fcntl = None
+
 REVIEW_CSV_PATH = os.getenv("HITL_REVIEW_CSV", "./hitl_reviews.csv")
 ACCEPTED_CSV_PATH = os.getenv("HITL_ACCEPTED_CSV", "./hitl_accepted.csv")
+METADATA_CSV_PATH = os.getenv("HITL_METADATA_CSV", "./hitl_metadata.csv")
 
 EDITS_REVIEW_THRESHOLD = int(os.getenv("HITL_EDITS_THRESHOLD", "3"))
 
+# Buffered rows are written once this many are pending or the oldest is this old
+FLUSH_ROWS = int(os.getenv("HITL_FLUSH_ROWS", "256"))
+FLUSH_INTERVAL_S = float(os.getenv("HITL_FLUSH_INTERVAL_S", "2.0"))
+
 CSV_HEADERS = [
     "timestamp",
     "review",          # true/false
@@ -17,19 +27,194 @@ CSV_HEADERS = [
     "original_text",   # original segment text as received by Step 2
     "step1_text",
     "step2_text",
+    "step2_source",    # llm / local_model (local backend) / local (skipped by the LLM gate) / fallback
     "num_edits",
     "edits_json",
     "warnings_json",
-    "metadata_json",
+    "metadata_id",     # row in the metadata CSV; stored once per distinct metadata
 ]
 
+METADATA_HEADERS = ["metadata_id", "timestamp", "metadata_json"]
+
+
+def metadata_id(metadata: Dict[str, Any]) -> str:
+    blob = json.dumps(metadata or {}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()[:16]
+
+
+class HitlWriter:
+    """
+    Buffered writer for the HITL CSVs. File handles stay open, rows are
+    buffered per file and written in one block on flush (explicitly, or once
+    FLUSH_ROWS / FLUSH_INTERVAL_S is reached). A thread lock serializes
+    callers in this process and an flock on each file serializes processes.
+    A file whose header differs from the current columns (written by an older
+    version) is renamed aside and a fresh one started.
+    """
+
+    def __init__(self,
+                 review_path: str = REVIEW_CSV_PATH,
+                 accepted_path: str = ACCEPTED_CSV_PATH,
+                 metadata_path: str = METADATA_CSV_PATH,
+                 flush_rows: int = FLUSH_ROWS,
+                 flush_interval_s: float = FLUSH_INTERVAL_S):
+        self.review_path = review_path
+        self.accepted_path = accepted_path
+        self.metadata_path = metadata_path
+        self.flush_rows = flush_rows
+        self.flush_interval_s = flush_interval_s
+        self._lock = threading.RLock()
+        self._handles: Dict[str, Any] = {}
+        self._buffers: Dict[str, List[List[Any]]] = {}
+        self._pending = 0
+        self._oldest: Optional[float] = None
+        self._known_metadata: Optional[set] = None
+        # path -> inode whose header was checked
+        self._verified: Dict[str, int] = {}
+
+    def _handle(self, path: str):
+        f = self._handles.get(path)
+        if f is None:
+            f = open(path, "a", newline="", encoding="utf-8")
+            self._handles[path] = f
+        return f
+
+    def _load_known_metadata(self) -> set:
+        known = set()
+        if os.path.exists(self.metadata_path):
+            with open(self.metadata_path, newline="", encoding="utf-8") as f:
+                for row in csv.reader(f):
+                    if row and row[0] != METADATA_HEADERS[0]:
+                        known.add(row[0])
+        return known
+
+    def register_metadata(self, metadata: Dict[str, Any]) -> str:
+        """Returns the metadata's ID, buffering its row the first time it is seen."""
+        mid = metadata_id(metadata)
+        with self._lock:
+            if self._known_metadata is None:
+                self._known_metadata = self._load_known_metadata()
+            if mid not in self._known_metadata:
+                self._known_metadata.add(mid)
+                self._buffer(self.metadata_path, [
+                    mid, datetime.utcnow().isoformat(), json.dumps(metadata, ensure_ascii=False)
+                ])
+        return mid
+
+    def append(self, review: bool, row: List[Any]):
+        with self._lock:
+            self._buffer(self.review_path if review else self.accepted_path, row)
+            if self._pending >= self.flush_rows or (
+                self._oldest is not None and time.monotonic() - self._oldest >= self.flush_interval_s
+            ):
+                self.flush()
+
+    def _buffer(self, path: str, row: List[Any]):
+        self._buffers.setdefault(path, []).append(row)
+        self._pending += 1
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            # Each buffer is dropped as soon as it is written, so a failure on a
+            # later file doesn't write the earlier blocks again on the next flush
+            for path in list(self._buffers):
+                rows = self._buffers[path]
+                if rows:
+                    headers = METADATA_HEADERS if path == self.metadata_path else CSV_HEADERS
+                    self._write_block(path, headers, rows)
+                del self._buffers[path]
+                self._pending -= len(rows)
+            self._oldest = None
+
+    def _lock_file(self, path: str):
+        """Handle for `path`, flocked, reopened if another process rotated the file away."""
+        f = self._handle(path)
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            current = os.stat(path).st_ino
+        except FileNotFoundError:
+            current = None
+        if current != os.fstat(f.fileno()).st_ino:
+            self._unlock_file(f)
+            f.close()
+            del self._handles[path]
+            return self._lock_file(path)
+        return f
+
+    def _unlock_file(self, f):
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _rotate(self, path: str) -> str:
+        """Moves an outdated file aside: hitl_reviews.csv -> hitl_reviews.<utc timestamp>.csv."""
+        stem, ext = os.path.splitext(path)
+        target = f"{stem}.{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}{ext}"
+        n = 1
+        while os.path.exists(target):
+            target = f"{stem}.{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{n}{ext}"
+            n += 1
+        os.rename(path, target)
+        return target
+
+    def _check_header(self, path: str, f, headers: List[str]):
+        """Writes the header into an empty file, or rotates a file whose header differs; caller holds the flock."""
+        ino = os.fstat(f.fileno()).st_ino
+        if self._verified.get(path) == ino:
+            return f
+        if os.fstat(f.fileno()).st_size == 0:
+            csv.writer(f).writerow(headers)
+        else:
+            with open(path, newline="", encoding="utf-8") as r:
+                first = next(csv.reader(r), None)
+            if first != headers:
+                self._rotate(path)
+                if path == self.metadata_path:
+                    # Rows must reference metadata present in the new file
+                    self._known_metadata = None
+                self._unlock_file(f)
+                f.close()
+                del self._handles[path]
+                f = self._lock_file(path)
+                return self._check_header(path, f, headers)
+        self._verified[path] = ino
+        return f
+
+    def _write_block(self, path: str, headers: List[str], rows: List[List[Any]]):
+        block = io.StringIO()
+        writer = csv.writer(block)
+        writer.writerows(rows)
+        f = self._lock_file(path)
+        try:
+            # Header check happens under the lock so two processes can't both write it
+            f = self._check_header(path, f, headers)
+            f.write(block.getvalue())
+            f.flush()
+        finally:
+            self._unlock_file(f)
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            for f in self._handles.values():
+                f.close()
+            self._handles.clear()
+
+
+_writer: Optional[HitlWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> HitlWriter:
+    """Process-wide HitlWriter."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = HitlWriter()
+        return _writer
 
-def _ensure_file(path: str):
-    is_new = not os.path.exists(path)
-    if is_new:
-        with open(path, "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow(CSV_HEADERS)
 
 def should_review(num_edits: int, had_warning: bool) -> tuple[bool, str]:
     reasons = []
@@ -53,9 +238,16 @@ def append_row(
     edits: List[Dict[str, Any]],
     warnings: List[str],
     metadata: Dict[str, Any],
+    source: str = "llm",
+    metadata_ref: Optional[str] = None,
+    writer: Optional[HitlWriter] = None,
 ):
-    path = REVIEW_CSV_PATH if review else ACCEPTED_CSV_PATH
-    _ensure_file(path)
+    """
+    Buffers one HITL row. Pass `metadata_ref` (from register_metadata) to
+    skip re-hashing metadata for every row of a request.
+    """
+    writer = writer or get_writer()
+    mid = metadata_ref or writer.register_metadata(metadata)
     row = [
         datetime.utcnow().isoformat(),
         str(review).lower(),
@@ -66,11 +258,60 @@ def append_row(
         original_text,
         step1_text,
         step2_text,
+        source,
         len(edits),
         json.dumps(edits, ensure_ascii=False),
         json.dumps(warnings, ensure_ascii=False),
-        json.dumps(metadata, ensure_ascii=False),
+        mid,
     ]
-    with open(path, "a", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(row)
\ No newline at end of file
+    writer.append(review, row)
+
+
+def hitl_row(segment_index: int,
+             seg: Dict[str, Any],
+             step1_text: str,
+             step2_text: str,
+             source: str,
+             edits: List[Dict[str, Any]],
+             warnings: List[str],
+             metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Triage plus append_row kwargs for one pipeline segment. "original_text"
+    is the text as seen by Step 2 (Stage 1 text).
+    """
+    review, reason = should_review(num_edits=len(edits), had_warning=len(warnings) > 0)
+    return dict(
+        review=review,
+        reason=reason,
+        segment_index=segment_index,
+        speaker=seg.get("speaker", ""),
+        speaker_id=seg.get("speaker_id", 0),
+        original_text=step1_text,
+        step1_text=step1_text,
+        step2_text=step2_text,
+        source=source,
+        edits=edits,
+        warnings=warnings,
+        metadata=metadata,
+    )
+
+
+def append_rows(rows: List[Dict[str, Any]], writer: Optional[HitlWriter] = None, flush: bool = True):
+    """
+    Appends one request's rows and (by default) flushes them. Each item holds
+    append_row's keyword arguments; metadata is registered once per distinct dict.
+    """
+    writer = writer or get_writer()
+    refs: Dict[int, str] = {}
+    for row in rows:
+        md = row.get("metadata")
+        ref = refs.get(id(md))
+        if ref is None:
+            ref = refs[id(md)] = writer.register_metadata(md)
+        append_row(**{**row, "metadata_ref": ref, "writer": writer})
+    if flush:
+        writer.flush()
+
+
+def flush():
+    get_writer().flush()
@@ -0,0 +1,83 @@
+import contextvars, os, time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+# Server-side latency budget per request when the body has no deadline_ms (0 = unbounded)
+REQUEST_DEADLINE_MS = int(os.getenv("REQUEST_DEADLINE_MS", "10000"))
+
+# Warning text for segments that were still pending when the budget ran out
+DEADLINE_EXCEEDED = "deadline_exceeded"
+
+
+class DeadlineExceeded(TimeoutError):
+    """Outcome for work that was cut off (or never started) because the deadline passed."""
+
+    def __init__(self, msg: str = DEADLINE_EXCEEDED):
+        super().__init__(msg)
+
+
+class Deadline:
+    """
+    A point on the time.monotonic() clock by which a request must answer.
+    `expires_at` None means unbounded. Started when the request arrives, so
+    Stage 1 time comes out of the same budget as Step 2.
+    """
+
+    def __init__(self, expires_at: Optional[float] = None):
+        self.expires_at = expires_at
+
+    @classmethod
+    def after_ms(cls, ms: Optional[float]) -> "Deadline":
+        """Deadline ms from now; None or <= 0 gives an unbounded one."""
+        if ms is None or ms <= 0:
+            return cls(None)
+        return cls(time.monotonic() + ms / 1000.0)
+
+    @classmethod
+    def for_request(cls, deadline_ms: Optional[int] = None) -> "Deadline":
+        """The request's own deadline_ms, else REQUEST_DEADLINE_MS."""
+        return cls.after_ms(REQUEST_DEADLINE_MS if deadline_ms is None else deadline_ms)
+
+    @property
+    def bounded(self) -> bool:
+        return self.expires_at is not None
+
+    def remaining(self) -> float:
+        """Seconds left (inf when unbounded, never negative)."""
+        if self.expires_at is None:
+            return float("inf")
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def timeout(self) -> Optional[float]:
+        """remaining() in the form asyncio / concurrent.futures timeouts take (None = wait forever)."""
+        return None if self.expires_at is None else self.remaining()
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+
+_current: "contextvars.ContextVar[Optional[Deadline]]" = contextvars.ContextVar("deadline", default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    """Deadline of the request being served in this context, if any."""
+    return _current.get()
+
+
+def current_expiry() -> Optional[float]:
+    """current_deadline() as a monotonic timestamp (what GeminiScheduler takes)."""
+    d = _current.get()
+    return d.expires_at if d is not None else None
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[Deadline]) -> Iterator[Optional[Deadline]]:
+    """
+    Makes `deadline` current for the block. asyncio tasks created inside
+    inherit it; worker threads need contextvars.copy_context().run.
+    """
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
@@ -1,6 +1,13 @@
-from typing import Dict, List, Tuple, Any
+from typing import Dict, List, Tuple, Any, Optional
+from collections import OrderedDict
+import hashlib
+import json
+import os
 import re
 import difflib
+import threading
+
+from app.core.common_words import COMMON_WORDS
 
 try:
     from rapidfuzz import fuzz, process
@@ -9,6 +16,20 @@ try:
 except:
     USE_RAPIDFUZZ = False
 
+try:
+    import numpy as np
+    USE_CDIST = USE_RAPIDFUZZ
+
+except:
+    USE_CDIST = False
+
+try:
+    import jellyfish
+    USE_JELLYFISH = True
+
+except:
+    USE_JELLYFISH = False
+
 
 STOPWORDS = {
     "a","an","and","or","the","is","in","of","to","for","on","by","with","at","from","as","it","we","you","they","he","she"
@@ -18,6 +39,37 @@ STOPWORDS = {
 
 Word = str
 
+# Below this many keys every key is scored; above it only trigram candidates are
+CANDIDATE_MIN_KEYS = int(os.getenv("STAGE1_CANDIDATE_MIN_KEYS", "64"))
+# Compiled indexes kept in memory, keyed by metadata fingerprint
+INDEX_CACHE_SIZE = int(os.getenv("STAGE1_INDEX_CACHE_SIZE", "128"))
+# Threads rapidfuzz.process.cdist may use (-1 = all cores)
+CDIST_WORKERS = int(os.getenv("STAGE1_CDIST_WORKERS", "-1"))
+# Longest word span tried against multi-word canonicals ("bank of america", "chen nai")
+PHRASE_MAX_NGRAM = int(os.getenv("STAGE1_PHRASE_MAX_NGRAM", "4"))
+# Spans are scored with a plain (non-partial) ratio, so they get their own, stricter cut
+PHRASE_THRESHOLD = float(os.getenv("STAGE1_PHRASE_THRESHOLD", "85"))
+# Sound-alike fallback for tokens the fuzzy pass left unmatched ("roheet" -> "Rohit"); opt-in,
+# since same-sounding everyday words are usually meant literally
+PHONETIC_ENABLED = os.getenv("STAGE1_PHONETIC", "0") == "1"
+# Added to the plain ratio of a same-sounding key before comparing it with the threshold
+PHONETIC_BOOST = float(os.getenv("STAGE1_PHONETIC_BOOST", "30"))
+# Plain ratio a sound-alike still needs on its own, and the shortest token / key considered
+PHONETIC_MIN_SCORE = float(os.getenv("STAGE1_PHONETIC_MIN_SCORE", "70"))
+PHONETIC_MIN_LEN = int(os.getenv("STAGE1_PHONETIC_MIN_LEN", "4"))
+# Extra words (one per line) the phonetic fallback leaves alone, on top of COMMON_WORDS
+PHONETIC_WORDLIST = os.getenv("STAGE1_PHONETIC_WORDLIST", "")
+
+
+def _load_wordlist(path: str) -> frozenset:
+    if not path:
+        return frozenset()
+    with open(path, encoding="utf-8") as f:
+        return frozenset(w.strip().lower() for w in f if w.strip())
+
+
+PHONETIC_SKIP_WORDS = COMMON_WORDS | _load_wordlist(PHONETIC_WORDLIST)
+
 def normalize(s: str) -> str:
     # lowercase, trim, collapse whitespace, strip punctuation except common separators
 
@@ -78,37 +130,387 @@ def build_canonicals(metadata: Dict[str, Any]) -> Dict[str, str]:
     return canon
 
 
-def correct_transcript_segment(segment: Dict[str, Any],
-                               metadata: Dict[str, Any],
-                               add_terminal_period: bool = True,
-                               threshold: float = 80.0
-                            ) -> Dict[str, Any]:
-    
+def trigrams(s: str) -> set:
+    padded = f" {s} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def compact(s: str) -> str:
+    """Normalized phrase with separators removed: "micro soft" -> "microsoft"."""
+    return re.sub(r"[\s\-]+", "", s)
+
+
+def phrase_ratio(a: str, b: str) -> float:
+    if USE_RAPIDFUZZ:
+        return fuzz.ratio(a, b)
+    return difflib.SequenceMatcher(None, a, b).ratio() * 100
+
+
+_SOUNDEX_CODES = {c: d for letters, d in (("bfpv", "1"), ("cgjkqsxz", "2"), ("dt", "3"),
+                                            ("l", "4"), ("mn", "5"), ("r", "6")) for c in letters}
+
+
+def soundex(word: str) -> str:
+    """American Soundex ("summer", "samar" -> "S560"); "" when the word has no ASCII letters."""
+    letters = [c for c in word.lower() if "a" <= c <= "z"]
+    if not letters:
+        return ""
+    code, prev = letters[0].upper(), _SOUNDEX_CODES.get(letters[0], "")
+    for c in letters[1:]:
+        d = _SOUNDEX_CODES.get(c, "")
+        if d and d != prev:
+            code += d
+            if len(code) == 4:
+                break
+        # h / w do not separate letters with the same code; vowels do
+        if c not in "hw":
+            prev = d
+    return code.ljust(4, "0")
+
+
+def phonetic_key(word: str) -> str:
+    """Metaphone when jellyfish is installed, Soundex otherwise."""
+    if USE_JELLYFISH:
+        return jellyfish.metaphone(word)
+    return soundex(word)
+
+
+def metadata_fingerprint(metadata: Dict[str, Any]) -> str:
+    blob = json.dumps(metadata or {}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()
+
+
+class EntityIndex:
     """
-    Token level matching against metadata strings.
+    Canonicals compiled once per metadata dict: normalized keys, keys bucketed
+    by length and trigram postings, so a token is scored only against keys it
+    could plausibly match. Compacted keys get the same treatment for
+    multi-word spans, and single-word keys are also posted under their
+    phonetic key for the sound-alike fallback.
     """
 
-    canon = build_canonicals(metadata)
-    keys = list(canon.keys())
+    def __init__(self, canon: Dict[str, str], fingerprint: str = ""):
+        self.canon = canon
+        self.keys: List[str] = list(canon.keys())
+        self.fingerprint = fingerprint
+        # Single tokens are only scored against single-word keys; multi-word
+        # entities are left to the span matcher below (otherwise a lone
+        # "America" partial-matches "bank of america")
+        self.token_keys: List[str] = [k for k in self.keys if " " not in k]
+        self.by_length: Dict[int, List[int]] = {}
+        self.postings: Dict[str, List[int]] = {}
+        for i, k in enumerate(self.token_keys):
+            self.by_length.setdefault(len(k), []).append(i)
+            for g in trigrams(k):
+                self.postings.setdefault(g, []).append(i)
 
-    text = segment.get("text", "")
-    tokens = re.findall(r"\w+|\s+|[^\w\s]", text, re.UNICODE)
-    out: List[str] = []
-    changes: List[Dict[str, Any]] = []
+        # Phrase side: spans are compared on their compacted form, so both
+        # "bank of america" and split words like "chen nai" -> "chennai" match
+        self.compact_keys: List[str] = [compact(k) for k in self.keys]
+        self.compact_postings: Dict[str, List[int]] = {}
+        for i, ck in enumerate(self.compact_keys):
+            for g in trigrams(ck):
+                self.compact_postings.setdefault(g, []).append(i)
+        # Sound-alike side: phonetic key -> single-word key ids
+        self.phonetic: Dict[str, List[int]] = {}
+        for i, k in enumerate(self.token_keys):
+            code = phonetic_key(k) if len(k) >= PHONETIC_MIN_LEN else ""
+            if code:
+                self.phonetic.setdefault(code, []).append(i)
+        # Distinctive words of multi-word keys ("america" -> "bank of america")
+        self.phrase_words: Dict[str, List[str]] = {}
+        for k in self.keys:
+            if " " in k:
+                for w in set(k.split()):
+                    if len(w) >= PHONETIC_MIN_LEN and w not in STOPWORDS:
+                        self.phrase_words.setdefault(w, []).append(k)
+        longest = max((len(k.split()) for k in self.keys), default=1)
+        self.max_ngram = min(PHRASE_MAX_NGRAM, max(2, longest))
+
+    @classmethod
+    def from_metadata(cls, metadata: Dict[str, Any]) -> "EntityIndex":
+        return cls(build_canonicals(metadata), metadata_fingerprint(metadata))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def candidates(self, token: str, threshold: float) -> List[str]:
+        """
+        Keys worth scoring for `token`, in index order (so ties resolve the same
+        way as scoring the full key list).
+        """
+        if not USE_RAPIDFUZZ:
+            # difflib ratio is 2*M/(len(a)+len(b)) with M <= min length, so
+            # length alone rules out keys that can never reach the threshold
+            n, need = len(token), threshold / 100.0
+            ids = [
+                i
+                for length, bucket in self.by_length.items()
+                if 2 * min(n, length) / (n + length) >= need
+                for i in bucket
+            ]
+            return [self.token_keys[i] for i in sorted(ids)]
+
+        if len(self.token_keys) < CANDIDATE_MIN_KEYS:
+            return self.token_keys
+
+        ids = set()
+        for g in trigrams(token):
+            ids.update(self.postings.get(g, ()))
+        return [self.token_keys[i] for i in sorted(ids)]
+
+    def best(self, token: str, threshold: float) -> Tuple[str, float]:
+        return best_fuzzy(token, self.candidates(token, threshold), threshold)
+
+    def best_many(self, tokens: List[str], threshold: float) -> Dict[str, Tuple[str, float]]:
+        """
+        best() for many tokens at once, in a single vectorized rapidfuzz call:
+        a cdist matrix over all keys for small indexes, or cpdist over the
+        flattened (token, candidate) pairs once trigram pruning kicks in.
+        First max wins in both, so results match best() exactly.
+        """
+        if not USE_CDIST or not tokens or not self.token_keys:
+            return {t: self.best(t, threshold) for t in tokens}
+
+        scorer = getattr(fuzz, "WRatio", fuzz.partial_ratio)
+        out: Dict[str, Tuple[str, float]] = {}
+
+        if len(self.token_keys) < CANDIDATE_MIN_KEYS:
+            scores = process.cdist(tokens, self.token_keys, scorer=scorer, dtype=np.float64, workers=CDIST_WORKERS)
+            best_cols = scores.argmax(axis=1)
+            for row, t in enumerate(tokens):
+                col = int(best_cols[row])
+                score = float(scores[row, col])
+                out[t] = (self.token_keys[col], score) if score >= threshold else (None, score)
+            return out
+
+        per_token = [self.candidates(t, threshold) for t in tokens]
+        queries = [t for t, cands in zip(tokens, per_token) for _ in cands]
+        choices = [k for cands in per_token for k in cands]
+        scores = process.cpdist(queries, choices, scorer=scorer, dtype=np.float64, workers=CDIST_WORKERS) if choices else []
+
+        start = 0
+        for t, cands in zip(tokens, per_token):
+            if not cands:
+                out[t] = (None, 0.0)
+                continue
+            group = scores[start:start + len(cands)]
+            pos = int(group.argmax())
+            score = float(group[pos])
+            out[t] = (cands[pos], score) if score >= threshold else (None, score)
+            start += len(cands)
+        return out
+
+    def best_phonetic(self, tokens: List[str], threshold: float) -> Dict[str, Tuple[str, float]]:
+        """
+        Sound-alike matches: keys sharing the token's phonetic key whose plain
+        ratio reaches PHONETIC_MIN_SCORE and, plus PHONETIC_BOOST, `threshold`.
+        The best one wins, first in index order on ties; the returned score is
+        the plain ratio. Everyday words (PHONETIC_SKIP_WORDS) are never matched.
+        """
+        out: Dict[str, Tuple[str, float]] = {}
+        if not self.phonetic:
+            return out
+        for t in tokens:
+            if len(t) < PHONETIC_MIN_LEN or t in PHONETIC_SKIP_WORDS:
+                continue
+            best, score = None, 0.0
+            for i in self.phonetic.get(phonetic_key(t), ()):
+                r = phrase_ratio(t, self.token_keys[i])
+                if r > score:
+                    best, score = self.token_keys[i], r
+            if best is not None and score >= PHONETIC_MIN_SCORE and score + PHONETIC_BOOST >= threshold:
+                out[t] = (best, score)
+        return out
 
+    def phrase_candidates(self, span: str, threshold: float) -> List[int]:
+        """
+        Key ids worth scoring for a compacted span: at least two shared
+        trigrams, and a length inside the window `ratio` allows for the
+        threshold (2*min/(a+b) >= t).
+        """
+        hits: Dict[int, int] = {}
+        for g in trigrams(span):
+            for i in self.compact_postings.get(g, ()):
+                hits[i] = hits.get(i, 0) + 1
+        n, need = len(span), threshold / 100.0
+        lo, hi = n * need / (2 - need), n * (2 - need) / need
+        return sorted(
+            i for i, c in hits.items()
+            if c >= 2 and lo <= len(self.compact_keys[i]) <= hi
+        )
+
+    def best_phrases(self, spans: List[str], threshold: float) -> Dict[str, Tuple[str, float]]:
+        """
+        Best key per compacted span, scored with a plain ratio (partial matching
+        would let any span containing an entity win). All (span, candidate)
+        pairs go through one cpdist call when rapidfuzz + numpy are present.
+        """
+        per_span = [self.phrase_candidates(sp, threshold) for sp in spans]
+        queries = [sp for sp, ids in zip(spans, per_span) for _ in ids]
+        choices = [self.compact_keys[i] for ids in per_span for i in ids]
+        if not choices:
+            return {}
+        if USE_CDIST:
+            scores = process.cpdist(queries, choices, scorer=fuzz.ratio, dtype=np.float64, workers=CDIST_WORKERS)
+        else:
+            scores = [phrase_ratio(q, c) for q, c in zip(queries, choices)]
+
+        out: Dict[str, Tuple[str, float]] = {}
+        start = 0
+        for sp, ids in zip(spans, per_span):
+            if ids:
+                group = list(scores[start:start + len(ids)])
+                pos = max(range(len(ids)), key=lambda j: (group[j], -j))
+                if group[pos] >= threshold:
+                    out[sp] = (self.keys[ids[pos]], float(group[pos]))
+            start += len(ids)
+        return out
+
+    def mentions(self, texts: List[str], threshold: float) -> List[Dict[str, float]]:
+        """
+        Keys each text plausibly refers to, with their best score: the token
+        and phonetic passes of correct_transcript batched over all texts at a
+        (usually looser) `threshold`, plus multi-word keys one of whose words
+        appears verbatim (scored at `threshold`). Meant for Stage-1 output,
+        where matched spans already read as their canonical.
+        """
+        words = [_match_candidates(TOKEN_RE.findall(t)) for t in texts]
+        unique = list(dict.fromkeys(w for seg in words for w in seg))
+        matches = {w: m for w, m in self.best_many(unique, threshold).items() if m[0] is not None}
+        if PHONETIC_ENABLED:
+            matches.update(self.best_phonetic([w for w in unique if w not in matches], threshold))
+
+        out: List[Dict[str, float]] = []
+        for seg_words in words:
+            found: Dict[str, float] = {}
+            for w in seg_words:
+                hits = [matches[w]] if w in matches else []
+                hits += [(k, threshold) for k in self.phrase_words.get(w, ())]
+                for key, score in hits:
+                    if score > found.get(key, 0.0):
+                        found[key] = score
+            out.append(found)
+        return out
+
+_index_cache: "OrderedDict[str, EntityIndex]" = OrderedDict()
+_index_lock = threading.Lock()
+
+
+def get_index(metadata: Dict[str, Any]) -> EntityIndex:
+    """Returns the compiled EntityIndex for `metadata`, cached by fingerprint (LRU)."""
+    fp = metadata_fingerprint(metadata)
+    with _index_lock:
+        index = _index_cache.get(fp)
+        if index is not None:
+            _index_cache.move_to_end(fp)
+            return index
+
+    index = EntityIndex(build_canonicals(metadata), fp)
+    with _index_lock:
+        _index_cache[fp] = index
+        while len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return index
+
+
+TOKEN_RE = re.compile(r"\w+|\s+|[^\w\s]", re.UNICODE)
+WORD_RE = re.compile(r"\w+")
+# What may sit between two words of one span
+SPAN_GAP_RE = re.compile(r"\s+|-")
+
+Span = Tuple[int, int, str]   # (first token idx, last token idx + 1, compacted text)
+
+
+def _is_matchable(tn: str) -> bool:
+    # Skip smol short tokens and common words :3
+    return len(tn) >= 3 and tn not in STOPWORDS
+
+
+def _match_candidates(tokens: List[str]) -> List[str]:
+    """Normalized forms of the tokens that are worth matching."""
+    out: List[str] = []
     for t in tokens:
-        if not re.match(r"\w+", t):
-            out.append(t)
+        if not WORD_RE.match(t):
             continue
         tn = normalize(t)
+        if _is_matchable(tn):
+            out.append(tn)
+    return out
 
-        # Skip smol short tokens and common words :3
 
-        if len(tn) < 3 or tn in STOPWORDS:
-            out.append(t)
+def _spans(tokens: List[str], max_ngram: int) -> List[Span]:
+    """
+    Runs of 2..max_ngram words joined only by whitespace or hyphens, longest
+    first at each start. Edge words must not be stopwords; inner ones may be
+    ("bank of america").
+    """
+    words = [i for i, t in enumerate(tokens) if WORD_RE.match(t)]
+    out: List[Span] = []
+    for a in range(len(words)):
+        first = normalize(tokens[words[a]])
+        if len(first) < 2 or first in STOPWORDS:
+            continue
+        found: List[Span] = []
+        for b in range(a + 1, min(a + max_ngram, len(words))):
+            gap = tokens[words[b - 1] + 1:words[b]]
+            if not gap or not all(SPAN_GAP_RE.fullmatch(g) for g in gap):
+                break
+            last = normalize(tokens[words[b]])
+            if len(last) < 2 or last in STOPWORDS:
+                continue
+            phrase = compact(normalize("".join(tokens[words[a]:words[b] + 1])))
+            if len(phrase) >= 4:
+                found.append((words[a], words[b] + 1, phrase))
+        out.extend(reversed(found))
+    return out
+
+
+def _choose_spans(spans: List[Span], phrase_matches: Dict[str, Tuple[str, float]]) -> List[Span]:
+    """Greedy left-to-right, longest matching span first, no overlaps."""
+    chosen: List[Span] = []
+    end = -1
+    for sp in sorted(spans, key=lambda x: (x[0], -(x[1] - x[0]))):
+        if sp[0] >= end and sp[2] in phrase_matches:
+            chosen.append(sp)
+            end = sp[1]
+    return chosen
+
+
+def _apply_matches(segment: Dict[str, Any],
+                   tokens: List[str],
+                   canon: Dict[str, str],
+                   chosen: List[Span],
+                   phrase_matches: Dict[str, Tuple[str, float]],
+                   matches: Dict[str, Tuple[str, float]],
+                   add_terminal_period: bool,
+                   phonetic: Optional[Dict[str, Tuple[str, float]]] = None
+                ) -> Dict[str, Any]:
+    out: List[str] = []
+    changes: List[Dict[str, Any]] = []
+    starts = {sp[0]: sp for sp in chosen}
+
+    i = 0
+    while i < len(tokens):
+        if i in starts:
+            first, stop, phrase = starts[i]
+            original = "".join(tokens[first:stop])
+            cand_key, score = phrase_matches[phrase]
+            rep = smart_case(canon[cand_key], original)
+            out.append(rep)
+            if rep != original:
+                changes.append({"from": original, "to": rep, "reason": f"phrase:{int(score)}"})
+            i = stop
             continue
 
-        cand_key, score = best_fuzzy(tn, keys, threshold)
+        t = tokens[i]
+        i += 1
+        tn = normalize(t) if WORD_RE.match(t) else ""
+        cand_key, score = matches.get(tn, (None, 0.0)) if tn else (None, 0.0)
+        reason = "fuzzy"
+        if not cand_key and phonetic and tn in phonetic:
+            cand_key, score = phonetic[tn]
+            reason = "phonetic"
 
         if cand_key:
             raw_representation = canon[cand_key]
@@ -116,7 +518,7 @@ def correct_transcript_segment(segment: Dict[str, Any],
 
             if rep != t:
                 out.append(rep)
-                changes.append({"from": t, "to": rep, "reason": f"fuzzy:{int(score)}"})
+                changes.append({"from": t, "to": rep, "reason": f"{reason}:{int(score)}"})
             else:
                 out.append(t)
         
@@ -134,3 +536,57 @@ def correct_transcript_segment(segment: Dict[str, Any],
     out["_stage1_changes"] = changes
     return out
 
+
+def correct_transcript(segments: List[Dict[str, Any]],
+                       metadata: Dict[str, Any],
+                       add_terminal_period: bool = True,
+                       threshold: float = 80.0,
+                       index: Optional[EntityIndex] = None,
+                       phrase_threshold: Optional[float] = None
+                    ) -> List[Dict[str, Any]]:
+    """
+    Stage 1 for a whole transcript (or several sharing the same metadata).
+    Multi-word spans are matched first against compacted canonicals; the
+    remaining single tokens across all segments are then scored in one batch,
+    and those still unmatched get the phonetic fallback.
+    """
+    index = index if index is not None else get_index(metadata)
+    phrase_threshold = PHRASE_THRESHOLD if phrase_threshold is None else phrase_threshold
+
+    tokenized = [TOKEN_RE.findall(seg.get("text", "")) for seg in segments]
+
+    # Pass 1: word spans
+    spans = [_spans(tokens, index.max_ngram) if index.keys else [] for tokens in tokenized]
+    unique_spans = list(dict.fromkeys(sp[2] for seg_spans in spans for sp in seg_spans))
+    phrase_matches = index.best_phrases(unique_spans, phrase_threshold) if unique_spans else {}
+    chosen = [_choose_spans(seg_spans, phrase_matches) for seg_spans in spans]
+
+    # Pass 2: single tokens outside the chosen spans
+    unique: Dict[str, None] = {}
+    for tokens, seg_chosen in zip(tokenized, chosen):
+        covered = {i for first, stop, _ in seg_chosen for i in range(first, stop)}
+        free = [t for i, t in enumerate(tokens) if i not in covered]
+        for tn in _match_candidates(free):
+            unique.setdefault(tn, None)
+    matches = index.best_many(list(unique), threshold)
+    phonetic = index.best_phonetic([t for t, (k, _) in matches.items() if k is None], threshold) \
+        if PHONETIC_ENABLED else {}
+
+    return [
+        _apply_matches(seg, tokens, index.canon, seg_chosen, phrase_matches, matches, add_terminal_period, phonetic)
+        for seg, tokens, seg_chosen in zip(segments, tokenized, chosen)
+    ]
+
+
+def correct_transcript_segment(segment: Dict[str, Any],
+                               metadata: Dict[str, Any],
+                               add_terminal_period: bool = True,
+                               threshold: float = 80.0,
+                               index: Optional[EntityIndex] = None
+                            ) -> Dict[str, Any]:
+    
+    """
+    Token level matching against metadata strings.
+    Pass a prebuilt `index` to reuse it across segments of the same request.
+    """
+    return correct_transcript([segment], metadata, add_terminal_period, threshold, index)[0]
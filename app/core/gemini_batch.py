@@ -0,0 +1,159 @@
+import os, time
+from typing import Any, Dict, List, Optional, Tuple
+from google.genai import types
+from app.core.gemini_client import Step2Gemini
+from app.core.step2_orchestrator import Job, _build_jobs, _collect, _gate, _to_result
+from app.core.metrics import record_usage
+from app.core.prompt_compaction import MetadataCompactor
+from app.models.schemas_step2 import Step2SegmentResult
+
+# Gemini Batch API backend for Step 2: every segment prompt of one or more
+# transcripts goes into a single asynchronous batch job (batch pricing, no
+# interactive rate limits). Meant for backfills, not request paths.
+BATCH_POLL_INTERVAL_S = float(os.getenv("STEP2_BATCH_API_POLL_INTERVAL_S", "30"))
+BATCH_TIMEOUT_S = float(os.getenv("STEP2_BATCH_API_TIMEOUT_S", "86400"))
+
+DONE_STATES = {
+    types.JobState.JOB_STATE_SUCCEEDED,
+    types.JobState.JOB_STATE_PARTIALLY_SUCCEEDED,
+    types.JobState.JOB_STATE_FAILED,
+    types.JobState.JOB_STATE_CANCELLED,
+    types.JobState.JOB_STATE_EXPIRED,
+}
+
+# One transcript: (metadata, transcript_segments, step1_texts, step1_changes)
+BatchItem = Tuple[Dict[str, Any], List[Dict[str, Any]], List[str], List[List[Dict[str, Any]]]]
+
+
+class Step2BatchRunner:
+    """
+    Runs Step 2 through the Gemini Batch API. Prompts, config and response
+    validation are Step2Gemini's (same prompt, _read/_parse_or_repair), and
+    its cache is consulted before and filled after the job. The LLM gate
+    still applies. Segments without a valid response fall back to their
+    Stage-1 text with a "segment {idx}: ..." warning; there is no
+    interactive retry. `client` defaults to gemini.client (any object with
+    a compatible `.batches`, e.g. app.utils.fake_gemini.FakeGeminiClient).
+    """
+
+    def __init__(self,
+                 gemini: Step2Gemini,
+                 client: Any = None,
+                 poll_interval_s: float = BATCH_POLL_INTERVAL_S,
+                 timeout_s: float = BATCH_TIMEOUT_S):
+        self.gemini = gemini
+        self.client = client or gemini.client
+        self.poll_interval_s = poll_interval_s
+        self.timeout_s = timeout_s
+        self.last_job: Optional[types.BatchJob] = None
+
+    def _cache_key(self, metadata: Dict[str, Any], job: Job) -> Optional[str]:
+        return self.gemini._cache_key(metadata, *job) if self.gemini.cache is not None else None
+
+    def submit(self, requests: List[types.InlinedRequest], display_name: Optional[str] = None) -> types.BatchJob:
+        return self.client.batches.create(
+            model=self.gemini.model,
+            src=requests,
+            config=types.CreateBatchJobConfig(display_name=display_name or f"step2-{int(time.time())}"),
+        )
+
+    def wait(self, name: str) -> types.BatchJob:
+        """Polls until the job reaches a final state; cancels it past timeout_s."""
+        deadline = time.monotonic() + self.timeout_s
+        while True:
+            job = self.client.batches.get(name=name)
+            if job.state in DONE_STATES:
+                return job
+            if time.monotonic() >= deadline:
+                try:
+                    self.client.batches.cancel(name=name)
+                except Exception:
+                    pass
+                raise TimeoutError(f"batch job {name} still {job.state} after {self.timeout_s:.0f}s")
+            time.sleep(self.poll_interval_s)
+
+    def _responses(self, job: types.BatchJob, keys: List[str]) -> Dict[str, Any]:
+        """Maps request keys to InlinedResponse, by metadata key or else by position."""
+        inlined = (job.dest.inlined_responses if job.dest is not None else None) or []
+        out: Dict[str, Any] = {}
+        for pos, item in enumerate(inlined):
+            key = (item.metadata or {}).get("key") or (keys[pos] if pos < len(keys) else None)
+            if key is not None:
+                out[key] = item
+        return out
+
+    def _outcome(self, item: Any, state: Any) -> Any:
+        if item is None:
+            return ValueError(f"missing from batch output ({state})")
+        if item.error is not None:
+            return RuntimeError(f"batch error {item.error.code}: {item.error.message}")
+        record_usage(item.response)
+        try:
+            return self.gemini._read(item.response, after_retry=True)
+        except Exception as e:
+            return e
+
+    def run(self, items: List[BatchItem], gate: Optional[bool] = None,
+            display_name: Optional[str] = None) -> List[Tuple[List[Step2SegmentResult], List[str]]]:
+        """Refines several transcripts in one batch job; returns run_step2-shaped results per transcript."""
+        all_jobs: List[List[Job]] = []
+        outcomes: List[Dict[int, Any]] = []
+        requests: List[types.InlinedRequest] = []
+        pending: Dict[str, Tuple[int, int, Optional[str]]] = {}
+
+        for t, (metadata, segments, s1_texts, s1_changes) in enumerate(items):
+            jobs = _build_jobs(segments, s1_texts, s1_changes)
+            local, todo = _gate(jobs, gate, metadata)
+            all_jobs.append(jobs)
+            outcomes.append(dict(local))
+            compactor = MetadataCompactor(metadata, jobs, todo) if todo else None
+            for idx in todo:
+                seg_metadata = compactor.for_window([idx])
+                ck = self._cache_key(seg_metadata, jobs[idx])
+                cached = self.gemini.cache.get(ck) if ck is not None else None
+                if cached is not None:
+                    outcomes[t][idx] = _to_result(cached)
+                    continue
+                key = f"{t}:{idx}"
+                prompt, _ = self.gemini._prompts(seg_metadata, *jobs[idx])
+                requests.append(types.InlinedRequest(
+                    model=self.gemini.model, contents=prompt,
+                    config=self.gemini._config(0.2), metadata={"key": key},
+                ))
+                pending[key] = (t, idx, ck)
+
+        if requests:
+            try:
+                job = self.submit(requests, display_name)
+                self.last_job = job = self.wait(job.name)
+                responses, state = self._responses(job, list(pending)), job.state
+                failure = None if job.state != types.JobState.JOB_STATE_FAILED else RuntimeError(
+                    f"batch job {job.name} failed: {job.error.message if job.error else job.state}"
+                )
+            except Exception as e:
+                responses, state, failure = {}, None, e
+
+            for key, (t, idx, ck) in pending.items():
+                outcome = failure or self._outcome(responses.get(key), state)
+                if isinstance(outcome, dict):
+                    try:
+                        data, outcome = outcome, _to_result(outcome)
+                        if ck is not None:
+                            self.gemini.cache.put(ck, data)
+                    except Exception as e:
+                        outcome = e
+                outcomes[t][idx] = outcome
+
+        return [_collect(jobs, done) for jobs, done in zip(all_jobs, outcomes)]
+
+
+def run_step2_batch(gemini: Step2Gemini,
+                    metadata: Dict[str, Any],
+                    transcript_segments: List[Dict[str, Any]],
+                    step1_texts: List[str],
+                    step1_changes: List[List[Dict[str, Any]]],
+                    gate: Optional[bool] = None,
+                    client: Any = None):
+    """run_step2 for a single transcript via the Batch API (blocks until the job finishes)."""
+    runner = Step2BatchRunner(gemini, client=client)
+    return runner.run([(metadata, transcript_segments, step1_texts, step1_changes)], gate=gate)[0]
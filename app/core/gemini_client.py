@@ -1,100 +1,452 @@
 import os, json
-from typing import Any, Dict
-from google import genai
-from app.core.prompt_step2 import SYSTEM_INSTRUCTION, build_prompt
+from typing import Any, Callable, Dict, List, Optional
+from app.core.prompt_step2 import PROMPT_VERSION, SYSTEM_INSTRUCTION, BATCH_INSTRUCTION, CONTEXT_INSTRUCTION, build_prompt, build_batch_prompt
+from app.core.step2_cache import Step2Cache, cache_key, get_default_cache
+from app.core.rate_limit import GeminiScheduler, get_scheduler
+from app.core.gemini_provider import GeminiClientProvider, get_provider
+from app.core.context_cache import CONTEXT_CACHE_ENABLED, CONTEXT_CACHE_METADATA, ContextCache
+from app.core.deadline import current_expiry
+from app.core.metrics import LLM_CALLS, REPAIR_RETRIES, record_usage, timed
+from app.models.schemas_step2 import Step2SegmentResult
 from google.genai import types
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash-lite")
 
+# Output budget per segment; batch calls scale it with the window size
+SEGMENT_MAX_OUTPUT_TOKENS = 1024
+BATCH_MAX_OUTPUT_TOKENS = int(os.getenv("STEP2_BATCH_MAX_OUTPUT_TOKENS", "8192"))
+
+STRICT_REMINDER = (
+    "Return a single JSON object only with keys 'text' and 'edits'; "
+    "do not include markdown, prose, or extra keys."
+)
+
+SEGMENT_SCHEMA = types.Schema(
+    type=types.Type.OBJECT,
+    properties={
+        "text": types.Schema(type=types.Type.STRING),
+        "edits": types.Schema(
+            type=types.Type.ARRAY,
+            items=types.Schema(
+                type=types.Type.OBJECT,
+                properties={
+                    "type": types.Schema(type=types.Type.STRING),
+                    "from": types.Schema(type=types.Type.STRING, nullable=True),
+                    "to": types.Schema(type=types.Type.STRING, nullable=True),
+                    "why": types.Schema(type=types.Type.STRING, nullable=True),
+                },
+                required=["type"],
+            ),
+        ),
+    },
+    required=["text", "edits"]
+)
+
+BATCH_SCHEMA = types.Schema(
+    type=types.Type.OBJECT,
+    properties={
+        "segments": types.Schema(
+            type=types.Type.ARRAY,
+            items=types.Schema(
+                type=types.Type.OBJECT,
+                properties={
+                    "index": types.Schema(type=types.Type.INTEGER),
+                    "text": SEGMENT_SCHEMA.properties["text"],
+                    "edits": SEGMENT_SCHEMA.properties["edits"],
+                },
+                required=["index", "text", "edits"],
+            ),
+        ),
+    },
+    required=["segments"]
+)
+
+
+_DEFAULT = object()
+
+
+def _cacheable(data: Dict[str, Any]) -> bool:
+    """
+    Whether a parsed response validates as a Step2SegmentResult. _read only
+    checks the keys; anything the orchestrator would turn into a fallback
+    (e.g. an unknown edit type) must not be served from the cache for a day.
+    """
+    try:
+        Step2SegmentResult.model_validate({"text": data["text"], "edits": data["edits"]})
+    except Exception:
+        return False
+    return True
+
+
 class Step2Gemini:
-    def __init__(self, api_key: str | None = None, model: str | None = None):
-        key = api_key or os.getenv("GEMINI_API_KEY")
+    name = "gemini"
+    source = "llm"
 
-        if not key:
-            raise RuntimeError("GEMINI_API_KEY NOT FOUND")
-        
-        self.client = genai.Client(api_key=key)
+    def __init__(self, api_key: str | None = None, model: str | None = None,
+                 cache: Optional[Step2Cache] = _DEFAULT,
+                 scheduler: Optional[GeminiScheduler] = _DEFAULT,
+                 context_cache: Optional[ContextCache] = _DEFAULT):
+        # The process-wide pooled client unless a key is passed; either way it is
+        # only built on first use, so a missing GEMINI_API_KEY fails calls, not startup
+        self.provider = get_provider() if api_key is None else GeminiClientProvider(api_key)
+        self._client: Any = None
         self.model = model or GEMINI_MODEL
+        # Shared process-wide cache unless one (or None to disable) is passed
+        self.cache = get_default_cache() if cache is _DEFAULT else cache
+        # Shared quota / retry / breaker state; None calls the API directly.
+        # Retries and per-attempt timeouts stop at the current request's deadline.
+        self.scheduler = get_scheduler() if scheduler is _DEFAULT else scheduler
+        # Cached-content handles for the system instruction (GEMINI_CONTEXT_CACHE); None sends it inline.
+        # Looks the client up per call, so a swapped self.client (benchmark) is used for handles too.
+        if context_cache is _DEFAULT:
+            context_cache = ContextCache(lambda: self.client, self.model) if CONTEXT_CACHE_ENABLED else None
+        self.context_cache = context_cache
+
+    @property
+    def client(self) -> Any:
+        return self._client if self._client is not None else self.provider.get()
+
+    @client.setter
+    def client(self, value: Any):
+        # A fixed client (FakeGeminiClient in the benchmark) takes precedence over the provider
+        self._client = value
+
+    def close(self):
+        """Deletes this backend's cached-content handles (lifespan shutdown)."""
+        if self.context_cache is not None:
+            self.context_cache.clear()
+
+    def _estimate_tokens(self, contents: str, config: types.GenerateContentConfig) -> int:
+        # ~4 chars per token for the prompt plus the full output budget
+        return len(contents) // 4 + (config.max_output_tokens or 0)
+
+    def _usage_tokens(self, resp: Any) -> Optional[int]:
+        usage = getattr(resp, "usage_metadata", None)
+        return getattr(usage, "total_token_count", None) if usage is not None else None
+
+    def _with_timeout(self, config: types.GenerateContentConfig, timeout_s: float) -> types.GenerateContentConfig:
+        return config.model_copy(update={"http_options": types.HttpOptions(timeout=int(timeout_s * 1000))})
+
+    def _call(self, contents: str, config: types.GenerateContentConfig) -> Any:
+        if self.scheduler is None:
+            return self.client.models.generate_content(model=self.model, contents=contents, config=config)
+        return self.scheduler.call(
+            lambda timeout_s: self.client.models.generate_content(
+                model=self.model, contents=contents, config=self._with_timeout(config, timeout_s)),
+            est_tokens=self._estimate_tokens(contents, config),
+            deadline=current_expiry(),
+            usage=self._usage_tokens,
+        )
+
+    async def _acall(self, contents: str, config: types.GenerateContentConfig) -> Any:
+        if self.scheduler is None:
+            return await self.client.aio.models.generate_content(model=self.model, contents=contents, config=config)
+        return await self.scheduler.acall(
+            lambda timeout_s: self.client.aio.models.generate_content(
+                model=self.model, contents=contents, config=self._with_timeout(config, timeout_s)),
+            est_tokens=self._estimate_tokens(contents, config),
+            deadline=current_expiry(),
+            usage=self._usage_tokens,
+        )
+
+    def _generate(self, contents: str, config: types.GenerateContentConfig,
+                  kind: str = "segment", stage: str = "gemini") -> Any:
+        """One timed and counted Gemini call; `stage` separates the repair retry from first attempts."""
+        with timed(stage):
+            try:
+                resp = self._call(contents, config)
+            except Exception:
+                LLM_CALLS.inc(kind=kind, outcome="error")
+                raise
+        LLM_CALLS.inc(kind=kind, outcome="ok")
+        record_usage(resp)
+        return resp
+
+    async def _agenerate(self, contents: str, config: types.GenerateContentConfig,
+                         kind: str = "segment", stage: str = "gemini") -> Any:
+        with timed(stage):
+            try:
+                resp = await self._acall(contents, config)
+            except Exception:
+                LLM_CALLS.inc(kind=kind, outcome="error")
+                raise
+        LLM_CALLS.inc(kind=kind, outcome="ok")
+        record_usage(resp)
+        return resp
+
+    def _handle(self, instruction: str, metadata: Dict[str, Any]) -> Optional[str]:
+        """Cached-content handle for this prompt prefix, or None to send it inline."""
+        if self.context_cache is None:
+            return None
+        return self.context_cache.handle(instruction, metadata if CONTEXT_CACHE_METADATA else None)
+
+    async def _ahandle(self, instruction: str, metadata: Dict[str, Any]) -> Optional[str]:
+        if self.context_cache is None:
+            return None
+        return await self.context_cache.ahandle(instruction, metadata if CONTEXT_CACHE_METADATA else None)
+
+    def _send(self, contents: str, config: types.GenerateContentConfig, inline: Callable[[], str],
+              kind: str = "segment", stage: str = "gemini") -> Any:
+        """
+        _generate for a prompt that may use a cached-content handle. If the API
+        rejects the handle (expired, deleted, wrong model), it is dropped and the
+        call is resent once with the full inline prompt from `inline()`.
+        """
+        if not config.cached_content:
+            return self._generate(contents, config, kind, stage)
+        try:
+            return self._generate(contents, config, kind, stage)
+        except Exception as e:
+            if not self.context_cache.is_stale(e):
+                raise
+            self.context_cache.invalidate(config.cached_content)
+        return self._generate(inline(), config.model_copy(update={"cached_content": None}), kind, stage)
+
+    async def _asend(self, contents: str, config: types.GenerateContentConfig, inline: Callable[[], str],
+                     kind: str = "segment", stage: str = "gemini") -> Any:
+        if not config.cached_content:
+            return await self._agenerate(contents, config, kind, stage)
+        try:
+            return await self._agenerate(contents, config, kind, stage)
+        except Exception as e:
+            if not self.context_cache.is_stale(e):
+                raise
+            self.context_cache.invalidate(config.cached_content)
+        return await self._agenerate(inline(), config.model_copy(update={"cached_content": None}), kind, stage)
+
+    def _cache_key(self, metadata: Dict[str, Any], original_text: str, step1_text: str, step1_changes: list,
+                   context: Optional[List[str]] = None) -> str:
+        return cache_key(self.model, PROMPT_VERSION, metadata, original_text, step1_text, step1_changes, context)
 
     def _parse_or_repair(self, txt:str) -> Dict[str, Any]:
         try:
             return json.loads(txt)
-        
+
         except Exception:
             s, e = txt.find("{"), txt.rfind("}")
             if s != -1 and e != -1 and e > s:
                 return json.loads(txt[s:e+1])
             raise
 
-    def refine_segment(self, metadata: Dict[str, Any], original_text: str, step1_text: str, step1_changes: list) -> Dict[str, Any]:
-        user_payload = build_prompt(metadata, original_text, step1_text, step1_changes)
-        prompt = f"{SYSTEM_INSTRUCTION}\n\n{user_payload}"
-
-
-        schema = types.Schema(
-            type=types.Type.OBJECT,
-            properties={
-                "text": types.Schema(type=types.Type.STRING),
-                "edits": types.Schema(
-                    type=types.Type.ARRAY,
-                    items=types.Schema(
-                        type=types.Type.OBJECT,
-                        properties={
-                            "type": types.Schema(type=types.Type.STRING),
-                            "from": types.Schema(type=types.Type.STRING, nullable=True),
-                            "to": types.Schema(type=types.Type.STRING, nullable=True),
-                            "why": types.Schema(type=types.Type.STRING, nullable=True),
-                        },
-                        required=["type"],
-                    ),
-                ),
-            },
-            required=["text", "edits"]
+    def _parse_batch(self, txt: str) -> List[Any]:
+        """
+        Returns the entries of {"segments": [...]}. If the document is cut off or
+        malformed, salvages every complete entry up to the first broken one.
+        """
+        try:
+            data = json.loads(txt)
+            if isinstance(data, dict) and isinstance(data.get("segments"), list):
+                return data["segments"]
+            if isinstance(data, list):
+                return data
+
+        except Exception:
+            pass
+
+        start = txt.find("[")
+        if start == -1:
+            return []
+        decoder = json.JSONDecoder()
+        items: List[Any] = []
+        pos = start + 1
+        while True:
+            while pos < len(txt) and txt[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(txt) or txt[pos] == "]":
+                break
+            try:
+                item, pos = decoder.raw_decode(txt, pos)
+            except ValueError:
+                break
+            items.append(item)
+        return items
+
+    def _config(self, temperature: float, schema: types.Schema = SEGMENT_SCHEMA,
+                max_output_tokens: int = SEGMENT_MAX_OUTPUT_TOKENS,
+                cached_content: Optional[str] = None) -> types.GenerateContentConfig:
+        return types.GenerateContentConfig(
+            response_mime_type="application/json",
+            response_schema=schema,
+            temperature=temperature,
+            top_p=0.9,
+            max_output_tokens=max_output_tokens,
+            cached_content=cached_content,
         )
 
+    def _instruction(self, context: Optional[List[str]]) -> str:
+        return f"{SYSTEM_INSTRUCTION}\n\n{CONTEXT_INSTRUCTION}" if context else SYSTEM_INSTRUCTION
+
+    def _prompts(self, metadata: Dict[str, Any], original_text: str, step1_text: str, step1_changes: list,
+                 context: Optional[List[str]] = None, cached: bool = False) -> tuple[str, str]:
+        """(prompt, strict retry prompt); `cached` leaves out what a cached-content handle already holds."""
+        with timed("prompt"):
+            sent_metadata = None if cached and CONTEXT_CACHE_METADATA else metadata
+            user_payload = build_prompt(sent_metadata, original_text, step1_text, step1_changes, context)
+            if cached:
+                return user_payload, f"{STRICT_REMINDER}\n\n{user_payload}"
+            instruction = self._instruction(context)
+            prompt = f"{instruction}\n\n{user_payload}"
+            # Retry prompt reiterates the output constraints
+            strict_prompt = f"{instruction}\n\n{STRICT_REMINDER}\n\n{user_payload}"
+        return prompt, strict_prompt
+
+    def _text_of(self, resp: Any) -> str:
+        return getattr(resp, "text", None) or getattr(resp, "output_text", "")
+
+    def _read(self, resp: Any, after_retry: bool = False) -> Dict[str, Any]:
+        txt = self._text_of(resp)
+        with timed("parse"):
+            data = self._parse_or_repair(txt)
+        if not isinstance(data, dict) or "text" not in data or "edits" not in data:
+            if after_retry:
+                raise ValueError("Phase 2: invalid model output schema (after retry)")
+            raise ValueError("schema_miss")
+        return data
+
+    def refine_segment(self, metadata: Dict[str, Any], original_text: str, step1_text: str, step1_changes: list,
+                       context: Optional[List[str]] = None) -> Dict[str, Any]:
+        if self.cache is None:
+            return self._refine_segment(metadata, original_text, step1_text, step1_changes, context)
+        key = self._cache_key(metadata, original_text, step1_text, step1_changes, context)
+        data = self.cache.get(key)
+        if data is None:
+            data = self._refine_segment(metadata, original_text, step1_text, step1_changes, context)
+            if _cacheable(data):
+                self.cache.put(key, data)
+        return data
+
+    async def arefine_segment(self, metadata: Dict[str, Any], original_text: str, step1_text: str, step1_changes: list,
+                              context: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Async twin of refine_segment using the SDK's aio client."""
+        if self.cache is None:
+            return await self._arefine_segment(metadata, original_text, step1_text, step1_changes, context)
+        key = self._cache_key(metadata, original_text, step1_text, step1_changes, context)
+        data = await self.cache.aget(key)
+        if data is None:
+            data = await self._arefine_segment(metadata, original_text, step1_text, step1_changes, context)
+            if _cacheable(data):
+                await self.cache.aput(key, data)
+        return data
+
+    def _refine_segment(self, metadata: Dict[str, Any], original_text: str, step1_text: str, step1_changes: list,
+                        context: Optional[List[str]] = None) -> Dict[str, Any]:
+        handle = self._handle(self._instruction(context), metadata)
+        prompt, strict_prompt = self._prompts(metadata, original_text, step1_text, step1_changes, context,
+                                              cached=handle is not None)
+        inline = lambda: self._prompts(metadata, original_text, step1_text, step1_changes, context)
+
         # First attempt with structured output
-        resp = self.client.models.generate_content(
-            model=self.model,
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                response_mime_type="application/json",
-                response_schema=schema,
-                temperature=0.2,
-                top_p=0.9,
-                max_output_tokens=1024
-            ),
-        )
-        txt = getattr(resp, "text", None) or getattr(resp, "output_text", "")
-        
+        resp = self._send(prompt, self._config(0.2, cached_content=handle), lambda: inline()[0])
         try:
-            data = self._parse_or_repair(txt)
-            if not isinstance(data, dict) or "text" not in data or "edits" not in data:
-                raise ValueError("schema_miss")
-            return data
-        
+            return self._read(resp)
+
         except Exception:
             # One strict retry that reiterates constraints
-            strict_prompt = (
-                f"{SYSTEM_INSTRUCTION}\n\n"
-                "Return a single JSON object only with keys 'text' and 'edits'; "
-                "do not include markdown, prose, or extra keys.\n\n"
-                f"{user_payload}"
-            )
-            resp2 = self.client.models.generate_content(
-                model=self.model,
-                contents=strict_prompt,
-                config=types.GenerateContentConfig(
-                    response_mime_type="application/json",
-                    response_schema=schema,
-                    temperature=0.1,
-                    top_p=0.9,
-                    max_output_tokens=1024,
-                ),
-            )
-            txt2 = getattr(resp2, "text", None) or getattr(resp2, "output_text", "")
-            data2 = self._parse_or_repair(txt2)
-            if not isinstance(data2, dict) or "text" not in data2 or "edits" not in data2:
-                raise ValueError("Phase 2: invalid model output schema (after retry)")
-            return data2
+            REPAIR_RETRIES.inc()
+            resp2 = self._send(strict_prompt, self._config(0.1, cached_content=handle), lambda: inline()[1],
+                               stage="repair")
+            return self._read(resp2, after_retry=True)
+
+    async def _arefine_segment(self, metadata: Dict[str, Any], original_text: str, step1_text: str, step1_changes: list,
+                               context: Optional[List[str]] = None) -> Dict[str, Any]:
+        handle = await self._ahandle(self._instruction(context), metadata)
+        prompt, strict_prompt = self._prompts(metadata, original_text, step1_text, step1_changes, context,
+                                              cached=handle is not None)
+        inline = lambda: self._prompts(metadata, original_text, step1_text, step1_changes, context)
+
+        resp = await self._asend(prompt, self._config(0.2, cached_content=handle), lambda: inline()[0])
+        try:
+            return self._read(resp)
+
+        except Exception:
+            REPAIR_RETRIES.inc()
+            resp2 = await self._asend(strict_prompt, self._config(0.1, cached_content=handle), lambda: inline()[1],
+                                      stage="repair")
+            return self._read(resp2, after_retry=True)
+
+    def _batch_request(self, metadata: Dict[str, Any], segments: List[Dict[str, Any]],
+                       context: Optional[List[str]] = None,
+                       handle: Optional[str] = None) -> tuple[str, types.GenerateContentConfig]:
+        """Prompt and config for one window; with a handle, the instructions (and cached metadata) are left out."""
+        with timed("prompt"):
+            sent_metadata = None if handle and CONTEXT_CACHE_METADATA else metadata
+            prompt = build_batch_prompt(sent_metadata, segments, context)
+            if not handle:
+                prompt = f"{self._batch_instruction(context)}\n\n{prompt}"
+        max_tokens = min(BATCH_MAX_OUTPUT_TOKENS, SEGMENT_MAX_OUTPUT_TOKENS * len(segments))
+        return prompt, self._config(0.2, schema=BATCH_SCHEMA, max_output_tokens=max_tokens, cached_content=handle)
+
+    def _batch_instruction(self, context: Optional[List[str]]) -> str:
+        return f"{self._instruction(context)}\n\n{BATCH_INSTRUCTION}"
+
+    def _read_batch(self, resp: Any, segments: List[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+        wanted = {s["index"] for s in segments}
+        out: Dict[int, Dict[str, Any]] = {}
+        with timed("parse"):
+            items = self._parse_batch(self._text_of(resp))
+        for item in items:
+            if not isinstance(item, dict) or "text" not in item or "edits" not in item:
+                continue
+            try:
+                idx = int(item.get("index"))
+            except (TypeError, ValueError):
+                continue
+            if idx in wanted and idx not in out:
+                out[idx] = {"text": item["text"], "edits": item["edits"]}
+        return out
+
+    def _batch_keys(self, metadata: Dict[str, Any], segments: List[Dict[str, Any]],
+                    context: Optional[List[str]] = None) -> Dict[int, str]:
+        return {
+            s["index"]: self._cache_key(metadata, s["original"], s["stage1_text"], s["stage1_changes"], context)
+            for s in segments
+        }
+
+    def refine_batch(self, metadata: Dict[str, Any], segments: List[Dict[str, Any]],
+                     context: Optional[List[str]] = None) -> Dict[int, Dict[str, Any]]:
+        """
+        Refines a window of segments in one call. `segments` items carry index,
+        original, stage1_text and stage1_changes. Returns index -> {text, edits}
+        for every segment that came back valid; missing ones are left to the caller.
+        Cached segments are answered locally and left out of the prompt.
+        """
+        out: Dict[int, Dict[str, Any]] = {}
+        keys = self._batch_keys(metadata, segments, context) if self.cache is not None else {}
+        for idx, key in keys.items():
+            data = self.cache.get(key)
+            if data is not None:
+                out[idx] = data
+        todo = [s for s in segments if s["index"] not in out]
+        if not todo:
+            return out
+
+        handle = self._handle(self._batch_instruction(context), metadata)
+        prompt, config = self._batch_request(metadata, todo, context, handle)
+        resp = self._send(prompt, config, lambda: self._batch_request(metadata, todo, context)[0], kind="batch")
+        fresh = self._read_batch(resp, todo)
+        for idx, data in fresh.items():
+            if idx in keys and _cacheable(data):
+                self.cache.put(keys[idx], data)
+        out.update(fresh)
+        return out
 
+    async def arefine_batch(self, metadata: Dict[str, Any], segments: List[Dict[str, Any]],
+                            context: Optional[List[str]] = None) -> Dict[int, Dict[str, Any]]:
+        out: Dict[int, Dict[str, Any]] = {}
+        keys = self._batch_keys(metadata, segments, context) if self.cache is not None else {}
+        for idx, key in keys.items():
+            data = await self.cache.aget(key)
+            if data is not None:
+                out[idx] = data
+        todo = [s for s in segments if s["index"] not in out]
+        if not todo:
+            return out
 
-    
+        handle = await self._ahandle(self._batch_instruction(context), metadata)
+        prompt, config = self._batch_request(metadata, todo, context, handle)
+        resp = await self._asend(prompt, config, lambda: self._batch_request(metadata, todo, context)[0], kind="batch")
+        fresh = self._read_batch(resp, todo)
+        for idx, data in fresh.items():
+            if idx in keys and _cacheable(data):
+                await self.cache.aput(keys[idx], data)
+        out.update(fresh)
+        return out
@@ -0,0 +1,99 @@
+import os, threading
+from typing import Any, Optional
+
+import httpx
+from google import genai
+from google.genai import types
+
+# Serve Gemini calls from the in-memory FakeGeminiClient (no API key, no network)
+GEMINI_OFFLINE = os.getenv("GEMINI_OFFLINE", "0") == "1"
+# HTTP connection pool shared by every Gemini call of the process (sync and async clients each get one)
+GEMINI_POOL_MAX_CONNECTIONS = int(os.getenv("GEMINI_POOL_MAX_CONNECTIONS", "100"))
+GEMINI_POOL_MAX_KEEPALIVE = int(os.getenv("GEMINI_POOL_MAX_KEEPALIVE", "32"))
+# Idle keep-alive connections are closed after this (httpx defaults to 5s)
+GEMINI_POOL_KEEPALIVE_S = float(os.getenv("GEMINI_POOL_KEEPALIVE_S", "60"))
+
+
+class GeminiClientProvider:
+    """
+    One genai.Client for the process, created on first use. Its HTTP clients
+    are owned here with pooled keep-alive connections, so every backend,
+    cache handle and batch job reuses the same connections. Per-call
+    timeouts still come from each request's HttpOptions. With `offline`,
+    get() returns a FakeGeminiClient instead.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, offline: bool = GEMINI_OFFLINE):
+        self.api_key = api_key
+        self.offline = offline
+        self._client: Any = None
+        self._http: Optional[httpx.Client] = None
+        self._ahttp: Optional[httpx.AsyncClient] = None
+        self._lock = threading.Lock()
+
+    @property
+    def configured(self) -> bool:
+        """Whether get() can build a client (offline, or an API key is available)."""
+        return self.offline or bool(self.api_key or os.getenv("GEMINI_API_KEY"))
+
+    def get(self) -> Any:
+        client = self._client
+        if client is not None:
+            return client
+        with self._lock:
+            if self._client is None:
+                self._client = self._create()
+            return self._client
+
+    def _create(self) -> Any:
+        if self.offline:
+            from app.utils.fake_gemini import FakeGeminiClient
+            return FakeGeminiClient()
+        key = self.api_key or os.getenv("GEMINI_API_KEY")
+        if not key:
+            raise RuntimeError("GEMINI_API_KEY NOT FOUND")
+        limits = httpx.Limits(max_connections=GEMINI_POOL_MAX_CONNECTIONS,
+                              max_keepalive_connections=GEMINI_POOL_MAX_KEEPALIVE,
+                              keepalive_expiry=GEMINI_POOL_KEEPALIVE_S)
+        # timeout=None like the SDK's own clients: the scheduler sets one per attempt
+        self._http = httpx.Client(limits=limits, timeout=None)
+        self._ahttp = httpx.AsyncClient(limits=limits, timeout=None)
+        return genai.Client(api_key=key, http_options=types.HttpOptions(
+            httpx_client=self._http, httpx_async_client=self._ahttp))
+
+    def start(self):
+        """Builds the client ahead of the first request (lifespan startup); without a key that is left to first use."""
+        if self.configured:
+            self.get()
+
+    def _take(self):
+        with self._lock:
+            taken = self._client, self._http, self._ahttp
+            self._client = self._http = self._ahttp = None
+        return taken
+
+    async def aclose(self):
+        """Closes the pooled connections (lifespan shutdown); a later get() builds a fresh client."""
+        _, http, ahttp = self._take()
+        if http is not None:
+            http.close()
+        if ahttp is not None:
+            await ahttp.aclose()
+
+
+_provider: Optional[GeminiClientProvider] = None
+_provider_lock = threading.Lock()
+
+
+def get_provider() -> GeminiClientProvider:
+    """Process-wide GeminiClientProvider (the client itself is still created lazily)."""
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            _provider = GeminiClientProvider()
+        return _provider
+
+
+def get_client() -> Any:
+    """The shared genai.Client (or FakeGeminiClient with GEMINI_OFFLINE=1)."""
+    return get_provider().get()
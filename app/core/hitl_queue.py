@@ -0,0 +1,198 @@
+import asyncio, logging, os, queue, threading
+from typing import Any, Dict, List, Optional
+
+from app.core.csv_store import HitlWriter, append_rows, get_writer, FLUSH_INTERVAL_S
+from app.core.metrics import timed
+
+# Pending requests (each a list of rows) before submitters see backpressure
+QUEUE_MAX_BATCHES = int(os.getenv("HITL_QUEUE_MAX_BATCHES", "1000"))
+# How long a submitter may wait for room before the batch is dropped
+QUEUE_PUT_TIMEOUT_S = float(os.getenv("HITL_QUEUE_PUT_TIMEOUT_S", "0.05"))
+
+_STOP = object()
+
+logger = logging.getLogger(__name__)
+
+
+class HitlQueue:
+    """
+    Bounded queue between the API handlers and the HITL CSVs. A drain thread
+    writes batches through HitlWriter and flushes whenever the queue runs
+    dry, so disk latency never sits on the request path. When the queue is
+    full, submitters wait up to put_timeout_s and then the batch is dropped
+    and counted.
+    """
+
+    def __init__(self,
+                 writer: Optional[HitlWriter] = None,
+                 max_batches: int = QUEUE_MAX_BATCHES,
+                 put_timeout_s: float = QUEUE_PUT_TIMEOUT_S):
+        self.writer = writer
+        self.put_timeout_s = put_timeout_s
+        self._q: "queue.Queue[Any]" = queue.Queue(maxsize=max_batches)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.enqueued_batches = 0
+        self.dropped_batches = 0
+        self.dropped_rows = 0
+        self.written_rows = 0
+        self.write_errors = 0
+        self.high_watermark = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self._thread = threading.Thread(target=self._drain, name="hitl-drain", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> bool:
+        """
+        Drains everything already queued, flushes and closes the files. Rows
+        submitted meanwhile are written inline. If the drain thread is still
+        busy after `timeout`, the writer is left open (and still flushed by
+        the thread) and False is returned.
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return True
+        try:
+            self._q.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.warning("HITL drain thread still writing after %.1fs; leaving the CSVs open", timeout)
+            return False
+        (self.writer or get_writer()).close()
+        return True
+
+    def submit(self, rows: List[Dict[str, Any]]) -> bool:
+        """Queues one request's rows. Without a running drain thread they are written inline."""
+        if not rows:
+            return True
+        if not self.running:
+            return self._write_inline(rows)
+        try:
+            if self.put_timeout_s > 0:
+                self._q.put(rows, timeout=self.put_timeout_s)
+            else:
+                self._q.put_nowait(rows)
+        except queue.Full:
+            return self._dropped(rows)
+        return self._enqueued()
+
+    async def asubmit(self, rows: List[Dict[str, Any]], timeout: Optional[float] = None) -> bool:
+        """
+        submit() for async handlers: never blocks the event loop. `timeout`
+        caps the wait for room below put_timeout_s (e.g. the request's
+        remaining deadline). Without a drain thread the rows are written in a
+        worker thread; past `timeout` the caller stops waiting but the write
+        still completes.
+        """
+        if not rows:
+            return True
+        if not self.running:
+            write = asyncio.ensure_future(asyncio.to_thread(self._write_inline, rows))
+            try:
+                return await asyncio.wait_for(asyncio.shield(write), timeout)
+            except asyncio.TimeoutError:
+                return True
+        try:
+            self._q.put_nowait(rows)
+            return self._enqueued()
+        except queue.Full:
+            pass
+        wait_s = self.put_timeout_s if timeout is None else min(self.put_timeout_s, timeout)
+        if wait_s > 0:
+            try:
+                await asyncio.to_thread(self._q.put, rows, True, wait_s)
+                return self._enqueued()
+            except queue.Full:
+                pass
+        return self._dropped(rows)
+
+    def _write_inline(self, rows: List[Dict[str, Any]]) -> bool:
+        """Writes and flushes rows on the calling thread (no drain thread: tests, scripts, after stop())."""
+        try:
+            append_rows(rows, writer=self.writer)
+        except Exception:
+            self.write_errors += 1
+            return False
+        self.written_rows += len(rows)
+        return True
+
+    def _enqueued(self) -> bool:
+        self.enqueued_batches += 1
+        self.high_watermark = max(self.high_watermark, self._q.qsize())
+        return True
+
+    def _dropped(self, rows: List[Dict[str, Any]]) -> bool:
+        self.dropped_batches += 1
+        self.dropped_rows += len(rows)
+        return False
+
+    def _drain(self):
+        writer = self.writer or get_writer()
+        while True:
+            try:
+                item = self._q.get(timeout=FLUSH_INTERVAL_S)
+            except queue.Empty:
+                writer.flush()
+                continue
+            stop = item is _STOP
+            batches = [] if stop else [item]
+            # Take whatever else is already waiting and write it in one go
+            while not stop:
+                try:
+                    nxt = self._q.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is _STOP:
+                    stop = True
+                else:
+                    batches.append(nxt)
+            with timed("hitl_write"):
+                for rows in batches:
+                    try:
+                        append_rows(rows, writer=writer, flush=False)
+                        self.written_rows += len(rows)
+                    except Exception:
+                        self.write_errors += 1
+                try:
+                    writer.flush()
+                except Exception:
+                    self.write_errors += 1
+            if stop:
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "queue_depth": self._q.qsize(),
+            "queue_capacity": self._q.maxsize,
+            "high_watermark": self.high_watermark,
+            "enqueued_batches": self.enqueued_batches,
+            "dropped_batches": self.dropped_batches,
+            "dropped_rows": self.dropped_rows,
+            "written_rows": self.written_rows,
+            "write_errors": self.write_errors,
+        }
+
+
+_queue: Optional[HitlQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_queue() -> HitlQueue:
+    """Process-wide HitlQueue (started by the app lifespan)."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = HitlQueue()
+        return _queue
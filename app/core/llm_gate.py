@@ -0,0 +1,91 @@
+import os
+import re
+from typing import Any, Dict, List, Tuple
+
+from app.core.fuzzy_matcher import PHONETIC_MIN_LEN, EntityIndex, normalize, phonetic_key
+
+# Local gate in front of Step 2: segments that only need deterministic
+# cleanup (capitalization / terminal punctuation) skip the LLM call.
+GATE_ENABLED = os.getenv("STEP2_GATE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Longer segments usually carry grammar issues worth an LLM pass
+GATE_MAX_WORDS = int(os.getenv("STEP2_GATE_MAX_WORDS", "12"))
+# Stage-1 entity changes may need a context check (e.g. Bengal -> Bengaluru)
+GATE_MAX_STAGE1_CHANGES = int(os.getenv("STEP2_GATE_MAX_STAGE1_CHANGES", "0"))
+# Stage-1 index score from which an unresolved near match to a metadata entity needs the LLM
+GATE_ENTITY_THRESHOLD = float(os.getenv("STEP2_GATE_ENTITY_THRESHOLD", "70"))
+
+FILLER_RE = re.compile(r"\b(?:u+m+|u+h+|e+r+m*|h+m+|you know|i mean|like|kinda|sorta)\b", re.IGNORECASE)
+REPEAT_RE = re.compile(r"\b(\w+)\s+\1\b", re.IGNORECASE)
+LOWER_I_RE = re.compile(r"(?<![\w'])i(?![\w'])")
+WORD_RE = re.compile(r"[A-Za-z]+(?:'[A-Za-z]+)?")
+TERMINAL = (".", "?", "!")
+
+
+def needs_llm(step1_text: str, step1_changes: List[Dict[str, Any]]) -> Tuple[bool, str]:
+    """
+    Decides whether a segment needs the LLM. Returns (needed, reason) where
+    reason is "+"-joined like csv_store.should_review, e.g. "filler+length".
+    """
+    reasons = []
+    text = step1_text.strip()
+    words = WORD_RE.findall(text)
+
+    if FILLER_RE.search(text):
+        reasons.append("filler")
+    if REPEAT_RE.search(text):
+        reasons.append("repeat")
+    if len(step1_changes or []) > GATE_MAX_STAGE1_CHANGES:
+        reasons.append("stage1_changes")
+    if len(words) > GATE_MAX_WORDS:
+        reasons.append("length")
+    # A bare "i", or several words without a single capital: raw ASR casing
+    if LOWER_I_RE.search(text) or (len(words) > 3 and not any(c.isupper() for c in text[1:])):
+        reasons.append("casing")
+
+    return bool(reasons), "+".join(reasons)
+
+
+def entity_near_misses(texts: List[str], index: EntityIndex,
+                       threshold: float = GATE_ENTITY_THRESHOLD) -> List[bool]:
+    """
+    Per text, whether Stage 1 left a plausible but unresolved metadata entity:
+    an index mention scoring at least `threshold` but below 100, or a
+    capitalized word after the first that sounds like a single-word entity
+    ("I spoke with Summer" with Samar in the metadata).
+    """
+    found = index.mentions(texts, threshold)
+    out = []
+    for text, hits in zip(texts, found):
+        miss = any(score < 100 for score in hits.values())
+        if not miss and index.phonetic:
+            for w in WORD_RE.findall(text)[1:]:
+                key = normalize(w)
+                if (w[0].isupper() and len(key) >= PHONETIC_MIN_LEN and key not in index.canon
+                        and phonetic_key(key) in index.phonetic):
+                    miss = True
+                    break
+        out.append(miss)
+    return out
+
+
+def local_cleanup(step1_text: str) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Deterministic Step-2 stand-in for gated segments: collapse whitespace,
+    capitalize the first letter and ensure terminal punctuation. Edits use
+    the Step2Edit shape with a "local:" rationale.
+    """
+    text = re.sub(r"\s+", " ", step1_text).strip()
+    text = re.sub(r"\s+([.,?!])", r"\1", text)
+    edits: List[Dict[str, Any]] = []
+
+    if text and text[0].isalpha() and text[0].islower():
+        first = re.match(r"\w+", text).group(0)
+        edits.append({"type": "capitalization", "from": first,
+                      "to": first[0].upper() + first[1:], "why": "local: sentence start"})
+        text = text[0].upper() + text[1:]
+
+    if text and not text.endswith(TERMINAL):
+        edits.append({"type": "punct", "from": None, "to": ".", "why": "local: terminal punctuation"})
+        text += "."
+
+    return text, edits
@@ -0,0 +1,206 @@
+import json, os, re, threading, time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.fuzzy_matcher import EntityIndex, build_canonicals, metadata_fingerprint
+from app.core.prompt_step2 import PromptMetadata
+
+# Compiled entries (entity index + prompt JSON) kept in memory; the raw
+# metadata of every version is always kept, so an evicted entry is rebuilt
+METADATA_REGISTRY_HOT = int(os.getenv("METADATA_REGISTRY_HOT", "256"))
+# Directory the registry persists uploads to (one JSON file per version); empty = memory only
+METADATA_REGISTRY_DIR = os.getenv("METADATA_REGISTRY_DIR", "")
+
+NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+# "<name>:v<N>" pins a version; "<name>:latest" follows uploads
+ID_RE = re.compile(r"^(?P<name>[A-Za-z0-9][A-Za-z0-9_.-]{0,63}):(?:v(?P<version>\d+)|(?P<latest>latest))$")
+
+
+class MetadataNotFound(KeyError):
+    """Unknown metadata name / version."""
+
+
+class RegisteredMetadata:
+    """One uploaded version of a tenant's metadata."""
+
+    def __init__(self, name: str, version: int, metadata: Dict[str, Any], created: Optional[float] = None):
+        self.name = name
+        self.version = version
+        self.metadata = metadata
+        self.created = created if created is not None else time.time()
+        self.fingerprint = metadata_fingerprint(metadata)
+        self.entities = len(build_canonicals(metadata))
+
+    @property
+    def id(self) -> str:
+        return f"{self.name}:v{self.version}"
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "version": self.version,
+            "fingerprint": self.fingerprint,
+            "entities": self.entities,
+            "created": self.created,
+        }
+
+
+class CompiledMetadata:
+    """What requests referencing a version need, built once: Stage-1 index and Step-2 prompt metadata."""
+
+    def __init__(self, entry: RegisteredMetadata):
+        self.entry = entry
+        self.index = EntityIndex(build_canonicals(entry.metadata), entry.fingerprint)
+        self.prompt_metadata = PromptMetadata(entry.metadata)
+
+
+class MetadataRegistry:
+    """
+    Versioned metadata uploads. Re-uploading identical metadata under a name
+    returns the existing version; anything else becomes version N+1. Compiled
+    entries live in an LRU of `hot_size`; with `directory` set, uploads are
+    written there and reloaded on startup.
+    """
+
+    def __init__(self, hot_size: int = METADATA_REGISTRY_HOT, directory: str = METADATA_REGISTRY_DIR):
+        self.hot_size = max(1, hot_size)
+        self.directory = directory
+        self._versions: Dict[str, List[RegisteredMetadata]] = {}
+        self._hot: "OrderedDict[str, CompiledMetadata]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if directory:
+            self._load()
+
+    def register(self, name: str, metadata: Dict[str, Any]) -> Tuple[RegisteredMetadata, bool]:
+        """Returns (entry, created); created is False when identical metadata was already the latest version."""
+        if not NAME_RE.match(name):
+            raise ValueError(f"invalid metadata name {name!r}")
+        fp = metadata_fingerprint(metadata)
+        with self._lock:
+            versions = self._versions.setdefault(name, [])
+            if versions and versions[-1].fingerprint == fp:
+                return versions[-1], False
+            entry = RegisteredMetadata(name, len(versions) + 1, metadata)
+            versions.append(entry)
+        if self.directory:
+            self._save(entry)
+        return entry, True
+
+    def get(self, metadata_id: str) -> RegisteredMetadata:
+        m = ID_RE.match(metadata_id)
+        if not m:
+            raise MetadataNotFound(f"invalid metadata id {metadata_id!r} (expected name:vN or name:latest)")
+        with self._lock:
+            versions = self._versions.get(m.group("name"))
+            if not versions:
+                raise MetadataNotFound(f"unknown metadata {m.group('name')!r}")
+            if m.group("latest"):
+                return versions[-1]
+            version = int(m.group("version"))
+            if not 1 <= version <= len(versions):
+                raise MetadataNotFound(f"unknown metadata version {metadata_id!r}")
+            return versions[version - 1]
+
+    def versions(self, name: str) -> List[RegisteredMetadata]:
+        with self._lock:
+            versions = list(self._versions.get(name, ()))
+        if not versions:
+            raise MetadataNotFound(f"unknown metadata {name!r}")
+        return versions
+
+    def names(self) -> List[RegisteredMetadata]:
+        """Latest version of every name."""
+        with self._lock:
+            return [v[-1] for v in self._versions.values() if v]
+
+    def resolve(self, metadata_id: str) -> CompiledMetadata:
+        """Compiled entry for an ID, built on first use (outside the lock) and kept in the LRU."""
+        entry = self.get(metadata_id)
+        with self._lock:
+            compiled = self._hot.get(entry.id)
+            if compiled is not None:
+                self._hot.move_to_end(entry.id)
+                self.hits += 1
+                return compiled
+            self.misses += 1
+
+        compiled = CompiledMetadata(entry)
+        with self._lock:
+            self._hot[entry.id] = compiled
+            while len(self._hot) > self.hot_size:
+                self._hot.popitem(last=False)
+        return compiled
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "names": len(self._versions),
+                "versions": sum(len(v) for v in self._versions.values()),
+                "hot_entries": len(self._hot),
+                "hot_capacity": self.hot_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "persistent": bool(self.directory),
+            }
+
+    def _path(self, name: str, version: int) -> str:
+        return os.path.join(self.directory, name, f"v{version}.json")
+
+    def _save(self, entry: RegisteredMetadata):
+        path = self._path(entry.name, entry.version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"name": entry.name, "version": entry.version, "created": entry.created,
+                       "metadata": entry.metadata}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def _load(self):
+        if not os.path.isdir(self.directory):
+            return
+        for name in sorted(os.listdir(self.directory)):
+            folder = os.path.join(self.directory, name)
+            if not NAME_RE.match(name) or not os.path.isdir(folder):
+                continue
+            version = 1
+            # Versions are contiguous; stop at the first gap or unreadable file
+            while os.path.exists(self._path(name, version)):
+                try:
+                    with open(self._path(name, version), encoding="utf-8") as f:
+                        data = json.load(f)
+                except (OSError, ValueError):
+                    break
+                self._versions.setdefault(name, []).append(
+                    RegisteredMetadata(name, version, data["metadata"], data.get("created"))
+                )
+                version += 1
+
+
+_registry: Optional[MetadataRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> MetadataRegistry:
+    """Process-wide MetadataRegistry."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = MetadataRegistry()
+        return _registry
+
+
+def resolve(metadata: Optional[Dict[str, Any]], metadata_id: Optional[str]) -> Tuple[Dict[str, Any], Optional[EntityIndex]]:
+    """
+    Metadata for a request that sent either an inline dict or a registry ID.
+    Registry IDs come with their prebuilt EntityIndex; inline metadata uses
+    the fingerprint-keyed index cache as before (index None).
+    """
+    if metadata_id is None:
+        return metadata or {}, None
+    compiled = get_registry().resolve(metadata_id)
+    return compiled.prompt_metadata, compiled.index
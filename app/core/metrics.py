@@ -0,0 +1,264 @@
+import contextvars, math, os, threading, time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Record stage timings / counters (the /metrics endpoint stays up either way)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# Add a Server-Timing header with the request's stage durations
+SERVER_TIMING = os.getenv("METRICS_SERVER_TIMING", "1") == "1"
+
+# Seconds; covers a sub-ms cache hit up to a slow Gemini retry chain
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelKey = Tuple[str, ...]
+# (name, type, help, [(labels, value)]) as produced by collectors
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+
+def _fmt_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, n: float = 1, **labels: str):
+        key = tuple(str(labels.get(k, "")) for k in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + n
+
+    def value(self, **labels: str) -> float:
+        key = tuple(str(labels.get(k, "")) for k in self.labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_fmt_labels(dict(zip(self.labels, key)))} {_fmt_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets: Iterable[float] = STAGE_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # label key -> (per-bucket counts, sum, count)
+        self._values: Dict[LabelKey, Tuple[List[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels.get(k, "")) for k in self.labels)
+        with self._lock:
+            counts, total, n = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, n + 1)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, (list(c), s, n)) for k, (c, s, n) in self._values.items())
+        for key, (counts, total, n) in items:
+            base = dict(zip(self.labels, key))
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_fmt_labels({**base, 'le': _fmt_value(bound)})} {count}")
+            lines.append(f"{self.name}_bucket{_fmt_labels({**base, 'le': '+Inf'})} {n}")
+            lines.append(f"{self.name}_sum{_fmt_labels(base)} {_fmt_value(total)}")
+            lines.append(f"{self.name}_count{_fmt_labels(base)} {n}")
+        return lines
+
+
+class Registry:
+    """
+    Minimal Prometheus text-format registry (exposition format 0.0.4).
+    Counters and histograms are updated in place; collectors are called at
+    scrape time to export stats other components already keep (cache,
+    scheduler, HITL queue) without double bookkeeping.
+    """
+
+    def __init__(self):
+        self._metrics: List[Any] = []
+        self._collectors: List[Callable[[], List[Family]]] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Iterable[str] = (),
+                  buckets: Iterable[float] = STAGE_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def _add(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn: Callable[[], List[Family]]):
+        with self._lock:
+            self._collectors.append(fn)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics, collectors = list(self._metrics), list(self._collectors)
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for fn in collectors:
+            try:
+                families = fn()
+            except Exception:
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_fmt_labels(labels)} {_fmt_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "pipeline_stage_seconds", "Time spent per pipeline stage.", ("stage",))
+SEGMENTS = REGISTRY.counter(
+    "step2_segments_total", "Step-2 segments by result source.", ("source",))
+EDITS = REGISTRY.counter(
+    "step2_edits_total", "Step-2 edits returned, by Step2Edit.type.", ("type",))
+DEADLINE_EXCEEDED = REGISTRY.counter(
+    "step2_deadline_exceeded_total", "Segments that fell back because the request deadline passed.")
+LLM_CALLS = REGISTRY.counter(
+    "step2_llm_calls_total", "Gemini generate_content calls (after scheduler retries).", ("kind", "outcome"))
+REPAIR_RETRIES = REGISTRY.counter(
+    "step2_repair_retries_total", "Strict re-prompts after an unparseable segment response.")
+METADATA_TOKENS = REGISTRY.counter(
+    "step2_metadata_tokens_total", "Estimated metadata tokens of Step-2 prompts: full metadata vs what compaction sent.", ("kind",))
+TOKENS = REGISTRY.counter(
+    "gemini_tokens_total", "Tokens reported in Gemini usage_metadata.", ("kind",))
+
+_USAGE_FIELDS = {
+    "prompt": "prompt_token_count",
+    "output": "candidates_token_count",
+    "thoughts": "thoughts_token_count",
+    "cached": "cached_content_token_count",
+    "total": "total_token_count",
+}
+
+# Stage durations (ms) of the request being served; set by ServerTimingMiddleware
+_timings: "contextvars.ContextVar[Optional[Dict[str, float]]]" = contextvars.ContextVar("timings", default=None)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """
+    Observes the block's duration in pipeline_stage_seconds{stage} and adds
+    it to the current request's Server-Timing entry. Concurrent blocks of the
+    same stage add up, so e.g. "gemini" is total call time, not wall time.
+    """
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        timings = _timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed * 1000
+
+
+def record_usage(resp: Any):
+    """Adds a Gemini response's usage_metadata to gemini_tokens_total."""
+    usage = getattr(resp, "usage_metadata", None)
+    if not METRICS_ENABLED or usage is None:
+        return
+    for kind, field in _USAGE_FIELDS.items():
+        n = getattr(usage, field, None)
+        if n:
+            TOKENS.inc(n, kind=kind)
+
+
+def record_segment(result: Any, warning: Optional[str] = None):
+    """Counts one finished Step-2 segment (a Step2SegmentResult) by source and edit type."""
+    if not METRICS_ENABLED:
+        return
+    SEGMENTS.inc(source=result.source)
+    for edit in result.edits:
+        EDITS.inc(type=edit.type)
+    if warning and warning.endswith("deadline_exceeded"):
+        DEADLINE_EXCEEDED.inc()
+
+
+def stats_families(prefix: str, help: str, stats: Dict[str, Any], counters: Iterable[str] = ()) -> List[Family]:
+    """Numeric entries of a component's stats() dict as {prefix}_{key} families."""
+    counters = set(counters)
+    out: List[Family] = []
+    for key, value in stats.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        kind = "counter" if key in counters else "gauge"
+        name = f"{prefix}_{key}_total" if kind == "counter" else f"{prefix}_{key}"
+        out.append((name, kind, f"{help} ({key})", [({}, value)]))
+    return out
+
+
+def server_timing(timings: Dict[str, float], total_ms: Optional[float] = None) -> str:
+    parts = [f"{stage};dur={ms:.1f}" for stage, ms in timings.items()]
+    if total_ms is not None:
+        parts.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(parts)
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware that gives each HTTP request its own timings dict (read
+    by `timed`) and sends it as a Server-Timing header. Streaming responses
+    only carry what was timed before their first byte.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not SERVER_TIMING:
+            await self.app(scope, receive, send)
+            return
+        timings: Dict[str, float] = {}
+        token = _timings.set(timings)
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                header = server_timing(timings, (time.perf_counter() - start) * 1000)
+                message = {**message, "headers": [*message.get("headers", []),
+                                                  (b"server-timing", header.encode("latin-1"))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _timings.reset(token)
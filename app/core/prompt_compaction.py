@@ -0,0 +1,175 @@
+import contextvars, json, os, threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.core.fuzzy_matcher import EntityIndex, get_index, normalize
+from app.core.metrics import METADATA_TOKENS
+from app.core.context_cache import CONTEXT_CACHE_ENABLED, CONTEXT_CACHE_METADATA
+from app.core.prompt_step2 import SEPARATORS, SYSTEM_INSTRUCTION
+
+# Send each Step-2 prompt only the entities its segments plausibly mention
+# (off while whole tenant metadata is kept in Gemini cached content, which needs one identical prefix)
+COMPACT_METADATA = (os.getenv("STEP2_COMPACT_METADATA", "1") == "1"
+                    and not (CONTEXT_CACHE_ENABLED and CONTEXT_CACHE_METADATA))
+# Metadata with fewer entities than this is always sent whole
+COMPACT_MIN_ENTITIES = int(os.getenv("STEP2_COMPACT_MIN_ENTITIES", "24"))
+# Entities kept per prompt, best-scoring first
+COMPACT_TOP_K = int(os.getenv("STEP2_COMPACT_TOP_K", "16"))
+# Stage-1 index score at which an entity counts as mentioned (looser than Stage 1 itself)
+COMPACT_THRESHOLD = float(os.getenv("STEP2_COMPACT_THRESHOLD", "70"))
+# Segments on each side whose mentions are also kept
+COMPACT_NEIGHBOURS = int(os.getenv("STEP2_COMPACT_NEIGHBOURS", "1"))
+# Estimated input tokens per prompt; entities are dropped (lowest score first) to fit (0 = no budget)
+PROMPT_TOKEN_BUDGET = int(os.getenv("STEP2_PROMPT_TOKEN_BUDGET", "0"))
+
+# Same rough chars-per-token estimate the scheduler uses for quota
+CHARS_PER_TOKEN = 4
+# Output schema, keys and separators of the user payload
+PAYLOAD_OVERHEAD_CHARS = 400
+CATEGORY_SHARE_CHARS = 16
+
+# Response header carrying CompactionReport.saved_tokens
+SAVED_TOKENS_HEADER = "X-Metadata-Tokens-Saved"
+
+Job = Tuple[str, str, List[Dict[str, Any]]]
+
+
+def dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=SEPARATORS)
+
+
+class CompactionReport:
+    """Estimated metadata tokens of the Step-2 prompts built for one request."""
+
+    def __init__(self):
+        self.prompts = 0
+        self.full_tokens = 0
+        self.sent_tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, full_tokens: int, sent_tokens: int):
+        with self._lock:
+            self.prompts += 1
+            self.full_tokens += full_tokens
+            self.sent_tokens += sent_tokens
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.full_tokens - self.sent_tokens
+
+
+_report: "contextvars.ContextVar[Optional[CompactionReport]]" = contextvars.ContextVar("compaction", default=None)
+
+
+@contextmanager
+def compaction_report() -> Iterator[CompactionReport]:
+    """Collects the compaction of every prompt built in the block (tasks and copied contexts included)."""
+    report = CompactionReport()
+    token = _report.set(report)
+    try:
+        yield report
+    finally:
+        _report.reset(token)
+
+
+class MetadataCompactor:
+    """
+    Per-request metadata pruning for Step-2 prompts. The Stage-1 text of the
+    pending segments and their neighbours is scanned once with the Stage-1
+    EntityIndex (EntityIndex.mentions); each window then gets the COMPACT_TOP_K entities
+    mentioned in it, its neighbours or the session context, trimmed to
+    PROMPT_TOKEN_BUDGET, in the metadata's own category layout.
+    """
+
+    def __init__(self, metadata: Dict[str, Any], jobs: List[Job], pending: Iterable[int],
+                 context: Optional[List[str]] = None, index: Optional[EntityIndex] = None,
+                 top_k: int = COMPACT_TOP_K, budget: int = PROMPT_TOKEN_BUDGET,
+                 neighbours: int = COMPACT_NEIGHBOURS, threshold: float = COMPACT_THRESHOLD):
+        self.metadata = metadata
+        self.jobs = jobs
+        self.context = context
+        self.top_k = top_k
+        self.budget = budget
+        self.neighbours = max(0, neighbours)
+        self.index = index if index is not None else (get_index(metadata) if COMPACT_METADATA else None)
+        self.active = COMPACT_METADATA and len(self.index) >= COMPACT_MIN_ENTITIES
+        # Registry metadata (PromptMetadata) carries its serialized form already
+        self.full_tokens = len(getattr(metadata, "json", None) or dumps(metadata)) // CHARS_PER_TOKEN
+        self._mentions: Dict[int, Dict[str, float]] = {}
+        self._context_mentions: Dict[str, float] = {}
+        if not self.active:
+            return
+
+        scan = sorted({j for i in pending for j in self._near(i)})
+        texts = [jobs[j][1] for j in scan]
+        if context:
+            texts.append("\n".join(context))
+        found = self.index.mentions(texts, threshold)
+        self._mentions = dict(zip(scan, found))
+        if context:
+            self._context_mentions = found[-1]
+        # Equal scores keep the metadata's own order
+        self._order = {k: n for n, k in enumerate(self.index.keys)}
+        # (category, single string?, [(key, value)]) so windows only filter
+        self._layout: List[Tuple[str, bool, List[Tuple[str, str]]]] = []
+        for category, value in metadata.items():
+            if isinstance(value, str):
+                self._layout.append((category, True, [(normalize(value), value)]))
+            elif isinstance(value, (list, tuple)):
+                self._layout.append((category, False, [(normalize(v), v) for v in value if isinstance(v, str)]))
+
+    def _near(self, i: int) -> range:
+        return range(max(0, i - self.neighbours), min(len(self.jobs), i + self.neighbours + 1))
+
+    def _rest_tokens(self, window: List[int]) -> int:
+        """Estimated tokens of everything in the prompt except the metadata."""
+        chars = len(SYSTEM_INSTRUCTION) + PAYLOAD_OVERHEAD_CHARS
+        for i in window:
+            og, s1, changes = self.jobs[i]
+            chars += len(og) + len(s1) + len(dumps(changes))
+        if self.context:
+            chars += sum(len(c) for c in self.context)
+        return chars // CHARS_PER_TOKEN
+
+    def _select(self, window: List[int]) -> List[str]:
+        scores = dict(self._context_mentions)
+        for i in window:
+            for j in self._near(i):
+                for key, score in self._mentions.get(j, {}).items():
+                    if score > scores.get(key, 0.0):
+                        scores[key] = score
+        ranked = sorted(scores, key=lambda k: (-scores[k], self._order.get(k, 0)))[:max(0, self.top_k)]
+        if self.budget <= 0:
+            return ranked
+        allowed = (self.budget - self._rest_tokens(window)) * CHARS_PER_TOKEN
+        kept: List[str] = []
+        used = 2
+        for key in ranked:
+            # Quoted value and comma, plus a rough share of the category keys
+            used += len(dumps(self.index.canon[key])) + 1 + CATEGORY_SHARE_CHARS
+            if used > allowed:
+                break
+            kept.append(key)
+        return kept
+
+    def for_window(self, window: List[int]) -> Dict[str, Any]:
+        """Metadata to send with the prompt for `window` (segment indices)."""
+        if not self.active:
+            self._record(self.full_tokens)
+            return self.metadata
+        keep = set(self._select(window))
+        out: Dict[str, Any] = {}
+        if keep:
+            for category, single, items in self._layout:
+                kept = [v for k, v in items if k in keep]
+                if kept:
+                    out[category] = kept[0] if single else kept
+        self._record(len(dumps(out)) // CHARS_PER_TOKEN)
+        return out
+
+    def _record(self, sent_tokens: int):
+        METADATA_TOKENS.inc(self.full_tokens, kind="full")
+        METADATA_TOKENS.inc(sent_tokens, kind="sent")
+        report = _report.get()
+        if report is not None:
+            report.add(self.full_tokens, sent_tokens)
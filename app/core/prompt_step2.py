@@ -1,4 +1,9 @@
 import json
+from typing import List, Optional
+
+# Bump whenever SYSTEM_INSTRUCTION / payload layout changes so cached
+# Step-2 responses from older prompts are not reused
+PROMPT_VERSION = "2"
 
 SYSTEM_INSTRUCTION = """You correct sales transcripts using provided metadata and Stage-1 changes.
 Rules:
@@ -23,14 +28,47 @@ Text examples, before vs after and MetaData:
 
 """
 
-def build_prompt(metadata: dict,
+CONTEXT_INSTRUCTION = """Live session: "context" holds the most recent already-corrected segments of the same call, oldest first.
+- Use them only to resolve names, entities and topic; never edit or return them.
+"""
+
+
+class PromptMetadata(dict):
+    """
+    Metadata dict that carries its own JSON, serialized once (metadata
+    registry entries). Prompts splice `json` in instead of re-encoding the
+    metadata per segment; as a dict it still hashes the same in cache keys.
+    """
+
+    def __init__(self, data: dict):
+        super().__init__(data)
+        self.json = json.dumps(data, ensure_ascii=False, separators=SEPARATORS)
+
+
+# Payloads are sent without the spaces json.dumps adds by default
+SEPARATORS = (",", ":")
+
+
+def _dumps(payload: dict) -> str:
+    """Compact json.dumps(payload), with a PromptMetadata under "metadata" (always the first key) spliced in."""
+    metadata = payload.get("metadata")
+    if not isinstance(metadata, PromptMetadata):
+        return json.dumps(payload, ensure_ascii=False, separators=SEPARATORS)
+    rest = json.dumps({k: v for k, v in payload.items() if k != "metadata"}, ensure_ascii=False, separators=SEPARATORS)
+    return '{"metadata":' + metadata.json + ("," + rest[1:] if rest != "{}" else "}")
+
+
+def build_prompt(metadata: Optional[dict],
                 segment_original_text: str,
                 segment_stage1_text: str, 
-                segment_stage1_changes: list
+                segment_stage1_changes: list,
+                context: Optional[List[str]] = None
             ) -> str:
     
+    # metadata None: already in the cached-content handle the call uses
     payload = {
-        "metadata": metadata,
+        **({"metadata": metadata} if metadata is not None else {}),
+        **({"context": context} if context else {}),
         "segment": {
             "original": segment_original_text,
             "stage1_text": segment_stage1_text,
@@ -48,4 +86,49 @@ def build_prompt(metadata: dict,
             ]
         }
     }
-    return json.dumps(payload, ensure_ascii=False)
+    return _dumps(payload)
+
+
+BATCH_INSTRUCTION = """Batch mode: the input holds several consecutive segments of the same call, each with an "index".
+- Correct every segment independently; use neighbouring segments only as context (names, topic, sentence flow).
+- Never merge, split, reorder or drop segments.
+- Return one JSON object {"segments": [...]} with exactly one entry per input segment, carrying the same "index".
+"""
+
+
+def build_batch_prompt(metadata: Optional[dict], segments: list, context: Optional[List[str]] = None) -> str:
+    """
+    segments: list of dicts with keys index, original, stage1_text, stage1_changes.
+    Metadata and the output schema are sent once for the whole window
+    (metadata None leaves it out, as in build_prompt).
+    """
+    payload = {
+        **({"metadata": metadata} if metadata is not None else {}),
+        **({"context": context} if context else {}),
+        "segments": [
+            {
+                "index": s["index"],
+                "original": s["original"],
+                "stage1_text": s["stage1_text"],
+                "stage1_changes": s["stage1_changes"],
+            }
+            for s in segments
+        ],
+        "output_schema": {
+            "segments": [
+                {
+                    "index": "index of the input segment",
+                    "text": "final corrected text for this segment",
+                    "edits": [
+                        {
+                            "type": "entity|grammar|punct|capitalization|filler",
+                            "from": "original or null",
+                            "to": "final or null",
+                            "why": "short rationale"
+                        }
+                    ]
+                }
+            ]
+        }
+    }
+    return _dumps(payload)
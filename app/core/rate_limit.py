@@ -0,0 +1,339 @@
+import asyncio, os, random, re, threading, time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+try:
+    from google.genai import errors as genai_errors
+except ImportError:
+    genai_errors = None
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# Client-side quota; 0 disables that bucket. Match these to the project's Gemini limits.
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "1000"))
+GEMINI_TPM = float(os.getenv("GEMINI_TPM", "1000000"))
+# Longest a call waits for quota before it is shed (falls back to Stage 1)
+GEMINI_QUOTA_WAIT_S = float(os.getenv("GEMINI_QUOTA_WAIT_S", "10"))
+# Per-attempt timeout
+GEMINI_TIMEOUT_S = float(os.getenv("GEMINI_TIMEOUT_S", "30"))
+# Retries on 429 / 5xx / timeouts, with full-jitter exponential backoff
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+GEMINI_BACKOFF_BASE_S = float(os.getenv("GEMINI_BACKOFF_BASE_S", "0.5"))
+GEMINI_BACKOFF_MAX_S = float(os.getenv("GEMINI_BACKOFF_MAX_S", "8"))
+# Consecutive retryable failures that open the breaker, and how long it stays open
+GEMINI_BREAKER_FAILURES = int(os.getenv("GEMINI_BREAKER_FAILURES", "5"))
+GEMINI_BREAKER_RESET_S = float(os.getenv("GEMINI_BREAKER_RESET_S", "30"))
+
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+RETRY_DELAY_RE = re.compile(r"^(\d+(?:\.\d+)?)s$")
+
+T = TypeVar("T")
+
+
+class QuotaTimeout(RuntimeError):
+    """No quota became available within the wait budget."""
+
+
+class CircuitOpenError(RuntimeError):
+    """The breaker is open; the call was shed without reaching the API."""
+
+
+class TokenBucket:
+    """
+    Classic token bucket refilled continuously at rate_per_min / 60 per second.
+    `reserve` takes tokens now (the balance may go negative) and returns how
+    long the caller must wait before proceeding, so waiters queue fairly
+    without polling.
+    """
+
+    def __init__(self, rate_per_min: float, capacity: Optional[float] = None):
+        self.rate = rate_per_min / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_min
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def reserve(self, n: float, max_wait: float) -> float:
+        """Takes n tokens and returns the wait in seconds; raises QuotaTimeout (taking nothing) past max_wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # A single request larger than the bucket would never fit; let it through once full
+            n = min(n, self.capacity)
+            wait = 0.0 if self._tokens >= n else (n - self._tokens) / self.rate
+            if wait > max_wait:
+                raise QuotaTimeout(f"quota wait {wait:.1f}s exceeds {max_wait:.1f}s")
+            self._tokens -= n
+            return wait
+
+    def adjust(self, delta: float):
+        """Corrects a reservation once the real cost is known (positive = used more)."""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens - delta)
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `failures` consecutive retryable failures; open ->
+    half-open after reset_s, letting a single probe through; the probe's
+    outcome closes or re-opens it. A probe that ends without an outcome
+    (shed for quota, cancelled) must release() its slot.
+    """
+
+    def __init__(self, failures: int = GEMINI_BREAKER_FAILURES, reset_s: float = GEMINI_BREAKER_RESET_S):
+        self.failures = max(1, failures)
+        self.reset_s = reset_s
+        self.state = "closed"
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.opened = 0
+
+    def allow(self) -> bool:
+        """Admits a call or raises CircuitOpenError; True when the call is the half-open probe."""
+        with self._lock:
+            if self.state == "closed":
+                return False
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_s:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            raise CircuitOpenError("Gemini circuit breaker open")
+
+    def release(self):
+        """Frees the probe slot without recording a result, so the next call probes instead."""
+        with self._lock:
+            if self.state == "half_open":
+                self._probing = False
+
+    def success(self):
+        with self._lock:
+            self.state = "closed"
+            self._consecutive = 0
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self._consecutive += 1
+            self._probing = False
+            if self.state == "half_open" or self._consecutive >= self.failures:
+                if self.state != "open":
+                    self.opened += 1
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+def status_code(exc: BaseException) -> Optional[int]:
+    code = getattr(exc, "code", None)
+    return code if isinstance(code, int) else None
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    if httpx is not None and isinstance(exc, (httpx.TimeoutException, httpx.TransportError)):
+        return True
+    if genai_errors is not None and isinstance(exc, genai_errors.APIError):
+        return exc.code in RETRYABLE_CODES
+    return status_code(exc) in RETRYABLE_CODES
+
+
+def server_retry_delay(exc: BaseException) -> Optional[float]:
+    """RetryInfo.retryDelay ("12s") from a 429 body, if the API sent one."""
+    body = getattr(exc, "details", None)
+    details = body.get("error", {}).get("details", []) if isinstance(body, dict) else []
+    for d in details if isinstance(details, list) else []:
+        m = RETRY_DELAY_RE.match(str(d.get("retryDelay", ""))) if isinstance(d, dict) else None
+        if m:
+            return float(m.group(1))
+    return None
+
+
+class GeminiScheduler:
+    """
+    Client-side admission for Gemini calls: RPM/TPM token buckets, a circuit
+    breaker, per-attempt timeouts and jittered exponential backoff on
+    retryable errors (429, 5xx, timeouts). Calls that cannot get quota within
+    quota_wait_s, hit an open breaker or run out of retries raise, and the
+    orchestrator turns that into the usual Stage-1 fallback.
+    """
+
+    def __init__(self,
+                 rpm: float = GEMINI_RPM,
+                 tpm: float = GEMINI_TPM,
+                 quota_wait_s: float = GEMINI_QUOTA_WAIT_S,
+                 timeout_s: float = GEMINI_TIMEOUT_S,
+                 max_retries: int = GEMINI_MAX_RETRIES,
+                 backoff_base_s: float = GEMINI_BACKOFF_BASE_S,
+                 backoff_max_s: float = GEMINI_BACKOFF_MAX_S,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.quota_wait_s = quota_wait_s
+        self.timeout_s = timeout_s
+        self.max_retries = max(0, max_retries)
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.breaker = breaker or CircuitBreaker()
+        self._lock = threading.Lock()
+        self.metrics: Dict[str, float] = {
+            "calls": 0, "attempts": 0, "succeeded": 0, "failed": 0,
+            "retries": 0, "throttled_429": 0, "server_errors": 0, "timeouts": 0,
+            "shed_quota": 0, "shed_breaker": 0, "quota_wait_s": 0.0, "backoff_s": 0.0,
+            "tokens_reserved": 0, "tokens_used": 0,
+        }
+
+    def _count(self, key: str, n: float = 1):
+        with self._lock:
+            self.metrics[key] += n
+
+    def _remaining(self, deadline: Optional[float]) -> float:
+        return float("inf") if deadline is None else deadline - time.monotonic()
+
+    def _reserve(self, est_tokens: int, deadline: Optional[float]) -> Tuple[float, bool]:
+        """Admission: breaker check, then both buckets. Returns (quota wait, holds the breaker probe)."""
+        try:
+            probe = self.breaker.allow()
+        except CircuitOpenError:
+            self._count("shed_breaker")
+            raise
+        max_wait = max(0.0, min(self.quota_wait_s, self._remaining(deadline)))
+        wait = 0.0
+        try:
+            if self.requests is not None:
+                wait = self.requests.reserve(1, max_wait)
+            if self.tokens is not None:
+                try:
+                    wait = max(wait, self.tokens.reserve(est_tokens, max_wait))
+                except QuotaTimeout:
+                    if self.requests is not None:
+                        self.requests.adjust(-1)
+                    raise
+        except QuotaTimeout:
+            self._count("shed_quota")
+            if probe:
+                self.breaker.release()
+            raise
+        self._count("quota_wait_s", wait)
+        self._count("tokens_reserved", est_tokens)
+        return wait, probe
+
+    def _settle(self, est_tokens: int, used: Optional[int]):
+        if used is not None:
+            self._count("tokens_used", used)
+            if self.tokens is not None:
+                self.tokens.adjust(used - est_tokens)
+
+    def _attempt_timeout(self, deadline: Optional[float]) -> float:
+        return max(0.001, min(self.timeout_s, self._remaining(deadline)))
+
+    def _on_error(self, exc: BaseException, attempt: int, deadline: Optional[float]) -> float:
+        """Records a failed attempt; returns the backoff delay, or raises to give up."""
+        code = status_code(exc)
+        if code == 429:
+            self._count("throttled_429")
+        elif code is not None and code >= 500:
+            self._count("server_errors")
+        elif isinstance(exc, (asyncio.TimeoutError, TimeoutError)) or (
+            httpx is not None and isinstance(exc, httpx.TimeoutException)
+        ):
+            self._count("timeouts")
+
+        if not is_retryable(exc):
+            # Bad request, local errors etc. say nothing about the API's health:
+            # only a real response closes the breaker, so just free a probe slot
+            self.breaker.release()
+            self._count("failed")
+            raise exc
+        self.breaker.failure()
+        delay = server_retry_delay(exc)
+        if delay is None:
+            delay = random.uniform(0, min(self.backoff_max_s, self.backoff_base_s * (2 ** attempt)))
+        if attempt >= self.max_retries or delay >= self._remaining(deadline):
+            self._count("failed")
+            raise exc
+        self._count("retries")
+        self._count("backoff_s", delay)
+        return delay
+
+    def call(self, fn: Callable[[float], T], est_tokens: int = 0,
+             deadline: Optional[float] = None, usage: Callable[[T], Optional[int]] = lambda r: None) -> T:
+        """Runs fn(timeout_s) under the scheduler. `deadline` is a time.monotonic() value."""
+        self._count("calls")
+        attempt = 0
+        while True:
+            wait, probe = self._reserve(est_tokens, deadline)
+            try:
+                time.sleep(wait)
+                self._count("attempts")
+                try:
+                    result = fn(self._attempt_timeout(deadline))
+                except Exception as e:
+                    self._settle(est_tokens, 0)
+                    time.sleep(self._on_error(e, attempt, deadline))
+                    attempt += 1
+                    continue
+                self.breaker.success()
+                self._count("succeeded")
+                self._settle(est_tokens, usage(result))
+                return result
+            finally:
+                # No-op once success() / failure() ran; frees a probe that was interrupted
+                if probe:
+                    self.breaker.release()
+
+    async def acall(self, fn: Callable[[float], Awaitable[T]], est_tokens: int = 0,
+                    deadline: Optional[float] = None, usage: Callable[[T], Optional[int]] = lambda r: None) -> T:
+        """Async call(): waits with asyncio.sleep and bounds each attempt with wait_for."""
+        self._count("calls")
+        attempt = 0
+        while True:
+            wait, probe = self._reserve(est_tokens, deadline)
+            try:
+                await asyncio.sleep(wait)
+                self._count("attempts")
+                timeout = self._attempt_timeout(deadline)
+                try:
+                    result = await asyncio.wait_for(fn(timeout), timeout)
+                except Exception as e:
+                    self._settle(est_tokens, 0)
+                    await asyncio.sleep(self._on_error(e, attempt, deadline))
+                    attempt += 1
+                    continue
+                self.breaker.success()
+                self._count("succeeded")
+                self._settle(est_tokens, usage(result))
+                return result
+            finally:
+                # Also runs on CancelledError (deadline, client disconnect)
+                if probe:
+                    self.breaker.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = {k: (round(v, 3) if isinstance(v, float) else v) for k, v in self.metrics.items()}
+        out["breaker_state"] = self.breaker.state
+        out["breaker_opened"] = self.breaker.opened
+        return out
+
+
+_scheduler: Optional[GeminiScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> GeminiScheduler:
+    """Process-wide scheduler: the quota belongs to the API key, not to a client instance."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = GeminiScheduler()
+        return _scheduler
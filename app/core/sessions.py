@@ -0,0 +1,139 @@
+import asyncio, os, threading, time, uuid
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.fuzzy_matcher import EntityIndex, correct_transcript, get_index
+
+# Corrected segments carried into each Step-2 prompt as context
+SESSION_CONTEXT_SEGMENTS = int(os.getenv("SESSION_CONTEXT_SEGMENTS", "6"))
+# Context is trimmed (oldest first) to stay under this many characters
+SESSION_CONTEXT_MAX_CHARS = int(os.getenv("SESSION_CONTEXT_MAX_CHARS", "1500"))
+# Idle sessions are dropped after this long; the oldest go first past SESSION_MAX
+SESSION_TTL_S = float(os.getenv("SESSION_TTL_S", "3600"))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "1000"))
+
+
+class Session:
+    """
+    One live call. Metadata and its compiled EntityIndex are fixed when the
+    session opens; each appended chunk is corrected on its own, with the last
+    few corrected segments as Step-2 context, so per-chunk cost does not grow
+    with the length of the call.
+    """
+
+    def __init__(self, session_id: str, metadata: Dict[str, Any],
+                 backend: Optional[str] = None,
+                 index: Optional[EntityIndex] = None,
+                 context_segments: int = SESSION_CONTEXT_SEGMENTS,
+                 context_max_chars: int = SESSION_CONTEXT_MAX_CHARS):
+        self.session_id = session_id
+        self.metadata = metadata
+        self.backend = backend          # Step-2 backend name; None = STEP2_BACKEND
+        # Registry uploads come with their index prebuilt
+        self.index: EntityIndex = index if index is not None else get_index(metadata)
+        self.context_max_chars = context_max_chars
+        self._context: "deque[str]" = deque(maxlen=max(0, context_segments))
+        self.transcript: List[Dict[str, Any]] = []
+        self.created = time.time()
+        self.last_used = time.monotonic()
+        # Chunks of one session are applied in order
+        self.lock = asyncio.Lock()
+
+    @property
+    def next_index(self) -> int:
+        return len(self.transcript)
+
+    def context(self) -> List[str]:
+        """Most recent corrected texts, oldest first, within context_max_chars."""
+        out: List[str] = []
+        total = 0
+        for text in reversed(self._context):
+            total += len(text)
+            if out and total > self.context_max_chars:
+                break
+            out.append(text)
+        out.reverse()
+        return out
+
+    def stage1(self, seg_dicts: List[Dict[str, Any]]) -> Tuple[List[str], List[List[Dict[str, Any]]]]:
+        """Stage 1 against the session's prebuilt index; updates seg["text"] in place."""
+        stage1 = correct_transcript(seg_dicts, self.metadata, add_terminal_period=True,
+                                    threshold=80.0, index=self.index)
+        texts: List[str] = []
+        changes: List[List[Dict[str, Any]]] = []
+        for seg, s1 in zip(seg_dicts, stage1):
+            seg["text"] = s1["text"]
+            texts.append(s1["text"])
+            changes.append(s1.get("_stage1_changes", []))
+        return texts, changes
+
+    def commit(self, final_segments: List[Dict[str, Any]]):
+        self.transcript.extend(final_segments)
+        for seg in final_segments:
+            if seg.get("text"):
+                self._context.append(seg["text"])
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "segments": len(self.transcript),
+            "entities": len(self.index),
+            "backend": self.backend,
+            "created": self.created,
+        }
+
+
+class SessionStore:
+    """In-memory sessions keyed by ID, evicted by idle TTL and count (LRU)."""
+
+    def __init__(self, ttl_s: float = SESSION_TTL_S, max_sessions: int = SESSION_MAX):
+        self.ttl_s = ttl_s
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, metadata: Dict[str, Any], backend: Optional[str] = None,
+               index: Optional[EntityIndex] = None) -> Session:
+        session = Session(uuid.uuid4().hex, metadata, backend, index)
+        with self._lock:
+            self._sessions[session.session_id] = session
+            self._evict()
+        return session
+
+    def get(self, session_id: str) -> Optional[Session]:
+        with self._lock:
+            self._evict()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_used = time.monotonic()
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def close(self, session_id: str) -> Optional[Session]:
+        with self._lock:
+            return self._sessions.pop(session_id, None)
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._sessions:
+            sid, oldest = next(iter(self._sessions.items()))
+            if len(self._sessions) > self.max_sessions or now - oldest.last_used > self.ttl_s:
+                del self._sessions[sid]
+            else:
+                break
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+_store: Optional[SessionStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> SessionStore:
+    """Process-wide SessionStore."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SessionStore()
+        return _store
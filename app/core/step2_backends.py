@@ -0,0 +1,206 @@
+import asyncio, os, re, threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Protocol, runtime_checkable
+
+from app.core.llm_gate import REPEAT_RE, LOWER_I_RE, local_cleanup
+
+try:
+    import torch
+    from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+    USE_TRANSFORMERS = True
+except ImportError:
+    USE_TRANSFORMERS = False
+
+# Backend used when a request doesn't name one: gemini | local
+STEP2_BACKEND = os.getenv("STEP2_BACKEND", "gemini").lower()
+# Optional seq2seq checkpoint (HF name or path, e.g. a BART fine-tuned on the
+# HITL CSVs). Empty -> rule-based local corrections only.
+LOCAL_MODEL = os.getenv("STEP2_LOCAL_MODEL", "")
+# CPU threads for local inference (torch intra-op threads and the executor)
+LOCAL_THREADS = int(os.getenv("STEP2_LOCAL_THREADS", "2"))
+# Segments per forward pass; also the orchestrator's window size for this backend
+LOCAL_BATCH_SIZE = int(os.getenv("STEP2_LOCAL_BATCH_SIZE", "16"))
+LOCAL_MAX_NEW_TOKENS = int(os.getenv("STEP2_LOCAL_MAX_NEW_TOKENS", "128"))
+
+# Narrower than llm_gate.FILLER_RE: only what is safe to delete without context
+# ("like" / "I mean" are often real words)
+FILLER_RE = re.compile(r"\b(?:u+m+|u+h+|e+rm+|h+m+|you know)\b,?\s*", re.IGNORECASE)
+LEADING_RE = re.compile(r"^(?:(?:so|like|well|okay)\b[,\s]*)+(?=\w)", re.IGNORECASE)
+# Lowercase word opening a sentence after the first
+SENTENCE_START_RE = re.compile(r"(?<=[.?!] )[a-z]\w*")
+
+
+@runtime_checkable
+class Step2Backend(Protocol):
+    """
+    What run_step2 needs from a Step-2 engine. Methods return {text, edits}
+    dicts (edits in the Step2Edit shape); batch methods return index -> dict
+    for the segments they could refine. `source` is the Step2SegmentResult
+    source for its results.
+    """
+    name: str
+    model: str
+    source: str
+
+    def refine_segment(self, metadata: Dict[str, Any], original_text: str, step1_text: str, step1_changes: list,
+                       context: Optional[List[str]] = None) -> Dict[str, Any]: ...
+
+    async def arefine_segment(self, metadata: Dict[str, Any], original_text: str, step1_text: str, step1_changes: list,
+                              context: Optional[List[str]] = None) -> Dict[str, Any]: ...
+
+    def refine_batch(self, metadata: Dict[str, Any], segments: List[Dict[str, Any]],
+                     context: Optional[List[str]] = None) -> Dict[int, Dict[str, Any]]: ...
+
+    async def arefine_batch(self, metadata: Dict[str, Any], segments: List[Dict[str, Any]],
+                            context: Optional[List[str]] = None) -> Dict[int, Dict[str, Any]]: ...
+
+
+def rule_refine(text: str) -> Dict[str, Any]:
+    """Rule-based Step 2: drop fillers, collapse repeated words, fix bare "i", then local_cleanup."""
+    text = re.sub(r"\s+", " ", text).strip()
+    edits: List[Dict[str, Any]] = []
+    for m in FILLER_RE.finditer(text):
+        edits.append({"type": "filler", "from": m.group(0).strip(" ,"), "to": None, "why": "local: filler"})
+    text = FILLER_RE.sub("", text)
+    m = LEADING_RE.match(text) if edits else None
+    if m:
+        # Discourse markers left dangling at the start once fillers are gone ("so um Dave")
+        edits.append({"type": "filler", "from": m.group(0).strip(" ,"), "to": None, "why": "local: filler"})
+        text = text[m.end():]
+    for m in REPEAT_RE.finditer(text):
+        edits.append({"type": "grammar", "from": m.group(0), "to": m.group(1), "why": "local: repeated word"})
+    text = REPEAT_RE.sub(r"\1", text)
+    if LOWER_I_RE.search(text):
+        edits.append({"type": "capitalization", "from": "i", "to": "I", "why": "local: pronoun"})
+        text = LOWER_I_RE.sub("I", text)
+    # Fillers leave stray commas / spaces behind
+    text = re.sub(r"^[,\s]+", "", text)
+    text = re.sub(r"([.?!])\s*,[,\s]*", r"\1 ", text)
+    text = re.sub(r",\s*([,.?!])", r"\1", text)
+    for m in SENTENCE_START_RE.finditer(text):
+        word = m.group(0)
+        edits.append({"type": "capitalization", "from": word, "to": word[0].upper() + word[1:],
+                      "why": "local: sentence start"})
+    text = SENTENCE_START_RE.sub(lambda m: m.group(0)[0].upper() + m.group(0)[1:], text)
+    text, cleanup = local_cleanup(text)
+    return {"text": text, "edits": edits + cleanup}
+
+
+class LocalStep2Backend:
+    """
+    CPU-only Step 2. Without STEP2_LOCAL_MODEL it is rule_refine; with it, a
+    seq2seq model loaded on first use generates the text in batches of
+    `batch_size`, capped at `threads` CPU threads. All inference goes through
+    one executor thread, so concurrent requests queue instead of
+    oversubscribing the CPU.
+    """
+    name = "local"
+    source = "local_model"
+
+    def __init__(self,
+                 model_name: str = LOCAL_MODEL,
+                 threads: int = LOCAL_THREADS,
+                 batch_size: int = LOCAL_BATCH_SIZE,
+                 max_new_tokens: int = LOCAL_MAX_NEW_TOKENS):
+        if model_name and not USE_TRANSFORMERS:
+            raise RuntimeError("STEP2_LOCAL_MODEL is set but torch/transformers are not installed")
+        self.model_name = model_name
+        self.model = model_name or "rules"
+        self.threads = max(1, threads)
+        self.default_batch_size = max(1, batch_size)
+        self.max_new_tokens = max_new_tokens
+        self._tokenizer = None
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="step2-local")
+
+    def _load(self):
+        with self._load_lock:
+            if self._model is None:
+                torch.set_num_threads(self.threads)
+                self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+                self._model = AutoModelForSeq2SeqLM.from_pretrained(self.model_name).eval()
+        return self._tokenizer, self._model
+
+    def _generate(self, texts: List[str]) -> List[str]:
+        tokenizer, model = self._load()
+        out: List[str] = []
+        for i in range(0, len(texts), self.default_batch_size):
+            enc = tokenizer(texts[i:i + self.default_batch_size], return_tensors="pt",
+                            padding=True, truncation=True, max_length=256)
+            with torch.inference_mode():
+                ids = model.generate(**enc, max_new_tokens=self.max_new_tokens, num_beams=1)
+            out.extend(tokenizer.batch_decode(ids, skip_special_tokens=True))
+        return out
+
+    def _refine_texts(self, texts: List[str]) -> List[Dict[str, Any]]:
+        if not self.model_name:
+            return [rule_refine(t) for t in texts]
+        results: List[Dict[str, Any]] = []
+        for src, gen in zip(texts, self._generate(texts)):
+            text, edits = local_cleanup(gen.strip() or src)
+            if text != src:
+                edits.insert(0, {"type": "grammar", "from": src, "to": text, "why": f"local model: {self.model_name}"})
+            results.append({"text": text, "edits": edits})
+        return results
+
+    def refine_batch(self, metadata: Dict[str, Any], segments: List[Dict[str, Any]],
+                     context: Optional[List[str]] = None) -> Dict[int, Dict[str, Any]]:
+        texts = [s["stage1_text"] for s in segments]
+        return {s["index"]: r for s, r in zip(segments, self._refine_texts(texts))}
+
+    async def arefine_batch(self, metadata: Dict[str, Any], segments: List[Dict[str, Any]],
+                            context: Optional[List[str]] = None) -> Dict[int, Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.refine_batch, metadata, segments, context)
+
+    def refine_segment(self, metadata: Dict[str, Any], original_text: str, step1_text: str, step1_changes: list,
+                       context: Optional[List[str]] = None) -> Dict[str, Any]:
+        return self._refine_texts([step1_text])[0]
+
+    async def arefine_segment(self, metadata: Dict[str, Any], original_text: str, step1_text: str, step1_changes: list,
+                              context: Optional[List[str]] = None) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.refine_segment,
+                                          metadata, original_text, step1_text, step1_changes, context)
+
+
+def _make_gemini():
+    from app.core.gemini_client import Step2Gemini
+    return Step2Gemini()
+
+
+BACKENDS = {
+    "gemini": _make_gemini,
+    "local": LocalStep2Backend,
+}
+
+_instances: Dict[str, Step2Backend] = {}
+_instances_lock = threading.Lock()
+
+
+def get_backend(name: Optional[str] = None) -> Step2Backend:
+    """Process-wide backend instance by name (default STEP2_BACKEND); created on first use."""
+    key = (name or STEP2_BACKEND).lower()
+    if key not in BACKENDS:
+        raise ValueError(f"unknown Step-2 backend {key!r} (available: {', '.join(BACKENDS)})")
+    with _instances_lock:
+        backend = _instances.get(key)
+        if backend is None:
+            backend = _instances[key] = BACKENDS[key]()
+        return backend
+
+
+def loaded_backend(name: str) -> Optional[Step2Backend]:
+    """The instance registered under `name` if one was created, without creating it (stats, shutdown)."""
+    with _instances_lock:
+        return _instances.get(name.lower())
+
+
+def set_backend(name: str, backend: Step2Backend):
+    """Installs a ready-made instance under a registered name (offline runs, benchmarks)."""
+    key = name.lower()
+    if key not in BACKENDS:
+        raise ValueError(f"unknown Step-2 backend {key!r} (available: {', '.join(BACKENDS)})")
+    with _instances_lock:
+        _instances[key] = backend
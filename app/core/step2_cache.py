@@ -0,0 +1,159 @@
+import asyncio, hashlib, json, os, sqlite3, threading, time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+# In-memory tier
+CACHE_ENABLED = os.getenv("STEP2_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+CACHE_MAX_ENTRIES = int(os.getenv("STEP2_CACHE_MAX_ENTRIES", "10000"))
+CACHE_TTL_S = float(os.getenv("STEP2_CACHE_TTL_S", "86400"))
+# Optional on-disk tier; empty path disables it
+CACHE_SQLITE_PATH = os.getenv("STEP2_CACHE_SQLITE", "")
+CACHE_SQLITE_MAX_ROWS = int(os.getenv("STEP2_CACHE_SQLITE_MAX_ROWS", "200000"))
+# Size eviction runs every this many disk writes rather than on each one
+TRIM_EVERY = 256
+
+
+def cache_key(model: str,
+              prompt_version: str,
+              metadata: Dict[str, Any],
+              original_text: str,
+              step1_text: str,
+              step1_changes: list,
+              context: Optional[list] = None) -> str:
+    """Content address of one Step-2 request: sha256 over everything the prompt depends on."""
+    parts = [model, prompt_version, metadata, original_text, step1_text, step1_changes]
+    if context:
+        # Only present for session calls, so context-free keys stay unchanged
+        parts.append(context)
+    blob = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class Step2Cache:
+    """
+    Two-tier cache for Step-2 segment responses ({text, edits} dicts).
+    Memory is an LRU of JSON strings; the optional SQLite tier survives
+    restarts. Both honour the TTL; SQLite is trimmed to max_rows by last access.
+    """
+
+    def __init__(self,
+                 max_entries: int = CACHE_MAX_ENTRIES,
+                 ttl_s: float = CACHE_TTL_S,
+                 sqlite_path: str = CACHE_SQLITE_PATH,
+                 sqlite_max_rows: int = CACHE_SQLITE_MAX_ROWS):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.sqlite_max_rows = sqlite_max_rows
+        self._mem: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._db: Optional[sqlite3.Connection] = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS step2_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS step2_cache_accessed ON step2_cache(accessed)")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None:
+                created, value = entry
+                if now - created <= self.ttl_s:
+                    self._mem.move_to_end(key)
+                    self.hits += 1
+                    self.memory_hits += 1
+                    return json.loads(value)
+                del self._mem[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created FROM step2_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] <= self.ttl_s:
+                    self._db.execute("UPDATE step2_cache SET accessed = ? WHERE key = ?", (now, key))
+                    self._remember(key, row[1], row[0])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return json.loads(row[0])
+                if row is not None:
+                    self._db.execute("DELETE FROM step2_cache WHERE key = ?", (key,))
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, data: Dict[str, Any]):
+        value = json.dumps(data, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO step2_cache (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now),
+                )
+                self._writes += 1
+                if self._writes % TRIM_EVERY == 0:
+                    self._trim_disk()
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        # Only the disk tier does I/O worth moving off the event loop
+        if self._db is None:
+            return self.get(key)
+        return await asyncio.to_thread(self.get, key)
+
+    async def aput(self, key: str, data: Dict[str, Any]):
+        if self._db is None:
+            return self.put(key, data)
+        await asyncio.to_thread(self.put, key, data)
+
+    def _remember(self, key: str, created: float, value: str):
+        self._mem[key] = (created, value)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+
+    def _trim_disk(self):
+        count = self._db.execute("SELECT COUNT(*) FROM step2_cache").fetchone()[0]
+        if count > self.sqlite_max_rows:
+            self._db.execute(
+                "DELETE FROM step2_cache WHERE key IN "
+                "(SELECT key FROM step2_cache ORDER BY accessed ASC LIMIT ?)",
+                (count - self.sqlite_max_rows,),
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._mem),
+                "disk_enabled": self._db is not None,
+            }
+
+
+_default_cache: Optional[Step2Cache] = None
+_default_lock = threading.Lock()
+
+
+def get_default_cache() -> Optional[Step2Cache]:
+    """Process-wide cache shared by every Step2Gemini instance (None if disabled)."""
+    global _default_cache
+    if not CACHE_ENABLED:
+        return None
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = Step2Cache()
+        return _default_cache
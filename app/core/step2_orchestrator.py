@@ -1,29 +1,254 @@
-from typing import List, Dict, Any
-from app.core.gemini_client import Step2Gemini
+import os
+import asyncio
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
+from app.core.step2_backends import Step2Backend
+from app.core.deadline import DEADLINE_EXCEEDED, Deadline, DeadlineExceeded, deadline_scope
+from app.core.metrics import record_segment, timed
+from app.core.fuzzy_matcher import get_index
+from app.core.llm_gate import GATE_ENABLED, entity_near_misses, needs_llm, local_cleanup
+from app.core.prompt_compaction import MetadataCompactor
 from app.models.schemas_step2 import Step2SegmentResult, Step2Edit
 
+# Max number of Gemini requests in flight per arun_step2 call (1 = sequential)
+STEP2_MAX_CONCURRENCY = int(os.getenv("STEP2_MAX_CONCURRENCY", "8"))
+# Segments packed into one Gemini prompt (1 = one request per segment)
+STEP2_BATCH_SIZE = int(os.getenv("STEP2_BATCH_SIZE", "1"))
+
+Job = Tuple[str, str, List[Dict[str, Any]]]
 
-def run_step2(gemini: Step2Gemini,
-                metadata: Dict[str, Any],
-                transcript_segments: List[Dict[str, Any]],
-                step1_texts: List[str],
-                step1_changes: List[List[Dict[str, Any]]]    
-        ):
-    
-    results: List[Step2SegmentResult] = []
-    warnings: List[str] = []
 
+def _build_jobs(transcript_segments: List[Dict[str, Any]],
+                step1_texts: List[str],
+                step1_changes: List[List[Dict[str, Any]]]
+        ) -> List[Job]:
+    jobs: List[Job] = []
     for idx, seg in enumerate(transcript_segments):
         og_text = seg.get("text", "")
         s1_text = step1_texts[idx]
         s1_changes = step1_changes[idx] if idx < len(step1_changes) else []
+        jobs.append((og_text, s1_text, s1_changes))
+    return jobs
+
+
+def _to_result(data: Dict[str, Any], source: str = "llm") -> Step2SegmentResult:
+    edits = [Step2Edit.model_validate(e) for e in data.get("edits", [])]
+    return Step2SegmentResult(text=data["text"], edits=edits, source=source)
+
+
+def _source(backend: Step2Backend) -> str:
+    return getattr(backend, "source", "llm")
+
+
+def _window_size(backend: Step2Backend, batch_size: Optional[int]) -> int:
+    # Explicit argument, else the backend's preference (local batches by default), else env
+    return max(1, batch_size or getattr(backend, "default_batch_size", None) or STEP2_BATCH_SIZE)
+
+
+def _resolve(idx: int, job: Job, outcome: Any,
+             deadline: Optional[Deadline] = None) -> Tuple[Step2SegmentResult, Optional[str]]:
+    if isinstance(outcome, Exception):
+        # Timeouts / quota sheds caused by the budget running out all read as deadline_exceeded
+        expired = isinstance(outcome, DeadlineExceeded) or (deadline is not None and deadline.expired())
+        reason = DEADLINE_EXCEEDED if expired else outcome
+        return Step2SegmentResult(text=job[1], edits=[], source="fallback"), f"segment {idx}: {reason}"
+    return outcome, None
+
+
+def _collect(jobs: List[Job], outcomes: Dict[int, Any], deadline: Optional[Deadline] = None):
+    """Results in input order; segments without an outcome were cut off by the deadline."""
+    results: List[Step2SegmentResult] = []
+    warnings: List[str] = []
+    for idx in range(len(jobs)):
+        result, warning = _resolve(idx, jobs[idx], outcomes.get(idx, DeadlineExceeded()), deadline)
+        record_segment(result, warning)
+        results.append(result)
+        if warning:
+            warnings.append(warning)
+    return results, warnings
+
+
+def _gate(jobs: List[Job], gate: Optional[bool],
+          metadata: Optional[Dict[str, Any]] = None) -> Tuple[Dict[int, Step2SegmentResult], List[int]]:
+    """
+    Splits segments into locally resolved results and indices that still need
+    the LLM. With the gate off every segment goes to the LLM. Segments that
+    pass the text heuristics still go to the LLM when they hold a near miss
+    to a metadata entity.
+    """
+    if not (GATE_ENABLED if gate is None else gate):
+        return {}, list(range(len(jobs)))
+
+    pending: List[int] = []
+    clean: List[int] = []
+    for idx, (_, s1_text, s1_changes) in enumerate(jobs):
+        needed, _ = needs_llm(s1_text, s1_changes)
+        (pending if needed else clean).append(idx)
+    if clean and metadata:
+        misses = entity_near_misses([jobs[i][1] for i in clean], get_index(metadata))
+        pending = sorted(pending + [i for i, miss in zip(clean, misses) if miss])
+        clean = [i for i, miss in zip(clean, misses) if not miss]
+
+    local: Dict[int, Step2SegmentResult] = {}
+    for idx in clean:
+        text, edits = local_cleanup(jobs[idx][1])
+        local[idx] = Step2SegmentResult(
+            text=text, edits=[Step2Edit.model_validate(e) for e in edits], source="local"
+        )
+    return local, pending
+
+
+def _windows(indices: List[int], batch_size: int) -> List[List[int]]:
+    return [indices[i:i + batch_size] for i in range(0, len(indices), batch_size)]
 
-        try:
-            data = gemini.refine_segment(metadata, og_text, s1_text, s1_changes)
-            edits = [Step2Edit.model_validate(e) for e in data.get("edits", [])]
-            results.append(Step2SegmentResult(text=data["text"], edits=edits))
 
+def _batch_items(jobs: List[Job], window: List[int]) -> List[Dict[str, Any]]:
+    return [
+        {"index": i, "original": jobs[i][0], "stage1_text": jobs[i][1], "stage1_changes": jobs[i][2]}
+        for i in window
+    ]
+
+
+async def _arefine_window(gemini: Step2Backend, metadata: Dict[str, Any], jobs: List[Job], window: List[int],
+                          context: Optional[List[str]] = None) -> List[Any]:
+    """
+    Refines a window of segments, returning one outcome (result or exception)
+    per index. Segments the batch response dropped or mangled are retried
+    on their own.
+    """
+    async def one(job: Job) -> Any:
+        try:
+            return _to_result(await gemini.arefine_segment(metadata, *job, context=context), _source(gemini))
         except Exception as e:
-            warnings.append(f"segment {idx}: {e}")
-            results.append(Step2SegmentResult(text=s1_text, edits=[]))
-    return results, warnings
\ No newline at end of file
+            return e
+
+    if len(window) == 1:
+        return [await one(jobs[window[0]])]
+
+    try:
+        parsed = await gemini.arefine_batch(metadata, _batch_items(jobs, window), context=context)
+    except Exception as e:
+        return [e] * len(window)
+
+    outcomes: List[Any] = []
+    for i in window:
+        if i in parsed:
+            try:
+                outcomes.append(_to_result(parsed[i], _source(gemini)))
+                continue
+            except Exception:
+                pass
+        outcomes.append(await one(jobs[i]))
+    return outcomes
+
+
+async def astream_step2(gemini: Step2Backend,
+                metadata: Dict[str, Any],
+                transcript_segments: List[Dict[str, Any]],
+                step1_texts: List[str],
+                step1_changes: List[List[Dict[str, Any]]],
+                max_concurrency: Optional[int] = None,
+                batch_size: Optional[int] = None,
+                gate: Optional[bool] = None,
+                context: Optional[List[str]] = None,
+                deadline: Optional[Deadline] = None
+        ) -> AsyncIterator[Tuple[int, Step2SegmentResult, Optional[str]]]:
+    """
+    Yields (index, result, warning) per segment as soon as it is done: gated
+    segments first, then LLM windows in completion order. `warning` is the
+    "segment {idx}: ..." string for fallbacks, else None. Pending Gemini
+    calls are cancelled if the consumer stops early or `deadline` passes;
+    segments cut off by the deadline come last, as deadline_exceeded
+    fallbacks.
+    """
+    limit = max(1, max_concurrency or STEP2_MAX_CONCURRENCY)
+    deadline = deadline or Deadline()
+    jobs = _build_jobs(transcript_segments, step1_texts, step1_changes)
+    # The entity near-miss check scans the segments; keep it off the event loop
+    with timed("gate"):
+        local, pending = await asyncio.to_thread(_gate, jobs, gate, metadata)
+    windows = _windows(pending, _window_size(gemini, batch_size))
+    sem = asyncio.Semaphore(limit)
+
+    for idx in sorted(local):
+        record_segment(local[idx])
+        yield idx, local[idx], None
+
+    # Scanning for entity mentions is CPU-bound; keep it off the event loop
+    compactor = await asyncio.to_thread(MetadataCompactor, metadata, jobs, pending, context) \
+        if windows and not deadline.expired() else None
+
+    async def refine(window: List[int]) -> Tuple[List[int], List[Any]]:
+        async with sem:
+            return window, await _arefine_window(gemini, compactor.for_window(window), jobs, window, context)
+
+    # Tasks copy the current context on creation, so the scheduler sees the deadline
+    with deadline_scope(deadline):
+        tasks = [] if deadline.expired() else [asyncio.create_task(refine(w)) for w in windows]
+    unfinished = set(pending)
+    try:
+        try:
+            for fut in asyncio.as_completed(tasks, timeout=deadline.timeout()):
+                window, window_outcomes = await fut
+                for idx, outcome in zip(window, window_outcomes):
+                    unfinished.discard(idx)
+                    result, warning = _resolve(idx, jobs[idx], outcome, deadline)
+                    record_segment(result, warning)
+                    yield idx, result, warning
+        except asyncio.TimeoutError:
+            pass
+        for idx in sorted(unfinished):
+            result, warning = _resolve(idx, jobs[idx], DeadlineExceeded())
+            record_segment(result, warning)
+            yield idx, result, warning
+    finally:
+        for t in tasks:
+            t.cancel()
+
+
+async def arun_step2(gemini: Step2Backend,
+                metadata: Dict[str, Any],
+                transcript_segments: List[Dict[str, Any]],
+                step1_texts: List[str],
+                step1_changes: List[List[Dict[str, Any]]],
+                max_concurrency: Optional[int] = None,
+                batch_size: Optional[int] = None,
+                gate: Optional[bool] = None,
+                context: Optional[List[str]] = None,
+                deadline: Optional[Deadline] = None
+        ):
+    """
+    Refines every segment with the Step-2 backend (Step2Gemini or another
+    Step2Backend), keeping up to `max_concurrency` requests
+    in flight. With `batch_size` > 1, windows of that many segments share one
+    prompt. Unless `gate` is off, segments llm_gate deems clean skip the LLM
+    and get local cleanup (source="local"). Results keep input order; a failed
+    segment falls back to its Stage-1 text and adds a "segment {idx}: ..."
+    warning. `context` (already-corrected earlier segments, e.g. from a live
+    session) is sent along with every prompt. Each prompt carries only the
+    metadata entities its window plausibly mentions (MetadataCompactor).
+    Segments still pending when
+    `deadline` passes keep their Stage-1 text with a "segment {idx}:
+    deadline_exceeded" warning.
+    """
+    results: Dict[int, Step2SegmentResult] = {}
+    seg_warnings: Dict[int, str] = {}
+    async for idx, result, warning in astream_step2(
+        gemini, metadata, transcript_segments, step1_texts, step1_changes,
+        max_concurrency=max_concurrency, batch_size=batch_size, gate=gate, context=context,
+        deadline=deadline,
+    ):
+        results[idx] = result
+        if warning:
+            seg_warnings[idx] = warning
+    ordered = [results[i] for i in range(len(transcript_segments))]
+    return ordered, [seg_warnings[i] for i in sorted(seg_warnings)]
+
+
+def run_step2(gemini: Step2Backend,
+                metadata: Dict[str, Any],
+                transcript_segments: List[Dict[str, Any]],
+                step1_texts: List[str],
+                step1_changes: List[List[Dict[str, Any]]],
+                **kwargs):
+    """arun_step2 for callers without an event loop (scripts, notebooks)."""
+    return asyncio.run(arun_step2(gemini, metadata, transcript_segments, step1_texts, step1_changes, **kwargs))
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, Field, model_validator, validator
 from typing import List, Optional, Any, Dict, Tuple
 
 class TranscriptSegment(BaseModel):
@@ -11,9 +11,20 @@ class TranscriptSegment(BaseModel):
     text: str
 
 
-class CorrectionRequest(BaseModel):
+class MetadataRef(BaseModel):
+    """Requests send metadata inline or reference a registry upload ("name:vN" / "name:latest")."""
+    metadata: Optional[Dict[str, Any]] = None
+    metadata_id: Optional[str] = None
+
+    @model_validator(mode="after")
+    def _one_metadata_source(self):
+        if (self.metadata is None) == (self.metadata_id is None):
+            raise ValueError("send exactly one of metadata / metadata_id")
+        return self
+
+
+class CorrectionRequest(MetadataRef):
     transcript: List[TranscriptSegment]
-    metadata: Dict[str, Any]
 
 
 class CorrectionResponse(BaseModel):
@@ -1,7 +1,10 @@
-from typing import List, Dict, Any
-from pydantic import BaseModel
-from app.models.schemas import TranscriptSegment
+from typing import List, Dict, Any, Literal, Optional
+from pydantic import BaseModel, Field
+from app.models.schemas import MetadataRef, TranscriptSegment
 
-class PipelineRequest(BaseModel):
+class PipelineRequest(MetadataRef):
     transcript: List[TranscriptSegment]
-    metadata: Dict[str, Any]
+    # Step-2 backend for this request; STEP2_BACKEND when omitted
+    backend: Optional[Literal["gemini", "local"]] = None
+    # Latency budget in ms, counted from arrival; REQUEST_DEADLINE_MS when omitted, 0 = unbounded
+    deadline_ms: Optional[int] = Field(default=None, ge=0)
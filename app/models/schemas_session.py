@@ -0,0 +1,30 @@
+from typing import List, Dict, Any, Literal, Optional
+from pydantic import BaseModel, Field
+from app.models.schemas import MetadataRef, TranscriptSegment
+from app.models.schemas_step2 import Step2Edit
+
+class SessionCreateRequest(MetadataRef):
+    backend: Optional[Literal["gemini", "local"]] = None
+
+class SessionInfo(BaseModel):
+    session_id: str
+    segments: int
+    entities: int
+    backend: Optional[str] = None
+    created: float
+
+class SessionAppendRequest(BaseModel):
+    transcript: List[TranscriptSegment]
+    # Per-chunk latency budget, as PipelineRequest.deadline_ms
+    deadline_ms: Optional[int] = Field(default=None, ge=0)
+
+class SessionAppendResponse(BaseModel):
+    session_id: str
+    offset: int                      # session-wide index of the first returned segment
+    transcript: List[TranscriptSegment]
+    edits: List[List[Step2Edit]]
+    warnings: List[str] = []         # "segment {i}: ..." with i relative to this chunk
+
+class SessionTranscript(BaseModel):
+    session_id: str
+    transcript: List[TranscriptSegment]
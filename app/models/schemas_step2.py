@@ -1,6 +1,6 @@
 from typing import List, Optional, Dict, Any, Literal
 from pydantic import BaseModel, Field
-from app.models.schemas import TranscriptSegment
+from app.models.schemas import MetadataRef, TranscriptSegment
 
 class Step2Edit(BaseModel):
     type: Literal["entity", "grammar", "punct", "capitalization", "filler"]
@@ -11,11 +11,17 @@ class Step2Edit(BaseModel):
 class Step2SegmentResult(BaseModel):
     text: str
     edits: List[Step2Edit] = []
+    # llm: refined by Gemini; local_model: refined by the local backend;
+    # local: skipped by the gate, cleaned up deterministically;
+    # fallback: backend failed, Stage-1 text kept
+    source: Literal["llm", "local_model", "local", "fallback"] = "llm"
 
-class GrammarRequest(BaseModel):
+class GrammarRequest(MetadataRef):
     transcript: List[TranscriptSegment]
-    metadata: Dict[str, Any]
     step1_changes: List[List[Dict[str, Any]]] = Field(..., alias="changes")
+    backend: Optional[Literal["gemini", "local"]] = None
+    # Same as PipelineRequest.deadline_ms
+    deadline_ms: Optional[int] = Field(default=None, ge=0)
 
     class Config:
         populate_by_name = True
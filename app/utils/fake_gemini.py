@@ -0,0 +1,269 @@
+import asyncio, datetime, hashlib, itertools, json, random, threading, time
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from google.genai import errors, types
+
+# Local stand-ins for the parts of genai.Client the pipeline uses, so Step 2
+# can be exercised without network access or an API key.
+
+Responder = Callable[[Dict[str, Any]], Any]
+
+
+def prompt_payload(prompt: str) -> Dict[str, Any]:
+    """The JSON payload at the end of a Step-2 prompt (after the instructions)."""
+    start = prompt.rfind("\n\n{")
+    return json.loads(prompt[start + 2:] if start != -1 else prompt)
+
+
+def echo_responder(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns the Stage-1 text unchanged, as a valid segment response."""
+    return {"text": payload["segment"]["stage1_text"], "edits": []}
+
+
+def text_response(text: str, prompt_tokens: Optional[int] = None) -> types.GenerateContentResponse:
+    """A response carrying `text`; with prompt_tokens, also usage_metadata (~4 chars per output token)."""
+    usage = None
+    if prompt_tokens is not None:
+        output_tokens = max(1, len(text) // 4)
+        usage = types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=output_tokens,
+            total_token_count=prompt_tokens + output_tokens,
+        )
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(text=text)]))],
+        usage_metadata=usage,
+    )
+
+
+def answer(responder: Responder, payload: Dict[str, Any]) -> Any:
+    """Responder output for a segment payload, or {"segments": [...]} for a batch payload."""
+    if "segments" not in payload:
+        return responder(payload)
+    out = []
+    for seg in payload["segments"]:
+        item = responder({**payload, "segment": seg})
+        out.append({"index": seg["index"], **item} if isinstance(item, dict) else item)
+    return {"segments": out}
+
+
+_STATUSES = {400: "INVALID_ARGUMENT", 403: "PERMISSION_DENIED", 404: "NOT_FOUND", 429: "RESOURCE_EXHAUSTED"}
+
+
+def api_error(code: int, message: str = "injected fake error") -> errors.APIError:
+    status = _STATUSES.get(code, "UNAVAILABLE")
+    body = {"error": {"code": code, "message": message, "status": status}}
+    return errors.ClientError(code, body) if code < 500 else errors.ServerError(code, body)
+
+
+class FakeCaches:
+    """
+    In-memory `client.caches`. Creating content estimated below `min_tokens`
+    (~4 chars per token) fails with a 400 like the real minimum; entries expire
+    after their ttl and are then unknown (404) to get / update / generate_content.
+    """
+
+    def __init__(self, min_tokens: int = 0):
+        self.min_tokens = min_tokens
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.creates = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _seconds(ttl: Optional[str]) -> float:
+        return float(ttl.rstrip("s")) if ttl else 3600.0
+
+    def _info(self, name: str, entry: Dict[str, Any]) -> types.CachedContent:
+        return types.CachedContent(
+            name=name, model=entry["model"],
+            expire_time=datetime.datetime.fromtimestamp(entry["expires"], tz=datetime.timezone.utc),
+            usage_metadata=types.CachedContentUsageMetadata(total_token_count=entry["tokens"]),
+        )
+
+    def create(self, *, model: str, config: types.CreateCachedContentConfig) -> types.CachedContent:
+        texts = [p.text or "" for c in (config.contents or []) for p in (c.parts or [])]
+        instruction = config.system_instruction or ""
+        tokens = (len(instruction if isinstance(instruction, str) else "") + sum(len(t) for t in texts)) // 4
+        if tokens < self.min_tokens:
+            raise api_error(400, f"cached content has {tokens} tokens, minimum is {self.min_tokens}")
+        metadata = None
+        for text in texts:
+            try:
+                metadata = prompt_payload(text)
+            except ValueError:
+                pass
+        with self._lock:
+            self.creates += 1
+            name = f"cachedContents/fake-{next(self._ids)}"
+            self.entries[name] = {"model": model, "tokens": tokens, "metadata": metadata,
+                                  "expires": time.time() + self._seconds(config.ttl)}
+            return self._info(name, self.entries[name])
+
+    def lookup(self, name: str) -> Dict[str, Any]:
+        with self._lock:
+            entry = self.entries.get(name)
+            if entry is None or entry["expires"] <= time.time():
+                self.entries.pop(name, None)
+                raise api_error(404, f"cached content {name} not found")
+            return entry
+
+    def get(self, *, name: str, config: Any = None) -> types.CachedContent:
+        return self._info(name, self.lookup(name))
+
+    def update(self, *, name: str, config: types.UpdateCachedContentConfig) -> types.CachedContent:
+        entry = self.lookup(name)
+        with self._lock:
+            entry["expires"] = time.time() + self._seconds(config.ttl)
+        return self._info(name, entry)
+
+    def delete(self, *, name: str, config: Any = None) -> None:
+        with self._lock:
+            if self.entries.pop(name, None) is None:
+                raise api_error(404, f"cached content {name} not found")
+
+
+class FakeModels:
+    """
+    In-memory `client.models`. Each call waits latency_s plus up to jitter_s
+    and fails with probability error_rate (APIError `error_code`). The draws
+    are seeded by the prompt and how often it was sent before, so a run is
+    reproducible however calls interleave, and a retried prompt gets a fresh
+    draw. A config.cached_content handle must exist in `caches` (else 404);
+    metadata cached with it is added to the payload the responder sees.
+    """
+
+    def __init__(self, responder: Responder = echo_responder, latency_s: float = 0.0, jitter_s: float = 0.0,
+                 error_rate: float = 0.0, error_code: int = 503, seed: int = 0,
+                 caches: Optional[FakeCaches] = None):
+        self.responder = responder
+        self.caches = caches
+        self.latency_s = latency_s
+        self.jitter_s = jitter_s
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.seed = seed
+        self.calls = 0
+        self.errors = 0
+        self._sent: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _plan(self, contents: str) -> Tuple[float, Optional[Exception]]:
+        digest = hashlib.blake2b(contents.encode("utf-8"), digest_size=8).hexdigest()
+        with self._lock:
+            self.calls += 1
+            n = self._sent[digest] = self._sent.get(digest, 0) + 1
+        rng = random.Random(f"{self.seed}:{digest}:{n}")
+        delay = self.latency_s + rng.uniform(0, self.jitter_s)
+        if rng.random() < self.error_rate:
+            with self._lock:
+                self.errors += 1
+            return delay, api_error(self.error_code)
+        return delay, None
+
+    def _cached(self, config: Any) -> Optional[Dict[str, Any]]:
+        name = getattr(config, "cached_content", None)
+        if not name:
+            return None
+        if self.caches is None:
+            raise api_error(404, f"cached content {name} not found")
+        return self.caches.lookup(name)
+
+    def _respond(self, contents: str, config: Any = None) -> types.GenerateContentResponse:
+        cached = self._cached(config)
+        payload = prompt_payload(contents)
+        if cached and cached["metadata"] is not None and "metadata" not in payload:
+            payload = {"metadata": cached["metadata"], **payload}
+        out = answer(self.responder, payload)
+        text = out if isinstance(out, str) else json.dumps(out, ensure_ascii=False)
+        resp = text_response(text, prompt_tokens=max(1, len(contents) // 4) + (cached["tokens"] if cached else 0))
+        if cached:
+            resp.usage_metadata.cached_content_token_count = cached["tokens"]
+        return resp
+
+    def generate_content(self, *, model: str, contents: str, config: Any = None) -> types.GenerateContentResponse:
+        delay, error = self._plan(contents)
+        time.sleep(delay)
+        if error is not None:
+            raise error
+        return self._respond(contents, config)
+
+
+class FakeAsyncModels:
+    """`client.aio.models` over the same FakeModels (shared counters and draws), sleeping with asyncio."""
+
+    def __init__(self, models: FakeModels):
+        self.sync = models
+
+    async def generate_content(self, *, model: str, contents: str, config: Any = None) -> types.GenerateContentResponse:
+        delay, error = self.sync._plan(contents)
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return self.sync._respond(contents, config)
+
+
+class FakeBatches:
+    """
+    In-memory `client.batches`. Inlined requests are answered by `responder`
+    (payload dict -> response dict or raw string; raising marks that request
+    as errored). A job reports RUNNING for `polls_until_done` gets, then
+    SUCCEEDED, or FAILED when `fail_jobs` is set.
+    """
+
+    def __init__(self, responder: Responder = echo_responder, polls_until_done: int = 1, fail_jobs: bool = False):
+        self.responder = responder
+        self.polls_until_done = polls_until_done
+        self.fail_jobs = fail_jobs
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def create(self, *, model: str, src: List[types.InlinedRequest], config: Any = None) -> types.BatchJob:
+        with self._lock:
+            name = f"batches/fake-{next(self._ids)}"
+            self.jobs[name] = {"model": model, "src": list(src), "polls": 0, "cancelled": False}
+        return types.BatchJob(name=name, model=model, state=types.JobState.JOB_STATE_PENDING)
+
+    def get(self, *, name: str, config: Any = None) -> types.BatchJob:
+        with self._lock:
+            job = self.jobs[name]
+            job["polls"] += 1
+            polls, cancelled = job["polls"], job["cancelled"]
+        if cancelled:
+            return types.BatchJob(name=name, state=types.JobState.JOB_STATE_CANCELLED)
+        if polls <= self.polls_until_done:
+            return types.BatchJob(name=name, state=types.JobState.JOB_STATE_RUNNING)
+        if self.fail_jobs:
+            return types.BatchJob(name=name, state=types.JobState.JOB_STATE_FAILED,
+                                  error=types.JobError(code=500, message="fake batch failure"))
+        return types.BatchJob(
+            name=name,
+            state=types.JobState.JOB_STATE_SUCCEEDED,
+            dest=types.BatchJobDestination(inlined_responses=[self._answer(r) for r in job["src"]]),
+        )
+
+    def cancel(self, *, name: str, config: Any = None) -> None:
+        with self._lock:
+            self.jobs[name]["cancelled"] = True
+
+    def _answer(self, req: types.InlinedRequest) -> types.InlinedResponse:
+        try:
+            out = self.responder(prompt_payload(req.contents))
+        except Exception as e:
+            return types.InlinedResponse(metadata=req.metadata, error=types.JobError(code=400, message=str(e)))
+        text = out if isinstance(out, str) else json.dumps(out, ensure_ascii=False)
+        return types.InlinedResponse(metadata=req.metadata, response=text_response(text))
+
+
+class FakeGeminiClient:
+    """Drop-in for genai.Client where only the attributes used by this repo are needed."""
+
+    def __init__(self, batches: Optional[FakeBatches] = None, models: Optional[FakeModels] = None,
+                 caches: Optional[FakeCaches] = None):
+        self.batches = batches or FakeBatches()
+        self.models = models or FakeModels()
+        self.caches = caches or self.models.caches or FakeCaches()
+        # Handles created through client.caches are the ones generate_content accepts
+        self.models.caches = self.caches
+        self.aio = SimpleNamespace(models=FakeAsyncModels(self.models))
@@ -1,13 +1,44 @@
 from dotenv import load_dotenv
 load_dotenv()
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from app.api.routes import router as step1_router
 from app.api.grammar_routes import router as step2_router
 from app.api.pipeline_routes import router as pipeline_router
+from app.api.session_routes import router as session_router
+from app.api.metrics_routes import router as metrics_router
+from app.api.metadata_routes import router as metadata_router
+from app.core.hitl_queue import get_queue
+from app.core.gemini_provider import get_provider
+from app.core.step2_backends import loaded_backend
+from app.core.metrics import ServerTimingMiddleware
 
 
-app = FastAPI(title="Transcript Correction Pipeline")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    hitl = get_queue()
+    hitl.start()
+    # Build the pooled Gemini client now rather than on the first request (skipped without a key)
+    gemini = get_provider()
+    gemini.start()
+    yield
+    # Drain pending HITL rows and close the CSVs before exiting
+    hitl.stop()
+    # Delete cached-content handles, then close the pooled connections
+    backend = loaded_backend("gemini")
+    if backend is not None and hasattr(backend, "close"):
+        await run_in_threadpool(backend.close)
+    await gemini.aclose()
+
+
+app = FastAPI(title="Transcript Correction Pipeline", lifespan=lifespan)
+# Per-request stage durations as a Server-Timing header
+app.add_middleware(ServerTimingMiddleware)
 app.include_router(step1_router)
 app.include_router(step2_router)
 app.include_router(pipeline_router)
+app.include_router(session_router)
+app.include_router(metrics_router)
+app.include_router(metadata_router)
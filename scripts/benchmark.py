@@ -0,0 +1,324 @@
+# scripts/benchmark.py
+# Offline, reproducible benchmark of the full pipeline (Stage 1 + Step 2 + HITL hand-off).
+#
+#   python scripts/benchmark.py --sizes small,medium --save bench/baseline.json
+#   python scripts/benchmark.py --sizes small,medium --compare bench/baseline.json
+#
+# Requests go through the FastAPI app in-process (httpx ASGI transport), with Step 2
+# answered by the in-memory Gemini stand-in from app/utils/fake_gemini.py: no server,
+# no API key, no network. Latency and error rate of the stand-in are injectable, and
+# transcripts are generated from a seed, so two runs with the same flags do the same work.
+# --compare exits with status 1 when a metric regressed by more than --tolerance.
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# HITL rows from benchmark runs must not land in the real review CSVs
+_HITL_DIR = tempfile.mkdtemp(prefix="bench-hitl-")
+for _var, _name in (("HITL_REVIEW_CSV", "reviews"), ("HITL_ACCEPTED_CSV", "accepted"), ("HITL_METADATA_CSV", "metadata")):
+    os.environ.setdefault(_var, os.path.join(_HITL_DIR, f"hitl_{_name}.csv"))
+
+# Transcript shapes: segments per call, metadata entities, tokens (words) per segment
+SIZES: Dict[str, Tuple[int, int, int]] = {
+    "small": (10, 12, 12),
+    "medium": (40, 60, 20),
+    "large": (150, 300, 30),
+}
+
+# Lower is better for these; throughput is higher-is-better
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "llm_calls_per_segment", "metadata_tokens_per_segment",
+                   "stage1_us_per_token")
+HIGHER_IS_BETTER = ("throughput_rps", "segments_per_s")
+
+SYLLABLES = ["ka", "ro", "mi", "shan", "dev", "li", "na", "tor", "vi", "sel", "am", "ru", "jo", "pra", "ten", "bel"]
+FILLERS = ["um", "uh", "you know", "like"]
+WORDS = ("the we our can for this that next week call team price plan send demo quote deal contract "
+         "meeting follow up review budget timeline about with will should would could yes sure okay").split()
+
+
+def make_name(rng: random.Random, parts: int) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(parts)).capitalize()
+
+
+def make_metadata(rng: random.Random, n_entities: int) -> Dict[str, Any]:
+    """People, companies and locations (split roughly 3:1:1), unique within the call."""
+    names: set = set()
+    while len(names) < n_entities:
+        names.add(make_name(rng, rng.randint(2, 3)) + ("" if rng.random() < 0.7 else " " + make_name(rng, 2)))
+    names_list = sorted(names)
+    rng.shuffle(names_list)
+    n_people = max(1, n_entities * 3 // 5)
+    n_companies = max(1, (n_entities - n_people) // 2)
+    return {
+        "people": names_list[:n_people],
+        "companies": names_list[n_people:n_people + n_companies],
+        "locations": names_list[n_people + n_companies:],
+    }
+
+
+def misspell(rng: random.Random, word: str) -> str:
+    """ASR-style corruption: lowercase, plus a dropped, doubled or swapped letter."""
+    w = word.lower()
+    if len(w) < 4:
+        return w
+    i = rng.randrange(1, len(w) - 1)
+    op = rng.choice(("drop", "double", "swap"))
+    if op == "drop":
+        return w[:i] + w[i + 1:]
+    if op == "double":
+        return w[:i] + w[i] + w[i:]
+    return w[:i - 1] + w[i] + w[i - 1] + w[i + 1:]
+
+
+def make_transcript(rng: random.Random, metadata: Dict[str, Any], n_segments: int, tokens: int,
+                    entity_rate: float = 0.08, filler_rate: float = 0.05) -> List[Dict[str, Any]]:
+    """Segments of ~`tokens` words with misspelled entity mentions and fillers sprinkled in."""
+    entities = [e for group in metadata.values() for e in group]
+    segments: List[Dict[str, Any]] = []
+    t = 0.0
+    for i in range(n_segments):
+        words: List[str] = []
+        while len(words) < tokens:
+            r = rng.random()
+            if entities and r < entity_rate:
+                words.extend(misspell(rng, w) for w in rng.choice(entities).split())
+            elif r < entity_rate + filler_rate:
+                words.extend(rng.choice(FILLERS).split())
+            else:
+                words.append(rng.choice(WORDS))
+        duration = 0.35 * len(words)
+        segments.append({
+            "start_timestamp": round(t, 2),
+            "end_timestamp": round(t + duration, 2),
+            "is_seller": i % 2 == 0,
+            "language": "en",
+            "speaker": "Seller" if i % 2 == 0 else "Buyer",
+            "speaker_id": i % 2,
+            "text": " ".join(words),
+        })
+        t += duration
+    return segments
+
+
+def make_requests(size: str, n: int, seed: int) -> List[Dict[str, Any]]:
+    n_segments, n_entities, tokens = SIZES[size]
+    rng = random.Random(f"{seed}:{size}")
+    out = []
+    for _ in range(n):
+        metadata = make_metadata(rng, n_entities)
+        out.append({"transcript": make_transcript(rng, metadata, n_segments, tokens), "metadata": metadata})
+    return out
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Linear-interpolated percentile (p in 0..100) of unsorted values."""
+    if not values:
+        return 0.0
+    s = sorted(values)
+    k = (len(s) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(s) - 1)
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+
+def bench_stage1(requests_: List[Dict[str, Any]], repeats: int) -> float:
+    """Stage-1 µs per word token, entity indexes prebuilt (as in a warm server)."""
+    from app.core.fuzzy_matcher import WORD_RE, correct_transcript, get_index
+    for r in requests_:
+        get_index(r["metadata"])
+    tokens = sum(len(WORD_RE.findall(seg["text"])) for r in requests_ for seg in r["transcript"]) * repeats
+    started = time.perf_counter()
+    for _ in range(repeats):
+        for r in requests_:
+            correct_transcript([dict(seg) for seg in r["transcript"]], r["metadata"],
+                               add_terminal_period=True, threshold=80.0)
+    return (time.perf_counter() - started) * 1e6 / tokens if tokens else 0.0
+
+
+async def bench_pipeline(app, requests_: List[Dict[str, Any]], concurrency: int,
+                         deadline_ms: Optional[int]) -> Tuple[List[float], float, int]:
+    """Posts every request to /run with `concurrency` in flight; returns latencies (ms), wall time, failures."""
+    import httpx
+    sem = asyncio.Semaphore(max(1, concurrency))
+    latencies: List[float] = []
+    failures = 0
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench",
+                                 timeout=None) as client:
+        async def one(body: Dict[str, Any]):
+            nonlocal failures
+            async with sem:
+                payload = body if deadline_ms is None else {**body, "deadline_ms": deadline_ms}
+                t0 = time.perf_counter()
+                resp = await client.post("/run", json=payload)
+                latencies.append((time.perf_counter() - t0) * 1000)
+                if resp.status_code != 200:
+                    failures += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(b) for b in requests_))
+        return latencies, time.perf_counter() - started, failures
+
+
+def run_size(size: str, args: argparse.Namespace) -> Dict[str, Any]:
+    from main import app
+    from app.core.metrics import SEGMENTS, DEADLINE_EXCEEDED, METADATA_TOKENS
+
+    requests_ = make_requests(size, args.requests, args.seed)
+    n_segments = sum(len(r["transcript"]) for r in requests_)
+    fake = _install_fake(args)
+
+    stage1_us = bench_stage1(requests_, args.stage1_repeats)
+    # Warm-up request: imports, index builds, first-call overheads stay out of the numbers
+    asyncio.run(bench_pipeline(app, requests_[:1], 1, args.deadline_ms))
+    calls0, errors0 = fake.calls, fake.errors
+    fallback0, deadline0 = SEGMENTS.value(source="fallback"), DEADLINE_EXCEEDED.value()
+    full0, sent0 = METADATA_TOKENS.value(kind="full"), METADATA_TOKENS.value(kind="sent")
+
+    latencies, wall, failures = asyncio.run(bench_pipeline(app, requests_, args.concurrency, args.deadline_ms))
+    calls = fake.calls - calls0
+    full, sent = METADATA_TOKENS.value(kind="full") - full0, METADATA_TOKENS.value(kind="sent") - sent0
+    return {
+        "requests": len(requests_),
+        "segments": n_segments,
+        "throughput_rps": round(len(requests_) / wall, 2),
+        "segments_per_s": round(n_segments / wall, 1),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "llm_calls_per_segment": round(calls / n_segments, 3),
+        # Estimated metadata tokens in Step-2 prompts, after compaction
+        "metadata_tokens_per_segment": round(sent / n_segments, 1),
+        "metadata_tokens_saved_pct": round(100 * (full - sent) / full, 1) if full else 0.0,
+        "injected_errors": fake.errors - errors0,
+        "fallback_segments": int(SEGMENTS.value(source="fallback") - fallback0),
+        "deadline_exceeded": int(DEADLINE_EXCEEDED.value() - deadline0),
+        "http_failures": failures,
+        "stage1_us_per_token": round(stage1_us, 3),
+    }
+
+
+def _install_fake(args: argparse.Namespace):
+    """Step2Gemini wired to a FakeGeminiClient and an unlimited scheduler; returns the fake's models."""
+    from app.core.gemini_client import Step2Gemini
+    from app.core.rate_limit import GeminiScheduler
+    from app.core.step2_backends import set_backend
+    from app.utils.fake_gemini import FakeGeminiClient, FakeModels
+
+    models = FakeModels(latency_s=args.latency_ms / 1000.0, jitter_s=args.jitter_ms / 1000.0,
+                        error_rate=args.error_rate, error_code=args.error_code, seed=args.seed)
+    # Client-side quota would measure the limiter, not the pipeline; retries/backoff stay as configured
+    gemini = Step2Gemini(api_key="offline-benchmark", cache=None, scheduler=GeminiScheduler(rpm=0, tpm=0))
+    gemini.client = FakeGeminiClient(models=models)
+    set_backend("gemini", gemini)
+    return models
+
+
+def git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def settings(args: argparse.Namespace) -> Dict[str, Any]:
+    """Flags that change the workload; baselines are only comparable when these match."""
+    keys = ("requests", "concurrency", "latency_ms", "jitter_ms", "error_rate", "error_code",
+            "seed", "deadline_ms", "batch_size", "gate")
+    return {k: getattr(args, k) for k in keys}
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Human-readable lines; those starting with "REGRESSION" fail the run."""
+    lines: List[str] = []
+    if baseline.get("settings") != report["settings"]:
+        lines.append(f"note: settings differ from baseline ({baseline.get('settings')})")
+    for size, res in report["results"].items():
+        base = baseline.get("results", {}).get(size)
+        if base is None:
+            lines.append(f"{size}: not in baseline")
+            continue
+        for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            old, new = base.get(metric), res.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change > tolerance if metric in LOWER_IS_BETTER else change < -tolerance
+            tag = "REGRESSION" if worse else "ok"
+            lines.append(f"{tag:<10} {size:<7} {metric:<22} {old:>10} -> {new:<10} ({change:+.1%})")
+    return lines
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Offline pipeline benchmark against an in-memory Gemini stand-in.")
+    p.add_argument("--sizes", default="small,medium", help=f"Comma-separated presets: {', '.join(SIZES)}")
+    p.add_argument("--requests", type=int, default=20, help="Transcripts per size")
+    p.add_argument("--concurrency", type=int, default=4, help="/run requests in flight")
+    p.add_argument("--latency-ms", type=float, default=50.0, help="Fake Gemini latency per call")
+    p.add_argument("--jitter-ms", type=float, default=20.0, help="Extra uniform latency per call")
+    p.add_argument("--error-rate", type=float, default=0.0, help="Share of fake calls that fail")
+    p.add_argument("--error-code", type=int, default=503, help="HTTP code of injected failures (429, 5xx)")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--deadline-ms", type=int, default=None, help="deadline_ms per request (default: server default)")
+    p.add_argument("--batch-size", type=int, default=None, help="STEP2_BATCH_SIZE for the run")
+    p.add_argument("--gate", choices=("on", "off"), default=None, help="Force the Step-2 gate (default: env)")
+    p.add_argument("--stage1-repeats", type=int, default=3, help="Passes over the corpus for the Stage-1 timing")
+    p.add_argument("--save", help="Write the report here as a baseline")
+    p.add_argument("--compare", help="Baseline JSON to compare against")
+    p.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative regression (0.10 = 10%%)")
+    args = p.parse_args(argv)
+    unknown = [s for s in args.sizes.split(",") if s not in SIZES]
+    if unknown:
+        p.error(f"unknown size(s): {', '.join(unknown)}")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    # Read by the orchestrator / gate at import time, so set before the app is imported
+    if args.batch_size is not None:
+        os.environ["STEP2_BATCH_SIZE"] = str(args.batch_size)
+    if args.gate is not None:
+        os.environ["STEP2_GATE_ENABLED"] = "true" if args.gate == "on" else "false"
+
+    from app.core.hitl_queue import get_queue
+    hitl = get_queue()
+    hitl.start()
+    try:
+        results = {size: run_size(size, args) for size in args.sizes.split(",")}
+    finally:
+        hitl.stop()
+        shutil.rmtree(_HITL_DIR, ignore_errors=True)
+
+    report = {"commit": git_commit(), "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "settings": settings(args), "results": results}
+    print(json.dumps(report, indent=2))
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            lines = compare(report, json.load(f), args.tolerance)
+        print("\n".join(lines))
+        if any(line.startswith("REGRESSION") for line in lines):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,310 @@
+# scripts/bulk_correct.py
+# Offline bulk correction: JSONL transcripts in, JSONL corrected transcripts + HITL rows out.
+#
+#   python scripts/bulk_correct.py transcripts.jsonl corrected.jsonl
+#
+# Each input line is a PipelineRequest ({"transcript": [...], "metadata": {...}}, or a
+# "metadata_id" from METADATA_REGISTRY_DIR instead of "metadata") with an optional "id"
+# (defaults to the line number). The output file doubles as the checkpoint: a rerun skips
+# every id already written there, so an interrupted job resumes where it stopped. HITL
+# rows are flushed before their output lines, so a crash can at worst repeat the HITL
+# rows of the last unfinished checkpoint.
+#
+# --batch-api sends Step 2 through Gemini Batch API jobs (app/core/gemini_batch.py), one job
+# per --batch-api-transcripts transcripts, for backfills where latency does not matter.
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from app.models.schemas_pipeline import PipelineRequest
+from app.core.fuzzy_matcher import correct_transcript
+from app.core.step2_orchestrator import arun_step2
+from app.core.gemini_client import Step2Gemini
+from app.core.step2_backends import BACKENDS, Step2Backend, get_backend
+from app.core.gemini_batch import Step2BatchRunner
+from app.core.csv_store import HitlWriter, append_rows, hitl_row
+from app.core.metadata_registry import MetadataNotFound, get_registry
+
+# Stage-1 worker processes (0 = os.cpu_count())
+BULK_WORKERS = int(os.getenv("BULK_WORKERS", "0"))
+# Transcripts in flight at once (Stage 1 queued or Step 2 running)
+BULK_MAX_INFLIGHT = int(os.getenv("BULK_MAX_INFLIGHT", "16"))
+# Per-transcript Gemini concurrency; total in flight is at most inflight x this
+BULK_STEP2_CONCURRENCY = int(os.getenv("BULK_STEP2_CONCURRENCY", "4"))
+# Finished transcripts written (and HITL flushed) per checkpoint
+BULK_CHECKPOINT_EVERY = int(os.getenv("BULK_CHECKPOINT_EVERY", "50"))
+# --batch-api: transcripts whose segments go into one Gemini batch job
+BULK_BATCH_API_TRANSCRIPTS = int(os.getenv("BULK_BATCH_API_TRANSCRIPTS", "500"))
+
+
+def stage1(seg_dicts: List[Dict[str, Any]], metadata: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], List[str], List[List[Dict[str, Any]]]]:
+    """Runs in a worker process; the entity index cache is per process."""
+    stage1 = correct_transcript(seg_dicts, metadata, add_terminal_period=True, threshold=80.0)
+    texts: List[str] = []
+    changes: List[List[Dict[str, Any]]] = []
+    for seg, s1 in zip(seg_dicts, stage1):
+        seg["text"] = s1["text"]
+        texts.append(s1["text"])
+        changes.append(s1.get("_stage1_changes", []))
+    return seg_dicts, texts, changes
+
+
+def load_done(out_path: str) -> Set[str]:
+    """IDs already in the output file; a torn last line (crash mid-write) is ignored."""
+    done: Set[str] = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(str(json.loads(line)["id"]))
+            except (ValueError, KeyError, TypeError):
+                continue
+    return done
+
+
+def drop_torn_tail(out_path: str):
+    """Cuts a crash's unterminated last line, so the next record doesn't get appended onto it."""
+    if not os.path.exists(out_path):
+        return
+    with open(out_path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        # Scan backwards for the last newline; the file itself can be large
+        end = size
+        while end > 0:
+            start = max(0, end - 65536)
+            f.seek(start)
+            pos = f.read(end - start).rfind(b"\n")
+            if pos != -1:
+                f.truncate(start + pos + 1)
+                return
+            end = start
+        f.truncate(0)
+
+
+def read_records(in_path: str, done: Set[str]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    with open(in_path, encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                raw = json.loads(line)
+            except ValueError as e:
+                raw = {"error": f"invalid json: {e}"}
+            rid = str(raw.get("id", lineno)) if isinstance(raw, dict) else str(lineno)
+            if rid not in done:
+                yield rid, raw
+
+
+class Checkpointer:
+    """Collects finished transcripts and writes them (HITL rows first) in blocks."""
+
+    def __init__(self, out_path: str, writer: HitlWriter, every: int):
+        drop_torn_tail(out_path)
+        self.out = open(out_path, "a", encoding="utf-8")
+        self.writer = writer
+        self.every = max(1, every)
+        self.pending: List[Tuple[Dict[str, Any], List[Dict[str, Any]]]] = []
+        self.written = 0
+
+    def add(self, record: Dict[str, Any], rows: List[Dict[str, Any]]):
+        self.pending.append((record, rows))
+        if len(self.pending) >= self.every:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        for _, rows in self.pending:
+            append_rows(rows, writer=self.writer, flush=False)
+        self.writer.flush()
+        self.out.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r, _ in self.pending))
+        self.out.flush()
+        os.fsync(self.out.fileno())
+        self.written += len(self.pending)
+        self.pending.clear()
+
+    def close(self):
+        self.flush()
+        self.out.close()
+
+
+Prepared = Tuple[PipelineRequest, List[Dict[str, Any]], List[str], List[List[Dict[str, Any]]]]
+
+
+async def prepare(rid: str, raw: Dict[str, Any], pool: ProcessPoolExecutor) -> Tuple[Optional[Dict[str, Any]], Optional[Prepared]]:
+    """Validates one input line and runs its Stage 1; returns (error_record, None) or (None, prepared)."""
+    if "error" in raw and "transcript" not in raw:
+        return {"id": rid, "error": raw["error"]}, None
+    try:
+        req = PipelineRequest.model_validate(raw)
+    except Exception as e:
+        return {"id": rid, "error": f"invalid request: {e}"}, None
+    if req.metadata_id is not None:
+        try:
+            req.metadata = get_registry().get(req.metadata_id).metadata
+        except MetadataNotFound as e:
+            return {"id": rid, "error": e.args[0]}, None
+
+    seg_dicts = [seg.model_dump() for seg in req.transcript]
+    loop = asyncio.get_running_loop()
+    seg_dicts, stage1_texts, stage1_changes = await loop.run_in_executor(pool, stage1, seg_dicts, req.metadata)
+    return None, (req, seg_dicts, stage1_texts, stage1_changes)
+
+
+def finish(rid: str, prepared: Prepared, results: List[Any], warnings: List[str]) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    req, seg_dicts, stage1_texts, _ = prepared
+    final: List[Dict[str, Any]] = []
+    rows: List[Dict[str, Any]] = []
+    sources: Dict[str, int] = {}
+    for idx, (seg, res) in enumerate(zip(seg_dicts, results)):
+        final.append({**seg, "text": res.text})
+        edits_dicts = [e.model_dump(by_alias=True) for e in res.edits]
+        rows.append(hitl_row(idx, seg, stage1_texts[idx], res.text, res.source, edits_dicts, warnings, req.metadata))
+        sources[res.source] = sources.get(res.source, 0) + 1
+    return {"id": rid, "transcript": final, "warnings": warnings, "sources": sources}, rows
+
+
+async def correct_one(rid: str,
+                      raw: Dict[str, Any],
+                      pool: ProcessPoolExecutor,
+                      gemini: Optional[Step2Backend],
+                      step2_concurrency: int) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    error, prepared = await prepare(rid, raw, pool)
+    if error is not None:
+        return error, []
+    req, seg_dicts, stage1_texts, stage1_changes = prepared
+
+    if gemini is None:
+        # --stage1-only: Stage-1 text is the output
+        return {"id": rid, "transcript": seg_dicts, "warnings": [], "sources": {}}, []
+
+    results, warnings = await arun_step2(
+        gemini=gemini,
+        metadata=req.metadata,
+        transcript_segments=seg_dicts,
+        step1_texts=stage1_texts,
+        step1_changes=stage1_changes,
+        max_concurrency=step2_concurrency,
+    )
+    return finish(rid, prepared, results, warnings)
+
+
+async def correct_group(group: List[Tuple[str, Dict[str, Any]]],
+                        pool: ProcessPoolExecutor,
+                        runner: Step2BatchRunner) -> List[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+    """--batch-api: Stage 1 for the whole group, then one Gemini batch job for all of its segments."""
+    prepped = await asyncio.gather(*(prepare(rid, raw, pool) for rid, raw in group))
+    ok = [(rid, p) for (rid, _), (err, p) in zip(group, prepped) if err is None]
+    batch_out = await asyncio.to_thread(
+        runner.run, [(p[0].metadata, p[1], p[2], p[3]) for _, p in ok]
+    ) if ok else []
+    finished = {rid: finish(rid, p, results, warnings) for (rid, p), (results, warnings) in zip(ok, batch_out)}
+    return [(err, []) if err is not None else finished[rid] for (rid, _), (err, _) in zip(group, prepped)]
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    done = load_done(args.output)
+    gemini = None if args.stage1_only else get_backend(args.backend)
+    if args.batch_api and gemini is not None and not isinstance(gemini, Step2Gemini):
+        raise SystemExit("--batch-api needs the gemini backend")
+    # The Gemini client is built lazily; fail here rather than fall back on every segment
+    if isinstance(gemini, Step2Gemini) and not gemini.provider.configured:
+        raise SystemExit("GEMINI_API_KEY NOT FOUND (use --stage1-only or GEMINI_OFFLINE=1)")
+    writer = HitlWriter()
+    ckpt = Checkpointer(args.output, writer, args.checkpoint_every)
+    inflight = asyncio.Semaphore(max(1, args.max_inflight))
+    stats = {"skipped": len(done), "written": 0, "errors": 0, "segments": 0,
+             "sources": {}, "with_warnings": 0}
+    started = time.perf_counter()
+
+    def record(record: Dict[str, Any], rows: List[Dict[str, Any]]):
+        if "error" in record:
+            stats["errors"] += 1
+        else:
+            stats["segments"] += len(record["transcript"])
+            stats["with_warnings"] += bool(record["warnings"])
+            for k, v in record["sources"].items():
+                stats["sources"][k] = stats["sources"].get(k, 0) + v
+        ckpt.add(record, rows)
+
+    async def handle(rid: str, raw: Dict[str, Any]):
+        try:
+            out = await correct_one(rid, raw, pool, gemini, args.step2_concurrency)
+        finally:
+            inflight.release()
+        record(*out)
+
+    workers = args.workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        tasks: Set[asyncio.Task] = set()
+        try:
+            records = read_records(args.input, done)
+            if args.batch_api and gemini is not None:
+                runner = Step2BatchRunner(gemini)
+                while True:
+                    group = list(itertools.islice(records, max(1, args.batch_api_transcripts)))
+                    if not group:
+                        break
+                    for out in await correct_group(group, pool, runner):
+                        record(*out)
+                    ckpt.flush()
+            else:
+                for rid, raw in records:
+                    # Bounded read-ahead: Stage 1 of upcoming transcripts overlaps Step 2 of earlier ones
+                    await inflight.acquire()
+                    task = asyncio.create_task(handle(rid, raw))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                if tasks:
+                    await asyncio.gather(*tasks)
+        finally:
+            ckpt.close()
+            writer.close()
+            if isinstance(gemini, Step2Gemini):
+                await asyncio.to_thread(gemini.close)
+                await gemini.provider.aclose()
+
+    elapsed = time.perf_counter() - started
+    stats["written"] = ckpt.written
+    stats["elapsed_s"] = round(elapsed, 2)
+    stats["transcripts_per_s"] = round(ckpt.written / elapsed, 2) if elapsed else 0.0
+    stats["output"] = os.path.abspath(args.output)
+    return stats
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Bulk transcript correction (Stage 1 + Step 2) with resume.")
+    p.add_argument("input", help="JSONL of PipelineRequest objects (optional \"id\" per line)")
+    p.add_argument("output", help="JSONL of corrected transcripts; also the resume checkpoint")
+    p.add_argument("--workers", type=int, default=BULK_WORKERS, help="Stage-1 processes (0 = all cores)")
+    p.add_argument("--max-inflight", type=int, default=BULK_MAX_INFLIGHT)
+    p.add_argument("--step2-concurrency", type=int, default=BULK_STEP2_CONCURRENCY)
+    p.add_argument("--checkpoint-every", type=int, default=BULK_CHECKPOINT_EVERY)
+    p.add_argument("--backend", choices=sorted(BACKENDS), default=None, help="Step-2 backend (default STEP2_BACKEND)")
+    p.add_argument("--stage1-only", action="store_true", help="Skip Step 2 (no Gemini calls, no HITL rows)")
+    p.add_argument("--batch-api", action="store_true",
+                   help="Run Step 2 as Gemini Batch API jobs (cheaper, hours of latency) instead of live calls")
+    p.add_argument("--batch-api-transcripts", type=int, default=BULK_BATCH_API_TRANSCRIPTS,
+                   help="Transcripts per batch job; each job is checkpointed when it completes")
+    return p.parse_args(argv)
+
+
+if __name__ == "__main__":
+    print(json.dumps(asyncio.run(run(parse_args())), indent=2, ensure_ascii=False))
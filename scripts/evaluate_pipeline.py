@@ -4,13 +4,23 @@ import os
 import time
 import csv
 import json
+import math
 import re
-from typing import Any, Dict, List
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, NamedTuple, Tuple
 import requests
 
 BASE_URL = os.getenv("PIPELINE_BASE_URL", "http://127.0.0.1:8000")
 URL = BASE_URL.rstrip("/") + "/run"
 OUT_CSV = os.getenv("EVAL_OUT_CSV", "./eval_results.csv")
+# Examples posted to the server at once
+EVAL_CONCURRENCY = int(os.getenv("EVAL_CONCURRENCY", "4"))
+# Processes for readability scoring (0 = inline); worth it from a few thousand texts
+EVAL_WORKERS = int(os.getenv("EVAL_WORKERS", "0"))
+# Optional JSONL of {"name", "transcript", "metadata"} to evaluate instead of EXAMPLES
+EVAL_EXAMPLES_JSONL = os.getenv("EVAL_EXAMPLES_JSONL", "")
 
 # ---------------------------
 # Readability helpers (FRE, FKGL + ARI, CLI, Fog, SMOG, Dale–Chall, LIX)
@@ -20,25 +30,26 @@ SENT_SPLIT = re.compile(r"[.!?]+")
 WORD_RE = re.compile(r"[A-Za-z]+(?:'[A-Za-z]+)?")
 LETTER_RE = re.compile(r"[A-Za-z]")
 ALNUM_RE = re.compile(r"[A-Za-z0-9]")
+# One scan for everything TextStats needs: words, digits, sentence terminators, anything else
+SCAN_RE = re.compile(r"(?P<word>[A-Za-z]+(?:'[A-Za-z]+)?)|(?P<digit>[0-9])|(?P<end>[.!?]+)|\S")
 
 VOWELS = "aeiouy"
 
-def count_sentences(text: str) -> int:
-    parts = [p for p in SENT_SPLIT.split(text) if p.strip()]
-    return max(1, len(parts))
+METRICS = ("fre", "fkgl", "ari", "cli", "fog", "smog", "dale", "lix")
 
-def count_words(text: str) -> int:
-    return len(WORD_RE.findall(text))
 
-def count_letters(text: str) -> int:
-    return len(LETTER_RE.findall(text))
-
-def count_alnum_chars(text: str) -> int:
-    return len(ALNUM_RE.findall(text))
+class TextStats(NamedTuple):
+    """Counts every readability formula below is built from; one scan of the text."""
+    sentences: int
+    words: int
+    syllables: int
+    polysyllables: int   # words with >= 3 syllables
+    letters: int
+    alnum: int
+    long_words: int      # words with >= 7 characters
 
-def count_long_words_letters(text: str, min_len: int = 7) -> int:
-    return sum(1 for w in WORD_RE.findall(text) if len(w) >= min_len)
 
+@lru_cache(maxsize=100_000)
 def count_syllables_in_word(word: str) -> int:
     w = word.lower()
     if w.endswith("e"):
@@ -52,6 +63,54 @@ def count_syllables_in_word(word: str) -> int:
         prev = is_vowel
     return max(1, groups)
 
+
+def text_stats(text: str) -> TextStats:
+    """
+    Single pass over `text`. Gives the same counts as the count_* helpers:
+    a sentence is a run between terminators with any non-space content,
+    and letters are exactly the letters of WORD_RE words.
+    """
+    sentences = words = syllables = polys = letters = digits = long_words = 0
+    in_sentence = False
+    for m in SCAN_RE.finditer(text):
+        kind = m.lastgroup
+        if kind == "end":
+            if in_sentence:
+                sentences += 1
+                in_sentence = False
+            continue
+        in_sentence = True
+        if kind == "word":
+            w = m.group()
+            n = count_syllables_in_word(w)
+            words += 1
+            syllables += n
+            polys += n >= 3
+            letters += len(w) - w.count("'")
+            long_words += len(w) >= 7
+        elif kind == "digit":
+            digits += 1
+    if in_sentence:
+        sentences += 1
+    return TextStats(max(1, sentences), words, syllables, polys, letters, letters + digits, long_words)
+
+
+def count_sentences(text: str) -> int:
+    parts = [p for p in SENT_SPLIT.split(text) if p.strip()]
+    return max(1, len(parts))
+
+def count_words(text: str) -> int:
+    return len(WORD_RE.findall(text))
+
+def count_letters(text: str) -> int:
+    return len(LETTER_RE.findall(text))
+
+def count_alnum_chars(text: str) -> int:
+    return len(ALNUM_RE.findall(text))
+
+def count_long_words_letters(text: str, min_len: int = 7) -> int:
+    return sum(1 for w in WORD_RE.findall(text) if len(w) >= min_len)
+
 def count_syllables(text: str) -> int:
     return sum(count_syllables_in_word(w) for w in WORD_RE.findall(text))
 
@@ -62,73 +121,52 @@ def safe_div(a: float, b: float) -> float:
     return a / b if b else 0.0
 
 # Flesch Reading Ease (higher = easier)
-def flesch_reading_ease(text: str) -> float:
-    sentences = count_sentences(text)
-    words = count_words(text)
-    syllables = count_syllables(text)
-    if words == 0:
+def fre_from(st: TextStats) -> float:
+    if st.words == 0:
         return 0.0
-    return 206.835 - 1.015 * safe_div(words, sentences) - 84.6 * safe_div(syllables, words)
+    return 206.835 - 1.015 * safe_div(st.words, st.sentences) - 84.6 * safe_div(st.syllables, st.words)
 
 # Flesch–Kincaid Grade Level (lower = easier)
-def fk_grade_level(text: str) -> float:
-    sentences = count_sentences(text)
-    words = count_words(text)
-    syllables = count_syllables(text)
-    if words == 0:
+def fkgl_from(st: TextStats) -> float:
+    if st.words == 0:
         return 0.0
-    return 0.39 * safe_div(words, sentences) + 11.8 * safe_div(syllables, words) - 15.59
+    return 0.39 * safe_div(st.words, st.sentences) + 11.8 * safe_div(st.syllables, st.words) - 15.59
 
-# Automated Readability Index (lower = easier)
-def ari(text: str) -> float:
-    sentences = count_sentences(text)
-    words = count_words(text)
-    chars = count_alnum_chars(text)  # ARI uses letters+numbers
-    if words == 0:
+# Automated Readability Index (lower = easier); letters+numbers per word
+def ari_from(st: TextStats) -> float:
+    if st.words == 0:
         return 0.0
-    return 4.71 * safe_div(chars, words) + 0.5 * safe_div(words, sentences) - 21.43
+    return 4.71 * safe_div(st.alnum, st.words) + 0.5 * safe_div(st.words, st.sentences) - 21.43
 
-# Coleman–Liau Index (lower = easier)
-def coleman_liau(text: str) -> float:
-    words = count_words(text)
-    sentences = count_sentences(text)
-    letters = count_letters(text)  # CLI uses letters per 100 words
-    if words == 0:
+# Coleman–Liau Index (lower = easier); letters and sentences per 100 words
+def cli_from(st: TextStats) -> float:
+    if st.words == 0:
         return 0.0
-    L = safe_div(letters, words) * 100.0
-    S = safe_div(sentences, words) * 100.0
+    L = safe_div(st.letters, st.words) * 100.0
+    S = safe_div(st.sentences, st.words) * 100.0
     return 0.0588 * L - 0.296 * S - 15.8
 
 # Gunning Fog Index (lower = easier)
-def gunning_fog(text: str) -> float:
-    words = count_words(text)
-    sentences = count_sentences(text)
-    complex_words = count_polysyllables(text, min_syllables=3)
-    if words == 0:
+def fog_from(st: TextStats) -> float:
+    if st.words == 0:
         return 0.0
-    asl = safe_div(words, sentences)
-    pcw = safe_div(complex_words, words) * 100.0
+    asl = safe_div(st.words, st.sentences)
+    pcw = safe_div(st.polysyllables, st.words) * 100.0
     return 0.4 * (asl + pcw)
 
 # SMOG (lower = easier); adjusted for arbitrary sentence counts
-def smog(text: str) -> float:
-    sentences = count_sentences(text)
-    polys = count_polysyllables(text, min_syllables=3)
-    if sentences == 0:
+def smog_from(st: TextStats) -> float:
+    if st.sentences == 0:
         return 0.0
     # 1.043 * sqrt(polysyllables * (30/sentences)) + 3.1291
-    import math
-    return 1.043 * math.sqrt(polys * (30.0 / sentences)) + 3.1291
+    return 1.043 * math.sqrt(st.polysyllables * (30.0 / st.sentences)) + 3.1291
 
 # Dale–Chall (approximate): use % polysyllabic words as “difficult”
-def dale_chall_approx(text: str) -> float:
-    words = count_words(text)
-    sentences = count_sentences(text)
-    if words == 0:
+def dale_from(st: TextStats) -> float:
+    if st.words == 0:
         return 0.0
-    difficult = count_polysyllables(text, min_syllables=3)
-    pdw = safe_div(difficult, words) * 100.0
-    asl = safe_div(words, sentences)
+    pdw = safe_div(st.polysyllables, st.words) * 100.0
+    asl = safe_div(st.words, st.sentences)
     # 0.1579*PDW + 0.0496*ASL (+ 3.6365 if PDW > 5%)
     raw = 0.1579 * pdw + 0.0496 * asl
     if pdw > 5.0:
@@ -136,13 +174,64 @@ def dale_chall_approx(text: str) -> float:
     return raw
 
 # LIX (higher = harder): words/sentences + (100*long_words)/words, long words >= 7 letters
-def lix(text: str) -> float:
-    words = count_words(text)
-    sentences = count_sentences(text)
-    long_words = count_long_words_letters(text, min_len=7)
-    if words == 0:
+def lix_from(st: TextStats) -> float:
+    if st.words == 0:
         return 0.0
-    return safe_div(words, sentences) + (100.0 * safe_div(long_words, words))
+    return safe_div(st.words, st.sentences) + (100.0 * safe_div(st.long_words, st.words))
+
+FORMULAS = {
+    "fre": fre_from, "fkgl": fkgl_from, "ari": ari_from, "cli": cli_from,
+    "fog": fog_from, "smog": smog_from, "dale": dale_from, "lix": lix_from,
+}
+
+def readability(text: str) -> Dict[str, float]:
+    """All METRICS for one text from a single TextStats."""
+    st = text_stats(text)
+    return {name: fn(st) for name, fn in FORMULAS.items()}
+
+def _score_chunk(texts: List[str]) -> List[Dict[str, float]]:
+    return [readability(t) for t in texts]
+
+def score_texts(texts: Iterable[str], workers: int = EVAL_WORKERS, chunk_size: int = 2000) -> List[Dict[str, float]]:
+    """
+    readability() for many texts: duplicates (e.g. segments the pipeline left
+    unchanged) are scored once, and with workers > 0 chunks go to a process pool.
+    """
+    texts = list(texts)
+    unique = list(dict.fromkeys(texts))
+    chunks = [unique[i:i + chunk_size] for i in range(0, len(unique), chunk_size)]
+    if workers > 0 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            scored = [r for chunk in pool.map(_score_chunk, chunks) for r in chunk]
+    else:
+        scored = [r for chunk in chunks for r in _score_chunk(chunk)]
+    by_text = dict(zip(unique, scored))
+    return [by_text[t] for t in texts]
+
+# Per-metric entry points (each builds its own TextStats; use readability() for several)
+def flesch_reading_ease(text: str) -> float:
+    return fre_from(text_stats(text))
+
+def fk_grade_level(text: str) -> float:
+    return fkgl_from(text_stats(text))
+
+def ari(text: str) -> float:
+    return ari_from(text_stats(text))
+
+def coleman_liau(text: str) -> float:
+    return cli_from(text_stats(text))
+
+def gunning_fog(text: str) -> float:
+    return fog_from(text_stats(text))
+
+def smog(text: str) -> float:
+    return smog_from(text_stats(text))
+
+def dale_chall_approx(text: str) -> float:
+    return dale_from(text_stats(text))
+
+def lix(text: str) -> float:
+    return lix_from(text_stats(text))
 
 # ---------------------------
 # Examples (4 provided + 5 additional)
@@ -280,16 +369,57 @@ EXAMPLES: List[Dict[str, Any]] = [
     }
 ]
 
+_local = threading.local()
+
+def _session() -> requests.Session:
+    # One connection pool per worker thread (Session is not thread-safe)
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+    return _local.session
+
 def post_run(transcript: List[Dict[str, Any]], metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
-    resp = requests.post(URL, json={"transcript": transcript, "metadata": metadata}, timeout=120)
+    resp = _session().post(URL, json={"transcript": transcript, "metadata": metadata}, timeout=120)
     resp.raise_for_status()
     return resp.json()
 
+def run_example(ex: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], float]:
+    """Corrected segments and ms per segment for one example."""
+    start = time.perf_counter()
+    result = post_run(ex["transcript"], ex["metadata"])
+    elapsed = (time.perf_counter() - start) * 1000.0
+    return result, elapsed / max(1, len(result))
+
+def load_examples() -> List[Dict[str, Any]]:
+    if not EVAL_EXAMPLES_JSONL:
+        return EXAMPLES
+    with open(EVAL_EXAMPLES_JSONL, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return [{"name": r.get("name", f"line {i}"), **r} for i, r in enumerate(rows, 1)]
+
 def evaluate() -> None:
     os.makedirs(os.path.dirname(OUT_CSV) or ".", exist_ok=True)
-    # Expanded CSV header
+    examples = load_examples()
+
+    # Examples run concurrently; results come back in example order
+    with ThreadPoolExecutor(max_workers=max(1, EVAL_CONCURRENCY)) as pool:
+        outputs = list(pool.map(run_example, examples))
+
+    pairs: List[Tuple[str, int, str, str, float]] = []
+    for ex, (result, per_seg_ms) in zip(examples, outputs):
+        for i, seg in enumerate(result):
+            pairs.append((ex["name"], i, ex["transcript"][i]["text"], seg["text"], per_seg_ms))
+
+    # Every before/after text scored in one batch (one TextStats each)
+    scores = score_texts([t for _, _, before, after, _ in pairs for t in (before, after)])
+
+    total_segments = 0
+    durations_ms: List[float] = []
+    # For mean deltas
+    acc_deltas: Dict[str, List[float]] = {m: [] for m in METRICS}
+
     with open(OUT_CSV, "w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
+        # Expanded CSV header
         writer.writerow([
             "example", "segment_index",
             "before_text", "after_text",
@@ -307,77 +437,26 @@ def evaluate() -> None:
             "duration_ms_per_segment"
         ])
 
-    total_segments = 0
-    durations_ms: List[float] = []
-    # For mean deltas
-    acc_deltas: Dict[str, List[float]] = {
-        "fre": [], "fkgl": [], "ari": [], "cli": [], "fog": [], "smog": [], "dale": [], "lix": []
-    }
-
-    for ex in EXAMPLES:
-        before_texts = [seg["text"] for seg in ex["transcript"]]
-        start = time.perf_counter()
-        result = post_run(ex["transcript"], ex["metadata"])
-        elapsed = (time.perf_counter() - start) * 1000.0
-        per_seg_ms = elapsed / max(1, len(result))
-
-        with open(OUT_CSV, "a", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            for i, seg in enumerate(result):
-                before = before_texts[i]
-                after = seg["text"]
-
-                # Before metrics
-                fre_b = flesch_reading_ease(before)
-                fk_b = fk_grade_level(before)
-                ari_b = ari(before)
-                cli_b = coleman_liau(before)
-                fog_b = gunning_fog(before)
-                smog_b = smog(before)
-                dale_b = dale_chall_approx(before)
-                lix_b = lix(before)
-
-                # After metrics
-                fre_a = flesch_reading_ease(after)
-                fk_a = fk_grade_level(after)
-                ari_a = ari(after)
-                cli_a = coleman_liau(after)
-                fog_a = gunning_fog(after)
-                smog_a = smog(after)
-                dale_a = dale_chall_approx(after)
-                lix_a = lix(after)
-
-                # Deltas (after - before); note: for FKGL/Fog/SMOG/Dale/LIX lower is easier
-                d_fre = fre_a - fre_b
-                d_fk = fk_a - fk_b
-                d_ari = ari_a - ari_b
-                d_cli = cli_a - cli_b
-                d_fog = fog_a - fog_b
-                d_smg = smog_a - smog_b
-                d_dal = dale_a - dale_b
-                d_lix = lix_a - lix_b
-
-                writer.writerow([
-                    ex["name"], i,
-                    before, after,
-                    f"{fre_b:.2f}", f"{fk_b:.2f}", f"{fre_a:.2f}", f"{fk_a:.2f}", f"{d_fre:.2f}", f"{d_fk:.2f}",
-                    f"{ari_b:.2f}", f"{cli_b:.2f}", f"{ari_a:.2f}", f"{cli_a:.2f}", f"{d_ari:.2f}", f"{d_cli:.2f}",
-                    f"{fog_b:.2f}", f"{smog_b:.2f}", f"{fog_a:.2f}", f"{smog_a:.2f}", f"{d_fog:.2f}", f"{d_smg:.2f}",
-                    f"{dale_b:.2f}", f"{dale_a:.2f}", f"{d_dal:.2f}",
-                    f"{lix_b:.2f}", f"{lix_a:.2f}", f"{d_lix:.2f}",
-                    f"{per_seg_ms:.2f}"
-                ])
-
-                total_segments += 1
-                durations_ms.append(per_seg_ms)
-                acc_deltas["fre"].append(d_fre)
-                acc_deltas["fkgl"].append(d_fk)
-                acc_deltas["ari"].append(d_ari)
-                acc_deltas["cli"].append(d_cli)
-                acc_deltas["fog"].append(d_fog)
-                acc_deltas["smog"].append(d_smg)
-                acc_deltas["dale"].append(d_dal)
-                acc_deltas["lix"].append(d_lix)
+        for n, (name, i, before, after, per_seg_ms) in enumerate(pairs):
+            b, a = scores[2 * n], scores[2 * n + 1]
+            # Deltas (after - before); note: for FKGL/Fog/SMOG/Dale/LIX lower is easier
+            d = {m: a[m] - b[m] for m in METRICS}
+
+            writer.writerow([
+                name, i,
+                before, after,
+                f"{b['fre']:.2f}", f"{b['fkgl']:.2f}", f"{a['fre']:.2f}", f"{a['fkgl']:.2f}", f"{d['fre']:.2f}", f"{d['fkgl']:.2f}",
+                f"{b['ari']:.2f}", f"{b['cli']:.2f}", f"{a['ari']:.2f}", f"{a['cli']:.2f}", f"{d['ari']:.2f}", f"{d['cli']:.2f}",
+                f"{b['fog']:.2f}", f"{b['smog']:.2f}", f"{a['fog']:.2f}", f"{a['smog']:.2f}", f"{d['fog']:.2f}", f"{d['smog']:.2f}",
+                f"{b['dale']:.2f}", f"{a['dale']:.2f}", f"{d['dale']:.2f}",
+                f"{b['lix']:.2f}", f"{a['lix']:.2f}", f"{d['lix']:.2f}",
+                f"{per_seg_ms:.2f}"
+            ])
+
+            total_segments += 1
+            durations_ms.append(per_seg_ms)
+            for m in METRICS:
+                acc_deltas[m].append(d[m])
 
     def mean(vals: List[float]) -> float:
         return sum(vals) / max(1, len(vals))
@@ -398,5 +477,5 @@ def evaluate() -> None:
     print(json.dumps(summary, indent=2, ensure_ascii=False))
 
 if __name__ == "__main__":
-    print(f"POST {URL}")
+    print(f"POST {URL} (concurrency {EVAL_CONCURRENCY})")
     evaluate()
@@ -0,0 +1,8 @@
+import os, sys, tempfile
+
+# HITL CSV paths are read at import time; keep test runs out of the working tree
+_tmp = tempfile.mkdtemp(prefix="hitl-tests-")
+for _var, _name in (("HITL_REVIEW_CSV", "reviews"), ("HITL_ACCEPTED_CSV", "accepted"), ("HITL_METADATA_CSV", "metadata")):
+    os.environ.setdefault(_var, os.path.join(_tmp, f"hitl_{_name}.csv"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
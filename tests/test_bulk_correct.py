@@ -0,0 +1,64 @@
+import csv, json, os, subprocess, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+METADATA = {"people": ["Rohit"], "companies": ["Pepsales"]}
+LONG = "so um we talked to rohit about the pepsales rollout and the budget for next quarter looks fine"
+
+
+def _record(rid, n=2):
+    transcript = [{"speaker": "A", "speaker_id": 1, "start_timestamp": i, "end_timestamp": i + 1,
+                   "is_seller": False, "language": None, "text": f"{LONG} {i}"} for i in range(n)]
+    return {"id": rid, "transcript": transcript, "metadata": METADATA}
+
+
+def _run(tmp_path, inp, out):
+    env = {**os.environ, "GEMINI_OFFLINE": "1", "STEP2_BACKEND": "gemini", "STEP2_CACHE_ENABLED": "0",
+           "HITL_REVIEW_CSV": str(tmp_path / "review.csv"), "HITL_ACCEPTED_CSV": str(tmp_path / "accepted.csv"),
+           "HITL_METADATA_CSV": str(tmp_path / "metadata.csv")}
+    proc = subprocess.run([sys.executable, os.path.join(ROOT, "scripts", "bulk_correct.py"), str(inp), str(out),
+                           "--workers", "1", "--checkpoint-every", "2"],
+                          env=env, cwd=str(tmp_path), capture_output=True, text=True, timeout=120)
+    assert proc.returncode == 0, proc.stderr
+    return json.loads(proc.stdout)
+
+
+def _hitl_rows(tmp_path):
+    rows = 0
+    for name in ("review.csv", "accepted.csv"):
+        path = tmp_path / name
+        if path.exists():
+            with open(path, newline="", encoding="utf-8") as f:
+                rows += sum(1 for _ in csv.reader(f)) - 1
+    return rows
+
+
+def test_rerun_skips_written_ids(tmp_path):
+    inp, out = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    inp.write_text("".join(json.dumps(_record(r)) + "\n" for r in ("a", "b", "c")), encoding="utf-8")
+
+    first = _run(tmp_path, inp, out)
+    assert (first["skipped"], first["written"], first["errors"]) == (0, 3, 0)
+    assert first["sources"] == {"llm": 6}
+    assert _hitl_rows(tmp_path) == 6
+
+    # A crash mid-write leaves a torn last line; only that id and the new one are redone
+    lines = out.read_text(encoding="utf-8").splitlines()
+    out.write_text("\n".join(lines[:2]) + "\n" + lines[2][:20], encoding="utf-8")
+    with open(inp, "a", encoding="utf-8") as f:
+        f.write(json.dumps(_record("d")) + "\n")
+
+    second = _run(tmp_path, inp, out)
+    assert (second["skipped"], second["written"]) == (2, 2)
+    assert _hitl_rows(tmp_path) == 10
+
+    third = _run(tmp_path, inp, out)
+    assert (third["skipped"], third["written"]) == (4, 0)
+    assert _hitl_rows(tmp_path) == 10
+
+    ids = []
+    for line in out.read_text(encoding="utf-8").splitlines():
+        try:
+            ids.append(json.loads(line)["id"])
+        except ValueError:
+            continue
+    assert sorted(ids) == ["a", "b", "c", "d"]
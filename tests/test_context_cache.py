@@ -0,0 +1,82 @@
+import asyncio
+
+from app.core import gemini_client
+from app.core.context_cache import ContextCache
+from app.core.gemini_client import Step2Gemini
+from app.utils.fake_gemini import FakeCaches, FakeGeminiClient, FakeModels
+
+METADATA = {"people": ["Rohit"], "companies": ["Pepsales"]}
+
+
+class Recorder:
+    def __init__(self):
+        self.payloads = []
+
+    def __call__(self, payload):
+        self.payloads.append(payload)
+        return {"text": payload["segment"]["stage1_text"], "edits": []}
+
+
+def _gemini(caches, min_tokens, responder):
+    g = Step2Gemini(api_key="test", cache=None, scheduler=None, context_cache=None)
+    g.client = FakeGeminiClient(models=FakeModels(responder=responder), caches=caches)
+    g.context_cache = ContextCache(lambda: g.client, g.model, min_tokens=min_tokens)
+    return g
+
+
+def test_default_minimum_keeps_instruction_inline():
+    caches, seen = FakeCaches(min_tokens=1024), Recorder()
+    g = _gemini(caches, 1024, seen)
+    assert g.refine_segment(METADATA, "hi rohit", "hi Rohit", []) == {"text": "hi Rohit", "edits": []}
+    assert caches.creates == 0
+    assert g.context_cache.stats()["inline"] == 1
+    assert seen.payloads[-1]["metadata"] == METADATA
+
+
+def test_handle_created_and_reused():
+    caches, seen = FakeCaches(min_tokens=100), Recorder()
+    g = _gemini(caches, 100, seen)
+    g.refine_segment(METADATA, "a", "a", [])
+    g.refine_segment(METADATA, "b", "b", [])
+    stats = g.context_cache.stats()
+    assert caches.creates == 1 and stats["creates"] == 1 and stats["hits"] == 1
+
+
+def test_metadata_cached_with_instruction(monkeypatch):
+    monkeypatch.setattr(gemini_client, "CONTEXT_CACHE_METADATA", True)
+    caches, seen = FakeCaches(min_tokens=100), Recorder()
+    g = _gemini(caches, 100, seen)
+    prompt, _ = g._prompts(METADATA, "a", "a", [], cached=True)
+    assert '"metadata"' not in prompt
+    g.refine_segment(METADATA, "a", "a", [])
+    (entry,) = caches.entries.values()
+    # The fake model sees the metadata from the handle, not from the prompt
+    assert entry["metadata"] == METADATA and seen.payloads[-1]["metadata"] == METADATA
+
+
+def test_create_failure_falls_back_inline():
+    # The service rejects the create (below its minimum) although our estimate cleared ours
+    caches, seen = FakeCaches(min_tokens=10 ** 6), Recorder()
+    g = _gemini(caches, 1, seen)
+    assert g.refine_segment(METADATA, "a", "a", [])["text"] == "a"
+    assert g.refine_segment(METADATA, "b", "b", [])["text"] == "b"
+    stats = g.context_cache.stats()
+    # One failed create, then inline during the retry period without another attempt
+    assert stats["failures"] == 1 and stats["inline"] == 1 and caches.creates == 0
+
+
+def test_stale_handle_is_resent_inline():
+    caches, seen = FakeCaches(min_tokens=100), Recorder()
+    g = _gemini(caches, 100, seen)
+    g.refine_segment(METADATA, "a", "a", [])
+    caches.entries.clear()   # expired / deleted server-side
+    assert asyncio.run(g.arefine_segment(METADATA, "b", "b", []))["text"] == "b"
+    assert g.context_cache.stats()["invalidated"] == 1
+
+
+def test_clear_deletes_handles():
+    caches = FakeCaches(min_tokens=100)
+    g = _gemini(caches, 100, Recorder())
+    g.refine_segment(METADATA, "a", "a", [])
+    g.close()
+    assert caches.entries == {}
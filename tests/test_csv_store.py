@@ -0,0 +1,79 @@
+import csv, os
+
+import pytest
+
+from app.core.csv_store import CSV_HEADERS, METADATA_HEADERS, HitlWriter, append_rows, hitl_row
+
+METADATA = {"people": ["Rohit"]}
+
+
+def _writer(tmp_path):
+    return HitlWriter(review_path=str(tmp_path / "reviews.csv"), accepted_path=str(tmp_path / "accepted.csv"),
+                      metadata_path=str(tmp_path / "metadata.csv"), flush_rows=10_000, flush_interval_s=3600)
+
+
+def _read(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.reader(f))
+
+
+def _rows(n, warnings=()):
+    seg = {"speaker": "A", "speaker_id": 1}
+    return [hitl_row(i, seg, "hello rohit", "Hello Rohit.", "llm", [], list(warnings), METADATA) for i in range(n)]
+
+
+def test_header_and_row_layout(tmp_path):
+    w = _writer(tmp_path)
+    append_rows(_rows(2) + _rows(1, warnings=["step2_error"]), writer=w)
+    accepted, reviews = _read(w.accepted_path), _read(w.review_path)
+    assert accepted[0] == CSV_HEADERS and reviews[0] == CSV_HEADERS
+    assert len(accepted) == 3 and len(reviews) == 2
+    row = dict(zip(CSV_HEADERS, accepted[1]))
+    assert row["step2_text"] == "Hello Rohit." and row["step2_source"] == "llm" and row["review"] == "false"
+    assert all(len(r) == len(CSV_HEADERS) for r in accepted + reviews)
+
+    meta = _read(w.metadata_path)
+    assert meta[0] == METADATA_HEADERS and len(meta) == 2
+    assert meta[1][0] == row["metadata_id"]
+
+
+def test_header_written_once_across_flushes(tmp_path):
+    w = _writer(tmp_path)
+    append_rows(_rows(1), writer=w)
+    append_rows(_rows(1), writer=w)
+    w.close()
+    assert [r for r in _read(w.accepted_path) if r == CSV_HEADERS] == [CSV_HEADERS]
+
+
+def test_outdated_header_is_rotated(tmp_path):
+    w = _writer(tmp_path)
+    old_header = [h for h in CSV_HEADERS if h != "step2_source"]
+    with open(w.accepted_path, "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows([old_header, ["x"] * len(old_header)])
+    append_rows(_rows(1), writer=w)
+
+    assert _read(w.accepted_path)[0] == CSV_HEADERS
+    rotated = [p for p in os.listdir(tmp_path) if p.startswith("accepted.") and p != "accepted.csv"]
+    assert len(rotated) == 1
+    assert _read(tmp_path / rotated[0])[0] == old_header
+
+
+def test_failed_flush_does_not_duplicate_written_blocks(tmp_path, monkeypatch):
+    w = _writer(tmp_path)
+    append_rows(_rows(1) + _rows(1, warnings=["w"]), writer=w, flush=False)
+    real = w._write_block
+
+    def flaky(path, headers, rows):
+        if path == w.review_path:
+            raise OSError("disk full")
+        real(path, headers, rows)
+
+    monkeypatch.setattr(w, "_write_block", flaky)
+    with pytest.raises(OSError):
+        w.flush()
+    monkeypatch.setattr(w, "_write_block", real)
+    w.flush()
+
+    assert len(_read(w.accepted_path)) == 2
+    assert len(_read(w.review_path)) == 2
+    assert len(_read(w.metadata_path)) == 2
@@ -0,0 +1,61 @@
+import asyncio, json, time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import pipeline_routes
+from app.core import step2_backends
+from app.core.deadline import DEADLINE_EXCEEDED, Deadline
+from app.core.gemini_client import Step2Gemini
+from app.core.step2_orchestrator import arun_step2
+from app.utils.fake_gemini import FakeGeminiClient, FakeModels
+
+METADATA = {"people": ["Rohit"], "companies": ["Pepsales"]}
+# Longer than STEP2_GATE_MAX_WORDS, so the LLM gate sends it to the backend
+TEXT = "so um we talked to rohit about the pepsales rollout and the budget for next quarter looks fine"
+
+
+def _gemini(latency_s=0.0):
+    g = Step2Gemini(api_key="test", cache=None, context_cache=None)
+    g.client = FakeGeminiClient(models=FakeModels(latency_s=latency_s))
+    return g
+
+
+def _segment(i):
+    return {"speaker": "A", "speaker_id": 1, "start_timestamp": i, "end_timestamp": i + 1,
+            "is_seller": False, "language": None, "text": TEXT}
+
+
+def test_slow_backend_falls_back_to_stage1_at_deadline():
+    segs = [_segment(i) for i in range(3)]
+    started = time.monotonic()
+    results, warnings = asyncio.run(arun_step2(
+        gemini=_gemini(latency_s=2.0), metadata=METADATA, transcript_segments=segs,
+        step1_texts=[TEXT] * 3, step1_changes=[[], [], []], deadline=Deadline.after_ms(200)))
+    assert time.monotonic() - started < 1.5
+    assert [r.text for r in results] == [TEXT] * 3
+    assert {r.source for r in results} == {"fallback"}
+    assert warnings and all(w.endswith(DEADLINE_EXCEEDED) for w in warnings)
+
+
+def test_stream_deadline_starts_when_request_arrives(monkeypatch):
+    resolve = pipeline_routes.resolve_metadata
+
+    async def slow_resolve(metadata, metadata_id):
+        await asyncio.sleep(0.3)
+        return await resolve(metadata, metadata_id)
+
+    monkeypatch.setattr(pipeline_routes, "resolve_metadata", slow_resolve)
+    monkeypatch.setitem(step2_backends._instances, "gemini", _gemini())
+    app = FastAPI()
+    app.include_router(pipeline_routes.router)
+    body = {"transcript": [_segment(0)], "metadata": METADATA, "backend": "gemini", "deadline_ms": 200}
+    with TestClient(app) as client:
+        resp = client.post("/run/stream", json=body)
+    lines = [json.loads(line) for line in resp.text.splitlines()]
+    summary = lines[-1]
+    # The budget was spent before the headers went out, so nothing reached the backend
+    assert summary["type"] == "summary"
+    assert summary["deadline_exceeded"] == 1
+    assert summary["elapsed_ms"] >= 300
+    assert lines[0]["type"] == "segment" and lines[0]["source"] == "fallback"
@@ -0,0 +1,51 @@
+from app.core import fuzzy_matcher
+from app.core.fuzzy_matcher import EntityIndex, build_canonicals, correct_transcript
+
+METADATA = {
+    "people": ["Rohit", "Samar"],
+    "companies": ["Pepsales"],
+    "locations": ["Chennai", "Bengaluru"],
+    "terms": ["BANT"],
+}
+
+
+def _index():
+    return EntityIndex(build_canonicals(METADATA))
+
+
+def _run(text):
+    return correct_transcript([{"text": text}], METADATA, add_terminal_period=False, index=_index())[0]
+
+
+def test_phonetic_skips_common_words():
+    tokens = ["root", "chain", "band", "bent", "summer"]
+    assert _index().best_phonetic(tokens, 80.0) == {}
+
+
+def test_common_words_unchanged_with_phonetic_on(monkeypatch):
+    monkeypatch.setattr(fuzzy_matcher, "PHONETIC_ENABLED", True)
+    out = _run("the root cause is the supply chain and the band was bent last summer")
+    assert out["text"] == "the root cause is the supply chain and the band was bent last summer"
+    assert out["_stage1_changes"] == []
+
+
+def test_phonetic_match_reports_plain_ratio(monkeypatch):
+    monkeypatch.setattr(fuzzy_matcher, "PHONETIC_ENABLED", True)
+    out = _run("I spoke to roheet today")
+    assert out["text"] == "I spoke to Rohit today"
+    (change,) = out["_stage1_changes"]
+    assert change["reason"] == "phonetic:72"
+
+
+def test_fuzzy_pass_still_corrects_entities():
+    out = _run("we met pepsales in chenai")
+    assert out["text"] == "we met Pepsales in Chennai"
+
+
+def test_empty_index_is_used_not_rebuilt(monkeypatch):
+    def rebuild(metadata):
+        raise AssertionError("passed-in index was replaced")
+
+    monkeypatch.setattr(fuzzy_matcher, "get_index", rebuild)
+    out = correct_transcript([{"text": "hi rohit"}], METADATA, add_terminal_period=False, index=EntityIndex({}))[0]
+    assert out["text"] == "hi rohit"
@@ -0,0 +1,103 @@
+from google.genai import types
+
+from app.core.gemini_batch import Step2BatchRunner, run_step2_batch
+from app.core.gemini_client import Step2Gemini
+from app.core.step2_cache import Step2Cache
+from app.utils.fake_gemini import FakeBatches, FakeGeminiClient, text_response
+
+METADATA = {"people": ["Rohit"]}
+TEXT = "so we talked to Rohit about the rollout and the budget for the next quarter looks fine to me"
+
+
+def upper(payload):
+    return {"text": payload["segment"]["stage1_text"].upper(), "edits": [{"type": "capitalization"}]}
+
+
+def _runner(batches, cache=None, **kwargs):
+    g = Step2Gemini(api_key="test", cache=cache, scheduler=None, context_cache=None)
+    client = FakeGeminiClient(batches=batches)
+    return Step2BatchRunner(g, client=client, poll_interval_s=0, **kwargs)
+
+
+def _item(n, tag=""):
+    segs = [{"speaker": "A", "speaker_id": 1, "text": f"{TEXT} {tag}{i}"} for i in range(n)]
+    return METADATA, segs, [s["text"] for s in segs], [[]] * n
+
+
+def test_job_refines_every_transcript():
+    batches = FakeBatches(responder=upper, polls_until_done=2)
+    runner = _runner(batches)
+    items = [_item(2, "a"), _item(1, "b")]
+    out = runner.run(items, gate=False)
+    for (results, warnings), (_, segs, _, _) in zip(out, items):
+        assert not warnings
+        assert [r.text for r in results] == [s["text"].upper() for s in segs]
+        assert {r.source for r in results} == {"llm"}
+    assert runner.last_job.state == types.JobState.JOB_STATE_SUCCEEDED
+    # One job for both transcripts, polled until it left RUNNING
+    assert len(batches.jobs) == 1
+    assert next(iter(batches.jobs.values()))["polls"] == 3
+
+
+def test_failed_job_falls_back_to_stage1():
+    _, segs, s1, changes = _item(2)
+    results, warnings = run_step2_batch(
+        Step2Gemini(api_key="test", cache=None, scheduler=None, context_cache=None),
+        METADATA, segs, s1, changes, gate=False,
+        client=FakeGeminiClient(batches=FakeBatches(fail_jobs=True, polls_until_done=0)))
+    assert [r.text for r in results] == s1
+    assert {r.source for r in results} == {"fallback"}
+    assert len(warnings) == 2 and all("fake batch failure" in w for w in warnings)
+
+
+def test_errored_request_falls_back_alone():
+    def responder(payload):
+        if payload["segment"]["stage1_text"].endswith(" 1"):
+            raise ValueError("bad request")
+        return upper(payload)
+
+    results, warnings = _runner(FakeBatches(responder=responder, polls_until_done=0)).run([_item(3)], gate=False)[0]
+    assert [r.source for r in results] == ["llm", "fallback", "llm"]
+    assert warnings == ["segment 1: batch error 400: bad request"]
+
+
+def test_invalid_response_falls_back_alone():
+    def responder(payload):
+        if payload["segment"]["stage1_text"].endswith(" 0"):
+            return "not json"
+        if payload["segment"]["stage1_text"].endswith(" 1"):
+            return {"text": "x", "edits": [{"type": "spelling"}]}
+        return upper(payload)
+
+    cache = Step2Cache()
+    results, warnings = _runner(FakeBatches(responder=responder, polls_until_done=0), cache).run([_item(3)], gate=False)[0]
+    assert [r.source for r in results] == ["fallback", "fallback", "llm"]
+    assert [w.split(":")[0] for w in warnings] == ["segment 0", "segment 1"]
+    # Only the valid answer is cached
+    assert cache.stats()["memory_entries"] == 1
+
+
+def test_cached_segments_skip_the_job():
+    batches = FakeBatches(responder=upper, polls_until_done=0)
+    runner = _runner(batches, Step2Cache())
+    first = runner.run([_item(2)], gate=False)[0]
+    second = runner.run([_item(2)], gate=False)[0]
+    assert [r.text for r in second[0]] == [r.text for r in first[0]]
+    assert len(batches.jobs) == 1
+
+
+def test_timeout_cancels_the_job():
+    batches = FakeBatches(responder=upper, polls_until_done=100)
+    results, warnings = _runner(batches, timeout_s=0).run([_item(2)], gate=False)[0]
+    assert {r.source for r in results} == {"fallback"}
+    assert all("still" in w for w in warnings)
+    assert next(iter(batches.jobs.values()))["cancelled"] is True
+
+
+def test_responses_map_by_key_then_position():
+    runner = _runner(FakeBatches())
+    keyed = types.InlinedResponse(metadata={"key": "0:1"}, response=text_response("{}"))
+    unkeyed = types.InlinedResponse(response=text_response("{}"))
+    job = types.BatchJob(name="j", dest=types.BatchJobDestination(inlined_responses=[keyed, unkeyed]))
+    assert runner._responses(job, ["0:0", "0:2"]) == {"0:1": keyed, "0:2": unkeyed}
+    assert runner._responses(types.BatchJob(name="j"), ["0:0"]) == {}
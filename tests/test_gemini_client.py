@@ -0,0 +1,32 @@
+import json
+
+from app.core.gemini_client import Step2Gemini
+from app.utils.fake_gemini import text_response
+
+SEGMENTS = [{"index": i, "original": "", "stage1_text": "", "stage1_changes": []} for i in (3, 4, 5)]
+
+
+def _gemini():
+    return Step2Gemini(api_key="test", cache=None, scheduler=None, context_cache=None)
+
+
+def test_parse_batch_salvages_truncated_output():
+    full = json.dumps({"segments": [{"index": 0, "text": "a", "edits": []}, {"index": 1, "text": "b", "edits": []}]})
+    cut = full[:full.rindex('"b"')]
+    assert _gemini()._parse_batch(full) == [{"index": 0, "text": "a", "edits": []}, {"index": 1, "text": "b", "edits": []}]
+    assert _gemini()._parse_batch(cut) == [{"index": 0, "text": "a", "edits": []}]
+    assert _gemini()._parse_batch("no json here") == []
+
+
+def test_read_batch_keeps_first_valid_entry_per_wanted_index():
+    items = [
+        {"index": 3, "text": "first", "edits": []},
+        {"index": 3, "text": "duplicate", "edits": []},
+        {"index": 9, "text": "out of range", "edits": []},
+        {"index": "x", "text": "bad index", "edits": []},
+        {"index": 4, "text": "no edits"},
+        {"text": "no index", "edits": []},
+        {"index": "5", "text": "string index", "edits": []},
+    ]
+    out = _gemini()._read_batch(text_response(json.dumps({"segments": items})), SEGMENTS)
+    assert out == {3: {"text": "first", "edits": []}, 5: {"text": "string index", "edits": []}}
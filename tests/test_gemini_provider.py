@@ -0,0 +1,73 @@
+import asyncio, os, subprocess, sys, threading
+
+import pytest
+
+from app.core import gemini_provider
+from app.core.gemini_provider import GeminiClientProvider
+from app.utils.fake_gemini import FakeGeminiClient
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class CountingClient:
+    built = 0
+
+    def __init__(self, api_key, http_options):
+        CountingClient.built += 1
+        self.api_key = api_key
+        self.http_options = http_options
+
+
+def test_offline_provider_serves_fake_client():
+    provider = GeminiClientProvider(offline=True)
+    assert provider.configured
+    client = provider.get()
+    assert isinstance(client, FakeGeminiClient)
+    assert provider.get() is client
+
+
+def test_offline_env_switches_process_client():
+    env = {**os.environ, "GEMINI_OFFLINE": "1"}
+    env.pop("GEMINI_API_KEY", None)
+    code = "from app.core.gemini_provider import get_client; print(type(get_client()).__name__)"
+    out = subprocess.run([sys.executable, "-c", code], env=env, cwd=ROOT, capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == "FakeGeminiClient"
+
+
+def test_client_built_once_on_first_use(monkeypatch):
+    monkeypatch.setattr(gemini_provider.genai, "Client", CountingClient)
+    CountingClient.built = 0
+    provider = GeminiClientProvider(api_key="test", offline=False)
+    assert CountingClient.built == 0
+
+    seen = []
+    threads = [threading.Thread(target=lambda: seen.append(provider.get())) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert CountingClient.built == 1
+    assert all(c is seen[0] for c in seen)
+    # The SDK gets the provider's pooled httpx clients
+    assert seen[0].http_options.httpx_client is provider._http
+    assert seen[0].http_options.httpx_async_client is provider._ahttp
+
+
+def test_aclose_releases_pools_and_rebuilds(monkeypatch):
+    monkeypatch.setattr(gemini_provider.genai, "Client", CountingClient)
+    provider = GeminiClientProvider(api_key="test", offline=False)
+    first = provider.get()
+    http, ahttp = provider._http, provider._ahttp
+    asyncio.run(provider.aclose())
+    assert http.is_closed and ahttp.is_closed
+    assert provider._http is None and provider._ahttp is None
+    assert provider.get() is not first
+
+
+def test_missing_key_fails_on_use_not_start(monkeypatch):
+    monkeypatch.delenv("GEMINI_API_KEY", raising=False)
+    provider = GeminiClientProvider(offline=False)
+    assert not provider.configured
+    provider.start()
+    with pytest.raises(RuntimeError, match="GEMINI_API_KEY"):
+        provider.get()
@@ -0,0 +1,64 @@
+import csv, os
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import grammar_routes
+from app.core import hitl_queue, step2_backends
+from app.core.csv_store import CSV_HEADERS, HitlWriter
+from app.core.gemini_client import Step2Gemini
+from app.core.hitl_queue import HitlQueue
+from app.utils.fake_gemini import FakeGeminiClient, FakeModels
+
+METADATA = {"people": ["Rohit"], "companies": ["Pepsales"]}
+LONG = "so um we talked to rohit about the pepsales rollout and the budget for next quarter looks fine"
+
+
+def upper(payload):
+    return {"text": payload["segment"]["stage1_text"].upper(), "edits": [{"type": "grammar"}]}
+
+
+@pytest.fixture
+def writer(tmp_path, monkeypatch):
+    w = HitlWriter(review_path=str(tmp_path / "reviews.csv"), accepted_path=str(tmp_path / "accepted.csv"),
+                   metadata_path=str(tmp_path / "metadata.csv"))
+    monkeypatch.setattr(hitl_queue, "_queue", HitlQueue(writer=w))
+    return w
+
+
+@pytest.fixture
+def client(monkeypatch):
+    g = Step2Gemini(api_key="test", cache=None, scheduler=None, context_cache=None)
+    g.client = FakeGeminiClient(models=FakeModels(responder=upper))
+    monkeypatch.setitem(step2_backends._instances, "gemini", g)
+    app = FastAPI()
+    app.include_router(grammar_routes.router)
+    with TestClient(app) as c:
+        yield c
+
+
+def _read(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+def test_step2_rows_follow_csv_headers(client, writer):
+    texts = [LONG, "Thanks, Rohit."]
+    transcript = [{"speaker": "A", "speaker_id": 1, "start_timestamp": i, "end_timestamp": i + 1,
+                   "is_seller": False, "language": None, "text": t} for i, t in enumerate(texts)]
+    resp = client.post("/step2", json={"transcript": transcript, "step1_changes": [[], []],
+                                       "metadata": METADATA, "backend": "gemini", "deadline_ms": 0})
+    assert resp.status_code == 200
+
+    rows = _read(writer.accepted_path) + _read(writer.review_path)
+    assert len(rows) == 2
+    for row in rows:
+        assert list(row) == CSV_HEADERS
+    by_index = {row["segment_index"]: row for row in rows}
+    assert by_index["0"]["original_text"] == LONG
+    assert by_index["0"]["step2_text"] == LONG.upper()
+    assert by_index["0"]["step2_source"] == "llm" and by_index["0"]["num_edits"] == "1"
+    assert by_index["1"]["step2_text"] == "Thanks, Rohit."
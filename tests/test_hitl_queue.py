@@ -0,0 +1,115 @@
+import asyncio, threading, time
+
+from app.core.csv_store import HitlWriter, hitl_row
+from app.core.hitl_queue import HitlQueue
+
+
+def _writer(tmp_path):
+    return HitlWriter(review_path=str(tmp_path / "reviews.csv"), accepted_path=str(tmp_path / "accepted.csv"),
+                      metadata_path=str(tmp_path / "metadata.csv"))
+
+
+def _rows(n):
+    seg = {"speaker": "A", "speaker_id": 1}
+    return [hitl_row(i, seg, "hi", "Hi.", "llm", [], [], {"people": ["Rohit"]}) for i in range(n)]
+
+
+def _lines(path):
+    with open(path, encoding="utf-8") as f:
+        return f.read().splitlines()
+
+
+def test_stop_drains_and_closes(tmp_path):
+    w = _writer(tmp_path)
+    q = HitlQueue(writer=w)
+    q.start()
+    for _ in range(5):
+        assert q.submit(_rows(2))
+    assert q.stop() is True
+    assert len(_lines(w.accepted_path)) == 11
+    assert w._handles == {}
+    assert q.stats()["written_rows"] == 10
+
+
+def test_submit_after_stop_is_written_inline(tmp_path):
+    w = _writer(tmp_path)
+    q = HitlQueue(writer=w)
+    q.start()
+    q.stop()
+    assert q.submit(_rows(1))
+    assert len(_lines(w.accepted_path)) == 2
+
+
+def test_stop_timeout_leaves_writer_open(tmp_path, monkeypatch):
+    w = _writer(tmp_path)
+    q = HitlQueue(writer=w)
+    release = threading.Event()
+    real_flush = w.flush
+
+    def slow_flush():
+        release.wait(5)
+        real_flush()
+
+    monkeypatch.setattr(w, "flush", slow_flush)
+    q.start()
+    q.submit(_rows(1))
+    time.sleep(0.05)
+
+    closed = []
+    monkeypatch.setattr(w, "close", lambda: closed.append(True))
+    started = time.monotonic()
+    assert q.stop(timeout=0.3) is False
+    assert time.monotonic() - started < 1.0
+    assert closed == []
+    release.set()
+
+
+def test_asubmit_without_thread_stays_off_the_loop(tmp_path, monkeypatch):
+    w = _writer(tmp_path)
+    q = HitlQueue(writer=w)
+    release = threading.Event()
+    real_flush = w.flush
+
+    def slow_flush():
+        release.wait(5)
+        real_flush()
+
+    monkeypatch.setattr(w, "flush", slow_flush)
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        t = asyncio.create_task(ticker())
+        started = time.monotonic()
+        accepted = await q.asubmit(_rows(2), timeout=0.2)
+        waited = time.monotonic() - started
+        t.cancel()
+        return accepted, waited, ticks
+
+    accepted, waited, ticks = asyncio.run(run())
+    # Gave up waiting at the deadline while the loop kept running
+    assert accepted and waited < 1.0 and ticks >= 5
+    release.set()
+    for _ in range(100):
+        if q.stats()["written_rows"] == 2:
+            break
+        time.sleep(0.01)
+    assert len(_lines(w.accepted_path)) == 3
+
+
+def test_inline_write_error_is_counted(tmp_path, monkeypatch):
+    w = _writer(tmp_path)
+    q = HitlQueue(writer=w)
+
+    def broken():
+        raise OSError("disk full")
+
+    monkeypatch.setattr(w, "flush", broken)
+    assert asyncio.run(q.asubmit(_rows(1))) is False
+    assert q.stats()["write_errors"] == 1
@@ -0,0 +1,56 @@
+import asyncio
+
+from app.core.fuzzy_matcher import EntityIndex
+from app.core.gemini_client import Step2Gemini
+from app.core.llm_gate import entity_near_misses, local_cleanup, needs_llm
+from app.core.step2_orchestrator import arun_step2
+from app.utils.fake_gemini import FakeGeminiClient, FakeModels
+
+METADATA = {"people": ["Rohit", "Samar"], "companies": ["Pepsales", "Bank of America"]}
+
+
+def test_clean_short_segment_skips_llm():
+    assert needs_llm("Thanks, Rohit.", []) == (False, "")
+
+
+def test_each_heuristic():
+    assert needs_llm("Um, that works.", []) == (True, "filler")
+    assert needs_llm("That that works.", []) == (True, "repeat")
+    assert needs_llm("Thanks, Rohit.", [{"from": "rohith", "to": "Rohit"}]) == (True, "stage1_changes")
+    long = "We " + " ".join(f"Word{chr(97 + i)}" for i in range(12))
+    assert needs_llm(long, [])[1] == "length"
+    assert needs_llm("Yes i can.", []) == (True, "casing")
+    assert needs_llm("we can do that tomorrow.", []) == (True, "casing")
+    assert needs_llm("um i i can", [])[1] == "filler+repeat+casing"
+
+
+def test_local_cleanup_capitalizes_and_punctuates():
+    text, edits = local_cleanup("thanks , Rohit")
+    assert text == "Thanks, Rohit."
+    assert [e["type"] for e in edits] == ["capitalization", "punct"]
+
+
+def test_entity_near_misses():
+    index = EntityIndex.from_metadata(METADATA)
+    texts = ["Thanks, Rohit.", "I spoke with Summer.", "Talk to Rohith.", "See you tomorrow.", "We had summer plans."]
+    assert entity_near_misses(texts, index) == [False, True, True, False, False]
+
+
+def _run(texts, metadata=METADATA):
+    g = Step2Gemini(api_key="test", cache=None, scheduler=None, context_cache=None)
+    g.client = FakeGeminiClient(models=FakeModels())
+    segs = [{"speaker": "A", "speaker_id": 1, "text": t} for t in texts]
+    results, _ = asyncio.run(arun_step2(g, metadata, segs, texts, [[]] * len(texts), gate=True))
+    return [r.source for r in results], g.client.models.calls
+
+
+def test_orchestrator_skips_backend_for_clean_segments():
+    assert _run(["Thanks, Rohit.", "See you tomorrow."]) == (["local", "local"], 0)
+
+
+def test_orchestrator_sends_near_misses_and_flagged_segments():
+    sources, calls = _run(["Thanks, Rohit.", "I spoke with Summer.", "Um, that works."])
+    assert sources == ["local", "llm", "llm"]
+    assert calls == 2
+    # Without metadata only the text heuristics apply
+    assert _run(["I spoke with Summer."], metadata={}) == (["local"], 0)
@@ -0,0 +1,71 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import metadata_routes, pipeline_routes
+from app.core import metadata_registry
+from app.core.metadata_registry import MetadataNotFound, MetadataRegistry
+
+V1 = {"people": ["Rohit"], "companies": ["Pepsales"]}
+V2 = {"people": ["Rohit", "Anubhav"], "companies": ["Pepsales"]}
+
+
+def test_versions_and_latest():
+    registry = MetadataRegistry()
+    first, created = registry.register("acme", V1)
+    assert (first.id, created) == ("acme:v1", True)
+    # Identical metadata keeps the current version
+    assert registry.register("acme", dict(V1)) == (first, False)
+    second, created = registry.register("acme", V2)
+    assert (second.id, created) == ("acme:v2", True)
+    assert registry.get("acme:v1").metadata == V1
+    assert registry.get("acme:latest") is second
+    assert [e.version for e in registry.versions("acme")] == [1, 2]
+
+
+def test_unknown_ids_raise():
+    registry = MetadataRegistry()
+    registry.register("acme", V1)
+    for bad in ("acme:v2", "other:v1", "other:latest", "acme"):
+        with pytest.raises(MetadataNotFound):
+            registry.get(bad)
+    with pytest.raises(MetadataNotFound):
+        registry.versions("other")
+    with pytest.raises(ValueError):
+        registry.register("bad name", V1)
+
+
+def test_resolve_compiles_once_and_persists(tmp_path):
+    registry = MetadataRegistry(directory=str(tmp_path))
+    entry, _ = registry.register("acme", V1)
+    assert registry.resolve(entry.id) is registry.resolve("acme:latest")
+    assert (registry.hits, registry.misses) == (1, 1)
+    reloaded = MetadataRegistry(directory=str(tmp_path))
+    assert reloaded.get("acme:v1").metadata == V1
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(metadata_registry, "_registry", MetadataRegistry())
+    app = FastAPI()
+    app.include_router(metadata_routes.router)
+    app.include_router(pipeline_routes.router)
+    with TestClient(app) as c:
+        yield c
+
+
+def test_routes(client):
+    resp = client.post("/metadata", json={"name": "acme", "metadata": V1})
+    assert resp.status_code == 200 and resp.json()["id"] == "acme:v1"
+    assert client.post("/metadata", json={"name": "acme", "metadata": V2}).json()["created_version"] is True
+    assert client.get("/metadata/acme:v1").json()["metadata"] == V1
+    assert [v["id"] for v in client.get("/metadata/acme").json()["versions"]] == ["acme:v1", "acme:v2"]
+    assert client.post("/metadata", json={"name": "bad name", "metadata": V1}).status_code == 422
+
+
+def test_unknown_metadata_is_404(client):
+    assert client.get("/metadata/acme:v1").status_code == 404
+    assert client.get("/metadata/acme").status_code == 404
+    body = {"transcript": [], "metadata_id": "acme:v3", "backend": "local"}
+    assert client.post("/run", json=body).status_code == 404
+    assert client.post("/run/stream", json=body).status_code == 404
@@ -0,0 +1,75 @@
+import re
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from app.core import step2_backends
+from app.core.gemini_client import Step2Gemini
+from app.utils.fake_gemini import FakeGeminiClient, FakeModels
+
+METADATA = {"people": ["Rohit"]}
+LONG = "so um we talked to rohit about the rollout and the budget for next quarter looks fine to me"
+
+
+def _value(text, name, **labels):
+    """Sample value of `name` with exactly `labels`, or None."""
+    wanted = ",".join(f'{k}="{v}"' for k, v in labels.items())
+    pattern = rf"^{re.escape(name)}{re.escape('{' + wanted + '}') if wanted else ''} (\S+)$"
+    m = re.search(pattern, text, re.MULTILINE)
+    return float(m.group(1)) if m else None
+
+
+@pytest.fixture
+def client(monkeypatch):
+    g = Step2Gemini(api_key="test", cache=None, scheduler=None, context_cache=None)
+    g.client = FakeGeminiClient(models=FakeModels())
+    monkeypatch.setitem(step2_backends._instances, "gemini", g)
+    with TestClient(main.app) as c:
+        yield c
+
+
+def _body(texts):
+    transcript = [{"speaker": "A", "speaker_id": 1, "start_timestamp": i, "end_timestamp": i + 1,
+                   "is_seller": False, "language": None, "text": t} for i, t in enumerate(texts)]
+    return {"transcript": transcript, "metadata": METADATA, "backend": "gemini"}
+
+
+def test_metrics_after_run(client):
+    before = client.get("/metrics").text
+    llm_before = _value(before, "step2_segments_total", source="llm") or 0
+    calls_before = _value(before, "step2_llm_calls_total", kind="segment", outcome="ok") or 0
+    stage1_before = _value(before, "pipeline_stage_seconds_count", stage="stage1") or 0
+
+    assert client.post("/run", json=_body([LONG, "Thanks, Rohit."])).status_code == 200
+    resp = client.get("/metrics")
+    assert resp.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = resp.text
+
+    assert "# TYPE pipeline_stage_seconds histogram" in text
+    assert "# TYPE step2_segments_total counter" in text
+    assert _value(text, "step2_segments_total", source="llm") == llm_before + 1
+    assert _value(text, "step2_segments_total", source="local") >= 1
+    assert _value(text, "step2_llm_calls_total", kind="segment", outcome="ok") == calls_before + 1
+    assert _value(text, "pipeline_stage_seconds_count", stage="stage1") == stage1_before + 1
+    assert _value(text, "pipeline_stage_seconds_bucket", stage="stage1", le="+Inf") is not None
+    # Component stats exported at scrape time
+    assert _value(text, "gemini_breaker_open") is not None
+    assert _value(text, "live_sessions") is not None
+
+
+def _stages(header):
+    return dict(part.split(";dur=") for part in header.split(", "))
+
+
+def test_server_timing_header(client):
+    resp = client.post("/run", json=_body([LONG]))
+    stages = _stages(resp.headers["server-timing"])
+    assert {"stage1", "gate", "gemini", "step2", "total"} <= set(stages)
+    assert all(float(ms) >= 0 for ms in stages.values())
+
+
+def test_server_timing_on_streaming_response(client):
+    resp = client.post("/run/stream", json=_body([LONG]))
+    # Headers go out before any stage runs, so only the total is known
+    assert set(_stages(resp.headers["server-timing"])) == {"total"}
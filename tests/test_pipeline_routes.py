@@ -0,0 +1,68 @@
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import pipeline_routes
+from app.core import step2_backends
+from app.core.gemini_client import Step2Gemini
+from app.utils.fake_gemini import FakeGeminiClient, FakeModels
+
+METADATA = {"people": ["Rohit"], "companies": ["Pepsales"]}
+LONG = "so um we talked to rohit about the pepsales rollout and the budget for next quarter looks fine"
+
+
+def upper(payload):
+    return {"text": payload["segment"]["stage1_text"].upper(), "edits": [{"type": "grammar"}]}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    g = Step2Gemini(api_key="test", cache=None, scheduler=None, context_cache=None)
+    g.client = FakeGeminiClient(models=FakeModels(responder=upper))
+    monkeypatch.setitem(step2_backends._instances, "gemini", g)
+    app = FastAPI()
+    app.include_router(pipeline_routes.router)
+    with TestClient(app) as c:
+        yield c
+
+
+def _segment(i, text):
+    return {"speaker": "A", "speaker_id": 1, "start_timestamp": i, "end_timestamp": i + 1,
+            "is_seller": False, "language": None, "text": text}
+
+
+def test_stream_lines_then_summary(client):
+    texts = [LONG, "Thanks, Rohit.", LONG + " again", "See you tomorrow."]
+    body = {"transcript": [_segment(i, t) for i, t in enumerate(texts)], "metadata": METADATA,
+            "backend": "gemini", "deadline_ms": 0}
+    resp = client.post("/run/stream", json=body)
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in resp.text.splitlines()]
+
+    assert [line["type"] for line in lines] == ["segment"] * 4 + ["summary"]
+    segments = lines[:-1]
+    # Gated segments come first, in input order; LLM ones follow in completion order
+    assert [s["index"] for s in segments[:2]] == [1, 3]
+    assert sorted(s["index"] for s in segments[2:]) == [0, 2]
+    by_index = {s["index"]: s for s in segments}
+    assert by_index[1]["source"] == "local" and by_index[0]["source"] == "llm"
+    assert by_index[0]["segment"]["text"] == by_index[0]["segment"]["text"].upper()
+    assert by_index[0]["edits"] == [{"type": "grammar", "from": None, "to": None, "why": None}]
+    assert all(s["warnings"] == [] for s in segments)
+
+    summary = lines[-1]
+    assert summary["segments"] == 4
+    assert summary["sources"] == {"local": 2, "llm": 2}
+    assert summary["warnings"] == [] and summary["deadline_exceeded"] == 0
+    assert summary["elapsed_ms"] >= 0
+
+
+def test_run_matches_stream(client):
+    texts = [LONG, "Thanks, Rohit."]
+    body = {"transcript": [_segment(i, t) for i, t in enumerate(texts)], "metadata": METADATA, "backend": "gemini"}
+    final = client.post("/run", json=body).json()
+    streamed = [json.loads(line) for line in client.post("/run/stream", json=body).text.splitlines()][:-1]
+    assert [s["text"] for s in final] == [s["segment"]["text"] for s in sorted(streamed, key=lambda s: s["index"])]
@@ -0,0 +1,74 @@
+import os, subprocess, sys
+
+from app.core import prompt_compaction
+from app.core.prompt_compaction import MetadataCompactor, compaction_report
+
+PEOPLE = ["Rohit", "Anubhav", "Priyanka", "Deepak", "Kavitha", "Suresh", "Meenakshi", "Gaurav", "Harpreet",
+          "Lakshmi", "Nikhil", "Oindrila", "Pranav", "Ritika", "Tanmay", "Vikram", "Yamini", "Zubair",
+          "Bhavesh", "Chitra", "Farhan", "Ishaan", "Jyotsna"]
+METADATA = {"people": PEOPLE, "companies": ["Pepsales", "Microsoft"], "locations": ["Bengaluru"]}
+
+
+def _jobs(texts):
+    return [(t, t, []) for t in texts]
+
+
+def test_small_metadata_is_sent_whole():
+    small = {"people": ["Rohit"], "companies": ["Pepsales"]}
+    compactor = MetadataCompactor(small, _jobs(["Talk to Rohit."]), [0])
+    assert not compactor.active
+    assert compactor.for_window([0]) is small
+
+
+def test_window_gets_only_mentioned_entities_in_layout_order():
+    jobs = _jobs(["Deepak from Pepsales called.", "Nothing here.", "Nothing either.", "Yamini is in Bengaluru."])
+    compactor = MetadataCompactor(METADATA, jobs, [0, 3], neighbours=0)
+    assert compactor.active
+    assert compactor.for_window([0]) == {"people": ["Deepak"], "companies": ["Pepsales"]}
+    assert compactor.for_window([3]) == {"people": ["Yamini"], "locations": ["Bengaluru"]}
+    assert compactor.for_window([1]) == {}
+
+
+def test_neighbours_and_context_mentions_are_kept():
+    jobs = _jobs(["Deepak joined.", "He agreed.", "Nothing here."])
+    compactor = MetadataCompactor(METADATA, jobs, [1], context=["Earlier Vikram spoke."], neighbours=1)
+    assert compactor.for_window([1]) == {"people": ["Deepak", "Vikram"]}
+
+
+def test_top_k_keeps_best_scores_first():
+    # "Rohith" is a near match, "Gaurav" and "Pepsales" exact ones
+    jobs = _jobs(["Rohith, Gaurav and Pepsales."])
+    compactor = MetadataCompactor(METADATA, jobs, [0], top_k=2)
+    assert compactor.for_window([0]) == {"people": ["Gaurav"], "companies": ["Pepsales"]}
+    assert set(MetadataCompactor(METADATA, jobs, [0], top_k=16).for_window([0])["people"]) == {"Rohit", "Gaurav"}
+
+
+def test_token_budget_drops_lowest_scores():
+    jobs = _jobs(["Rohith, Gaurav and Pepsales."])
+    base = MetadataCompactor(METADATA, jobs, [0])
+    rest = base._rest_tokens([0])
+    assert MetadataCompactor(METADATA, jobs, [0], budget=rest).for_window([0]) == {}
+    one = MetadataCompactor(METADATA, jobs, [0], budget=rest + 10).for_window([0])
+    assert one == {"people": ["Gaurav"]}
+
+
+def test_report_counts_saved_tokens():
+    jobs = _jobs(["Deepak from Pepsales called."])
+    with compaction_report() as report:
+        MetadataCompactor(METADATA, jobs, [0]).for_window([0])
+    assert report.prompts == 1
+    assert 0 < report.sent_tokens < report.full_tokens
+
+
+def test_disabled_compaction_is_a_no_op(monkeypatch):
+    monkeypatch.setattr(prompt_compaction, "COMPACT_METADATA", False)
+    compactor = MetadataCompactor(METADATA, _jobs(["Deepak called."]), [0])
+    assert compactor.for_window([0]) is METADATA
+
+
+def test_metadata_in_context_cache_turns_compaction_off():
+    env = {**os.environ, "GEMINI_CONTEXT_CACHE": "1", "GEMINI_CONTEXT_CACHE_METADATA": "1"}
+    out = subprocess.run([sys.executable, "-c", "from app.core import prompt_compaction as p; print(p.COMPACT_METADATA)"],
+                         env=env, capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert out.stdout.strip() == "False"
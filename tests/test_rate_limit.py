@@ -0,0 +1,113 @@
+import asyncio, time
+
+import pytest
+
+from app.core.rate_limit import CircuitBreaker, CircuitOpenError, GeminiScheduler, QuotaTimeout
+from app.utils.fake_gemini import api_error
+
+
+def _scheduler(**kw):
+    breaker = CircuitBreaker(failures=2, reset_s=0.05)
+    return GeminiScheduler(rpm=0, tpm=0, max_retries=0, backoff_base_s=0, breaker=breaker, **kw)
+
+
+def _fail(timeout_s):
+    raise api_error(503)
+
+
+def _open(s):
+    for _ in range(2):
+        with pytest.raises(Exception):
+            s.call(_fail)
+    assert s.breaker.state == "open"
+
+
+def test_breaker_opens_and_sheds():
+    s = _scheduler()
+    _open(s)
+    with pytest.raises(CircuitOpenError):
+        s.call(lambda t: "ok")
+    assert s.stats()["shed_breaker"] == 1
+
+
+def test_half_open_probe_closes_on_success():
+    s = _scheduler()
+    _open(s)
+    time.sleep(0.06)
+    assert s.call(lambda t: "ok") == "ok"
+    assert s.breaker.state == "closed"
+
+
+def test_half_open_probe_reopens_on_failure():
+    s = _scheduler()
+    _open(s)
+    time.sleep(0.06)
+    with pytest.raises(Exception):
+        s.call(_fail)
+    assert s.breaker.state == "open"
+
+
+def test_only_one_probe_in_half_open():
+    b = CircuitBreaker(failures=1, reset_s=0)
+    b.failure()
+    assert b.allow() is True
+    with pytest.raises(CircuitOpenError):
+        b.allow()
+
+
+def test_cancelled_probe_releases_slot():
+    s = _scheduler()
+    _open(s)
+    time.sleep(0.06)
+
+    async def hang(timeout_s):
+        await asyncio.sleep(10)
+
+    async def ok(timeout_s):
+        return "ok"
+
+    async def run():
+        task = asyncio.create_task(s.acall(hang))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert s.breaker.state == "half_open"
+        return await s.acall(ok)
+
+    assert asyncio.run(run()) == "ok"
+    assert s.breaker.state == "closed"
+
+
+def test_probe_shed_for_quota_releases_slot():
+    s = GeminiScheduler(rpm=60, tpm=0, quota_wait_s=0, max_retries=0,
+                        breaker=CircuitBreaker(failures=1, reset_s=0))
+    s.requests.reserve(s.requests.capacity, 0)   # drain the request bucket
+    s.breaker.failure()
+    with pytest.raises(QuotaTimeout):
+        s.call(lambda t: "ok")
+    assert s.breaker.state == "half_open"
+    assert s.breaker.allow() is True
+
+
+def test_non_retryable_error_does_not_close_breaker():
+    s = _scheduler()
+    _open(s)
+    time.sleep(0.06)
+
+    def bad_request(timeout_s):
+        raise api_error(400)
+
+    with pytest.raises(Exception):
+        s.call(bad_request)
+    assert s.breaker.state == "half_open"
+
+    def local_error(timeout_s):
+        raise ValueError("unparseable")
+
+    # The slot was freed, so the next call probes again
+    with pytest.raises(ValueError):
+        s.call(local_error)
+    assert s.breaker.state == "half_open"
+    assert s.call(lambda t: "ok") == "ok"
+    assert s.breaker.state == "closed"
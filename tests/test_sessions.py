@@ -0,0 +1,112 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import session_routes
+from app.core import sessions, step2_backends
+from app.core.gemini_client import Step2Gemini
+from app.core.sessions import Session, SessionStore
+from app.utils.fake_gemini import FakeGeminiClient, FakeModels
+
+METADATA = {"people": ["Rohit"], "companies": ["Pepsales"]}
+LONG = "so um we talked to rohit about the pepsales rollout and the budget for next quarter looks fine"
+
+
+class Recorder:
+    def __init__(self):
+        self.contexts = []
+
+    def __call__(self, payload):
+        self.contexts.append(payload.get("context"))
+        return {"text": payload["segment"]["stage1_text"].upper(), "edits": []}
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    seen = Recorder()
+    g = Step2Gemini(api_key="test", cache=None, scheduler=None, context_cache=None)
+    g.client = FakeGeminiClient(models=FakeModels(responder=seen, latency_s=0.05))
+    monkeypatch.setitem(step2_backends._instances, "gemini", g)
+    monkeypatch.setattr(sessions, "_store", SessionStore())
+    return seen
+
+
+def _app():
+    app = FastAPI()
+    app.include_router(session_routes.router)
+    return app
+
+
+def _chunk(start, n, tag=""):
+    return {"transcript": [
+        {"speaker": "A", "speaker_id": 1, "start_timestamp": start + i, "end_timestamp": start + i + 0.5,
+         "is_seller": False, "language": None, "text": f"{LONG} {tag}{i}"}
+        for i in range(n)
+    ]}
+
+
+def test_create_append_close(backend):
+    with TestClient(_app()) as client:
+        info = client.post("/sessions", json={"metadata": METADATA, "backend": "gemini"}).json()
+        sid = info["session_id"]
+        assert info["segments"] == 0 and info["entities"] == 2
+
+        first = client.post(f"/sessions/{sid}/segments", json=_chunk(0, 2)).json()
+        second = client.post(f"/sessions/{sid}/segments", json=_chunk(10, 1, "b")).json()
+        # Offsets continue across chunks; timestamps are the caller's
+        assert (first["offset"], second["offset"]) == (0, 2)
+        assert [s["start_timestamp"] for s in second["transcript"]] == [10]
+        assert second["transcript"][0]["text"].isupper()
+
+        # The first chunk went without context, the second got the first chunk's corrected text
+        assert backend.contexts[:2] == [None, None]
+        assert backend.contexts[2] == [s["text"] for s in first["transcript"]]
+
+        assert client.get(f"/sessions/{sid}").json()["segments"] == 3
+        closed = client.delete(f"/sessions/{sid}").json()
+        assert [s["start_timestamp"] for s in closed["transcript"]] == [0, 1, 10]
+        assert client.get(f"/sessions/{sid}").status_code == 404
+        assert client.delete(f"/sessions/{sid}").status_code == 404
+
+
+def test_concurrent_appends_are_serialized(backend):
+    async def run():
+        transport = httpx.ASGITransport(app=_app())
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            sid = (await client.post("/sessions", json={"metadata": METADATA, "backend": "gemini"})).json()["session_id"]
+            chunks = [_chunk(10 * k, 2, f"c{k}-") for k in range(3)]
+            replies = await asyncio.gather(*(client.post(f"/sessions/{sid}/segments", json=c) for c in chunks))
+            transcript = (await client.get(f"/sessions/{sid}/transcript")).json()["transcript"]
+        return [r.json() for r in replies], transcript
+
+    replies, transcript = asyncio.run(run())
+    assert sorted(r["offset"] for r in replies) == [0, 2, 4]
+    # Each chunk's segments sit together at its offset
+    for r in replies:
+        got = transcript[r["offset"]:r["offset"] + 2]
+        assert [s["start_timestamp"] for s in got] == [s["start_timestamp"] for s in r["transcript"]]
+
+
+def test_unknown_and_expired_sessions_are_404(backend, monkeypatch):
+    with TestClient(_app()) as client:
+        assert client.post("/sessions/nope/segments", json=_chunk(0, 1)).status_code == 404
+        sid = client.post("/sessions", json={"metadata": METADATA}).json()["session_id"]
+        sessions.get_store().ttl_s = 0
+        assert client.get(f"/sessions/{sid}").status_code == 404
+
+
+def test_context_is_trimmed_to_budget():
+    session = Session("s", METADATA, context_segments=3, context_max_chars=10)
+    session.commit([{"text": t} for t in ("aaaa", "bbbb", "cccc", "dddd")])
+    assert session.context() == ["cccc", "dddd"]
+    assert len(session.transcript) == 4
+
+
+def test_store_evicts_oldest_past_max():
+    store = SessionStore(max_sessions=2)
+    ids = [store.create(METADATA).session_id for _ in range(3)]
+    assert store.get(ids[0]) is None
+    assert store.get(ids[2]) is not None and len(store) == 2
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from app.core import step2_backends
+from app.core.step2_backends import LocalStep2Backend, get_backend, loaded_backend, rule_refine, set_backend
+from app.core.step2_orchestrator import arun_step2
+
+
+def _types(result):
+    return [e["type"] for e in result["edits"]]
+
+
+def test_fillers_and_leading_markers_are_dropped():
+    out = rule_refine("so um Dave from AWS mentioned that")
+    assert out["text"] == "Dave from AWS mentioned that."
+    assert _types(out) == ["filler", "filler", "punct"]
+    assert [e["from"] for e in out["edits"][:2]] == ["um", "so"]
+
+
+def test_repeats_and_pronoun():
+    out = rule_refine("um, i think we we need it")
+    assert out["text"] == "I think we need it."
+    assert _types(out) == ["filler", "grammar", "capitalization", "punct"]
+
+
+def test_sentence_starts_and_stray_punctuation():
+    out = rule_refine("you know it works. uh, right")
+    assert out["text"] == "It works. Right."
+    assert rule_refine("hello , okay, uh.")["text"] == "Hello, okay."
+
+
+def test_clean_text_is_kept():
+    out = rule_refine("We met Rohit yesterday.")
+    assert out == {"text": "We met Rohit yesterday.", "edits": []}
+    # "like" and "I mean" can be real words; the local backend keeps them
+    assert rule_refine("I like it.")["text"] == "I like it."
+
+
+def test_local_backend_through_orchestrator():
+    backend = LocalStep2Backend(model_name="")
+    texts = ["so um we we need it by Q1", "Thanks."]
+    segs = [{"speaker": "A", "speaker_id": 1, "text": t} for t in texts]
+    results, warnings = asyncio.run(arun_step2(backend, {}, segs, texts, [[], []], gate=False))
+    assert [r.text for r in results] == ["We need it by Q1.", "Thanks."]
+    assert {r.source for r in results} == {"local_model"} and not warnings
+
+
+def test_backend_selection(monkeypatch):
+    monkeypatch.setattr(step2_backends, "_instances", {})
+    local = get_backend("local")
+    assert isinstance(local, LocalStep2Backend)
+    assert get_backend("LOCAL") is local and loaded_backend("local") is local
+    assert loaded_backend("gemini") is None
+
+    custom = LocalStep2Backend(model_name="")
+    set_backend("gemini", custom)
+    assert get_backend("gemini") is custom
+    with pytest.raises(ValueError):
+        get_backend("nope")
+    with pytest.raises(ValueError):
+        set_backend("nope", custom)
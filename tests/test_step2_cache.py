@@ -0,0 +1,80 @@
+import asyncio
+
+from app.core.gemini_client import Step2Gemini
+from app.core.step2_cache import Step2Cache
+from app.core.step2_orchestrator import arun_step2
+from app.utils.fake_gemini import FakeGeminiClient, FakeModels
+
+METADATA = {"people": ["Rohit"]}
+TEXT = "so we talked to Rohit about the rollout and the budget for the next quarter looks fine to me"
+
+
+class BadOnce:
+    """Returns an edit type Step2Edit rejects on the first call, then valid output."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, payload):
+        self.calls += 1
+        edits = [{"type": "spelling" if self.calls == 1 else "grammar", "from": "a", "to": "b"}]
+        return {"text": payload["segment"]["stage1_text"], "edits": edits}
+
+
+def _gemini(cache, responder):
+    g = Step2Gemini(api_key="test", cache=cache, scheduler=None, context_cache=None)
+    g.client = FakeGeminiClient(models=FakeModels(responder=responder))
+    return g
+
+
+def _run(g, n=1, batch_size=None):
+    segs = [{"speaker": "A", "speaker_id": 1, "text": f"{TEXT} {i}"} for i in range(n)]
+    return asyncio.run(arun_step2(g, METADATA, segs, [s["text"] for s in segs], [[]] * n,
+                                  batch_size=batch_size, gate=False))
+
+
+def echo(payload):
+    return {"text": payload["segment"]["stage1_text"], "edits": []}
+
+
+def test_repeat_request_is_a_cache_hit():
+    cache = Step2Cache()
+    g = _gemini(cache, echo)
+    _run(g)
+    results, warnings = _run(g)
+    assert results[0].source == "llm" and not warnings
+    assert g.client.models.calls == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_invalid_edit_type_is_not_cached():
+    cache = Step2Cache()
+    g = _gemini(cache, BadOnce())
+    first, _ = _run(g)
+    assert first[0].source == "fallback"
+    assert cache.stats()["memory_entries"] == 0
+    second, _ = _run(g)
+    assert second[0].source == "llm"
+    assert g.client.models.calls == 2
+
+
+def test_invalid_batch_entry_is_not_cached():
+    cache = Step2Cache()
+    g = _gemini(cache, BadOnce())
+    # Entry 0 comes back invalid and is retried on its own (valid this time) under the same key
+    results, _ = _run(g, n=2, batch_size=2)
+    assert [r.source for r in results] == ["llm", "llm"]
+    assert cache.stats()["memory_entries"] == 2
+    stored = [cache.get(k) for k in list(cache._mem)]
+    assert all(e["type"] == "grammar" for d in stored for e in d["edits"])
+
+
+def test_sqlite_tier_survives_restart(tmp_path):
+    path = str(tmp_path / "step2.sqlite")
+    _run(_gemini(Step2Cache(sqlite_path=path), echo))
+    fresh = Step2Cache(sqlite_path=path)
+    g2 = _gemini(fresh, echo)
+    results, _ = _run(g2)
+    assert results[0].source == "llm"
+    assert g2.client.models.calls == 0
+    assert fresh.stats()["disk_hits"] == 1
@@ -0,0 +1,53 @@
+from app.core.gemini_client import Step2Gemini
+from app.core.step2_orchestrator import run_step2
+from app.utils.fake_gemini import FakeGeminiClient, FakeModels
+
+METADATA = {"people": ["Rohit"]}
+TEXT = "so we talked to Rohit about the rollout and the budget for the next quarter looks fine to me"
+
+
+def _gemini(responder=None):
+    g = Step2Gemini(api_key="test", cache=None, scheduler=None, context_cache=None)
+    g.client = FakeGeminiClient(models=FakeModels(responder=responder) if responder else FakeModels())
+    return g
+
+
+def _segments(n):
+    return [{"speaker": "A", "speaker_id": 1, "text": f"{TEXT} {i}"} for i in range(n)]
+
+
+def test_sync_wrapper_keeps_order_and_falls_back():
+    def responder(payload):
+        if payload["segment"]["stage1_text"].endswith(" 1"):
+            raise ValueError("boom")
+        return {"text": payload["segment"]["stage1_text"].upper(), "edits": []}
+
+    segs = _segments(3)
+    results, warnings = run_step2(_gemini(responder), METADATA, segs, [s["text"] for s in segs], [[]] * 3, gate=False)
+    assert [r.source for r in results] == ["llm", "fallback", "llm"]
+    assert results[0].text == segs[0]["text"].upper()
+    assert results[1].text == segs[1]["text"]
+    assert len(warnings) == 1 and warnings[0].startswith("segment 1:")
+
+
+def test_batch_retries_only_missing_segments():
+    singles = []
+
+    def responder(payload):
+        seg = payload["segment"]
+        if "segments" in payload:
+            # Batch answer drops segment 1 and mangles segment 2
+            if seg["index"] == 1:
+                return None
+            if seg["index"] == 2:
+                return {"text": seg["stage1_text"], "edits": [{"type": "spelling"}]}
+        else:
+            singles.append(seg["stage1_text"])
+        return {"text": seg["stage1_text"], "edits": []}
+
+    segs = _segments(4)
+    g = _gemini(responder)
+    results, warnings = run_step2(g, METADATA, segs, [s["text"] for s in segs], [[]] * 4, batch_size=4, gate=False)
+    assert [r.source for r in results] == ["llm"] * 4 and not warnings
+    assert singles == [segs[1]["text"], segs[2]["text"]]
+    assert g.client.models.calls == 3